@@ -0,0 +1,442 @@
+"""
+Benchmarks of the hot paths of AdsAPIClient against FakeAdsServer.
+
+Each case runs in a child process with the fake server in another one, so
+the peak RSS and allocations measured are those of the client alone. The
+results are saved as JSON to compare releases of the client. The module is
+run from the directory containing the package, as it uses relative imports,
+e.g., for the package ads_api_impl:
+
+    python -m ads_api_impl.ads_benchmark --output results.json
+    python -m ads_api_impl.ads_benchmark --compare baseline.json results.json
+
+Cases:
+    pagination: _get_entities() of 10k/100k/1M keywords.
+    bulk_update: update_keywords_v2() of keywords in batches.
+    report: get_report() download and parse of a large gzip report.
+    token: _rebuild_auth() per call with a cached token.
+    token_refresh: _rebuild_auth() per call with an expired token.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:     # Not available on Windows.
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:     # Python 2.
+    tracemalloc = None
+
+from .amazon_ads_api import AccessTokenCache
+from .amazon_ads_api import AdsAPIClient
+from .fake_ads_server import FakeAdsServer
+from .report_poller import ReportPoller
+
+
+PROFILE_ID = 1
+REFRESH_TOKEN = 'benchmark-refresh-token'
+
+
+def percentile(values, fraction):
+    """Get a percentile of the values by nearest rank.
+
+    Args:
+        values: float[], sorted.
+        fraction: float, e.g., 0.99.
+    """
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def _to_ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+class BenchmarkError(Exception):
+    """Failure of a child process of the benchmark."""
+    pass
+
+
+def _receive(conn, process, timeout=None):
+    """Receive the result of a child process.
+
+    Args:
+        conn: multiprocessing.Connection, parent end of the pipe.
+        process: multiprocessing.Process, the child.
+        timeout: float, seconds to wait, None to wait while it runs.
+
+    Returns:
+        The object sent by the child.
+
+    Raises:
+        BenchmarkError: the child failed, exited or timed out.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    while not conn.poll(0.1):
+        if not process.is_alive():
+            # It may have sent its result right before exiting.
+            if conn.poll():
+                break
+            raise BenchmarkError('%s exited with code %s.' % (
+                process.name, process.exitcode))
+        if deadline is not None and time.time() > deadline:
+            process.terminate()
+            raise BenchmarkError('%s timed out after %s seconds.' % (
+                process.name, timeout))
+
+    result = conn.recv()
+    if isinstance(result, dict) and 'error' in result:
+        raise BenchmarkError('%s failed:\n%s' % (
+            process.name, result['error']))
+    return result
+
+
+def _serve(conn, options, populate, parent_pid):
+    """Run a fake server in a child process until told to stop, or until
+    its parent exits."""
+    try:
+        server = FakeAdsServer(**options)
+        if populate:
+            server.populate(PROFILE_ID, **populate)
+        else:
+            server.add_profile(PROFILE_ID)
+        server.start()
+    except Exception:
+        conn.send({'error': traceback.format_exc()})
+        return
+
+    try:
+        conn.send(server.port)
+        # The child is re-parented once its parent exits.
+        while not conn.poll(1) and os.getppid() == parent_pid:
+            pass
+    finally:
+        server.stop()
+
+
+class _ServerProcess(object):
+    """Fake server in a child process."""
+
+    _START_TIMEOUT = 600    # Seconds to populate and start the server.
+
+    def __init__(self, options=None, populate=None):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(child_conn, options or {}, populate, os.getpid()))
+        self._process.daemon = True
+        self._process.start()
+        # Only the endpoints are used in this process.
+        self.server = FakeAdsServer(port=_receive(
+            self._conn, self._process, self._START_TIMEOUT))
+
+    def stop(self):
+        if self._process.is_alive():
+            self._conn.send('stop')
+        self._process.join()
+
+
+class _RequestTimer(object):
+    """Record the latency of each request sent by the clients."""
+
+    def __init__(self):
+        self.latencies = []
+        self._send = None
+
+    def start(self):
+        send = self._send = AdsAPIClient.__dict__['_send_scheduled']
+        latencies = self.latencies
+
+        def timed_send(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return send.__func__(*args, **kwargs)
+            finally:
+                latencies.append(time.time() - start_time)
+
+        AdsAPIClient._send_scheduled = staticmethod(timed_send)
+
+    def stop(self):
+        AdsAPIClient._send_scheduled = self._send
+
+
+def _make_client():
+    """Build a client of the benchmark profile with a fresh token."""
+    return AdsAPIClient(PROFILE_ID, 'US', 'benchmark-access-token',
+                        REFRESH_TOKEN, AccessTokenCache.now())
+
+
+def _prepare_pagination(params):
+    client = _make_client()
+    return lambda: len(client._get_entities(
+        'keywords/extended', page_workers=params['page_workers']))
+
+
+def _prepare_bulk_update(params):
+    client = _make_client()
+    keyword_ids = [k['keywordId'] for k in client._get_entities(
+        AdsAPIClient.ENTITY_TYPE_BIDDABLE_KEYWORDS, page_workers=4)]
+    data = [AdsAPIClient.get_keyword_to_update(k, bid=0.5 + k % 10 * 0.1)
+            for k in keyword_ids]
+    return lambda: len(client.update_keywords_v2(data))
+
+
+def _prepare_report(params):
+    client = _make_client()
+    # Measure the download and parse rather than the polling interval, and
+    # let the fake server generate the report once, out of the timed run.
+    AdsAPIClient._report_poller = ReportPoller(min_interval=0.01)
+    client.get_report('keywords', '20180101')
+    return lambda: len(client.get_report('keywords', '20180101'))
+
+
+def _prepare_token(params):
+    client = _make_client()
+
+    def run():
+        for _ in range(params['calls']):
+            client._rebuild_auth()
+        return params['calls']
+    return run
+
+
+def _prepare_token_refresh(params):
+    client = _make_client()
+
+    def run():
+        for _ in range(params['refreshes']):
+            AdsAPIClient._token_cache.invalidate(REFRESH_TOKEN)
+            client.token_time = 0   # Expire the token of the client.
+            client._rebuild_auth()
+        return params['refreshes']
+    return run
+
+
+# Preparation of the timed function, fake server options and fake data of
+# each case.
+CASES = {
+    'pagination': (_prepare_pagination, lambda params: ({}, {
+        'campaigns': 10, 'adgroups': 10,
+        'keywords': params['entities'] // 100})),
+    'bulk_update': (_prepare_bulk_update, lambda params: ({}, {
+        'campaigns': 10, 'adgroups': 10,
+        'keywords': params['keywords'] // 100})),
+    'report': (_prepare_report, lambda params: (
+        {'report_rows': params['rows']}, None)),
+    'token': (_prepare_token, lambda params: ({}, None)),
+    'token_refresh': (_prepare_token_refresh, lambda params: ({}, None)),
+}
+
+
+def _measure(conn, case, params, trace_allocations):
+    """Run a case in a child process and send its measurements, or the
+    traceback of its failure."""
+    try:
+        conn.send(_measure_case(case, params, trace_allocations))
+    except Exception:
+        conn.send({'error': traceback.format_exc()})
+
+
+def _measure_case(case, params, trace_allocations):
+    """Run a case and get its measurements."""
+    prepare, setup = CASES[case]
+    options, populate = setup(params)
+    server_process = _ServerProcess(options, populate)
+    server_process.server.install(AdsAPIClient)
+    AdsAPIClient.configure_rate_limits(region=1e6, profile=1e6)
+    timer = _RequestTimer()
+    try:
+        run = prepare(params)
+        if trace_allocations and tracemalloc:
+            tracemalloc.start()
+        timer.start()
+        start_time = time.time()
+        items = run()
+        seconds = time.time() - start_time
+        timer.stop()
+        allocated = None
+        if trace_allocations and tracemalloc:
+            allocated = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        server_process.server.uninstall()
+        server_process.stop()
+
+    latencies = sorted(timer.latencies)
+    peak_rss = None
+    if resource:
+        # Kilobytes on Linux, bytes on macOS.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak_rss *= 1024
+    return {
+        'case': case,
+        'params': params,
+        'seconds': seconds,
+        'items': items,
+        'items_per_second': items / seconds if seconds else None,
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'latency_p50_ms': _to_ms(percentile(latencies, 0.5)),
+        'latency_p99_ms': _to_ms(percentile(latencies, 0.99)),
+        'peak_rss_bytes': peak_rss,
+        'peak_allocated_bytes': allocated,
+    }
+
+
+def run_case(case, params, trace_allocations=False, timeout=None):
+    """Run a benchmark case in a child process.
+
+    Allocations are traced in a separate run, since tracing slows down the
+    timed run.
+
+    Args:
+        case: string, name of the case, refer to CASES.
+        params: dict, parameters of the case.
+        trace_allocations: boolean, if True, measure the peak allocated
+            memory with tracemalloc (Python 3 only).
+        timeout: float, seconds a run may take, None for no limit.
+
+    Returns:
+        A dict of measurements.
+
+    Raises:
+        BenchmarkError: the case failed, its process exited or timed out.
+    """
+    def measure(trace):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_measure, args=(child_conn, case, params, trace))
+        process.start()
+        try:
+            return _receive(conn, process, timeout)
+        finally:
+            process.join()
+
+    result = measure(False)
+    if trace_allocations and tracemalloc:
+        result['peak_allocated_bytes'] = measure(True)[
+            'peak_allocated_bytes']
+    return result
+
+
+def run(cases, sizes, page_workers, update_keywords, report_rows,
+        token_calls, token_refreshes, trace_allocations=True, timeout=None):
+    """Run the benchmark cases.
+
+    Refer to run_case() for the timeout of each case.
+
+    Returns:
+        A dict of the environment and of the results of the cases.
+    """
+    plans = {
+        'pagination': [dict(entities=size, page_workers=workers)
+                       for size in sizes for workers in page_workers],
+        'bulk_update': [dict(keywords=update_keywords)],
+        'report': [dict(rows=report_rows)],
+        'token': [dict(calls=token_calls)],
+        'token_refresh': [dict(refreshes=token_refreshes)],
+    }
+    results = []
+    for case in cases:
+        for params in plans[case]:
+            result = run_case(case, params, trace_allocations, timeout)
+            print('%-13s %-40s %8.2fs %10.0f items/s %8.0f req/s '
+                  'p50 %.1fms p99 %.1fms' % (
+                      case, json.dumps(params, sort_keys=True),
+                      result['seconds'], result['items_per_second'] or 0,
+                      result['requests_per_second'] or 0,
+                      result['latency_p50_ms'] or 0,
+                      result['latency_p99_ms'] or 0))
+            results.append(result)
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(baseline, current):
+    """Compare the results of two runs case by case.
+
+    Args:
+        baseline: dict, results of run().
+        current: dict, results of run().
+
+    Returns:
+        A list of (case, params, metric, baseline, current, ratio).
+    """
+    def key(result):
+        return (result['case'], json.dumps(result['params'], sort_keys=True))
+
+    baseline_results = dict((key(r), r) for r in baseline['results'])
+    rows = []
+    for result in current['results']:
+        before = baseline_results.get(key(result))
+        if not before:
+            continue
+        for metric in ('items_per_second', 'latency_p99_ms',
+                       'peak_rss_bytes', 'peak_allocated_bytes'):
+            if before.get(metric) and result.get(metric) is not None:
+                rows.append(key(result) + (
+                    metric, before[metric], result[metric],
+                    result[metric] / float(before[metric])))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark AdsAPIClient against a local fake server.')
+    parser.add_argument('--cases', default=','.join(sorted(CASES)),
+                        help='comma separated cases to run')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='entities of the pagination cases')
+    parser.add_argument('--page-workers', default='1,4',
+                        help='concurrent pages of the pagination cases')
+    parser.add_argument('--update-keywords', type=int, default=10000)
+    parser.add_argument('--report-rows', type=int, default=200000)
+    parser.add_argument('--token-calls', type=int, default=100000)
+    parser.add_argument('--token-refreshes', type=int, default=1000)
+    parser.add_argument('--no-allocations', action='store_true',
+                        help='skip the run tracing allocations')
+    parser.add_argument('--timeout', type=float,
+                        help='seconds each case may run, no limit by default')
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--compare', nargs=2,
+                        metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        for row in compare(baseline, current):
+            print('%-13s %-40s %-22s %12.1f %12.1f %6.2fx' % row)
+        return
+
+    results = run(
+        args.cases.split(','), [int(s) for s in args.sizes.split(',')],
+        [int(w) for w in args.page_workers.split(',')],
+        args.update_keywords, args.report_rows, args.token_calls,
+        args.token_refreshes, not args.no_allocations, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,24 +3,228 @@ Implementation of Amazon Advertising API. Refer to:
 https://advertising.amazon.com/API
 """
 from collections import defaultdict
+from collections import deque
 from datetime import datetime
-from gzip import GzipFile
-from io import BytesIO
+from multiprocessing.pool import ThreadPool
 import json
 import logging
+import random
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+try:
+    from Queue import Full
+    from Queue import Queue
+    from urllib import urlencode
+    from urlparse import urlparse
+except ImportError:     # Python 3.
+    from queue import Full
+    from queue import Queue
+    from urllib.parse import urlencode
+    from urllib.parse import urlparse
+
+from .rate_limiter import RequestScheduler
+from .report_columns import ColumnarReport
+from .report_poller import ReportFuture
+from .report_poller import ReportPoller
+from .report_stream import iter_gzip_json_array
+from .request_metrics import REQUEST_METRICS
+from .token_store import TokenRefresher
+
 
 logger = logging.getLogger(__name__)
 
+# The settings (param) and the timezone utilities are provided by the host
+# application; defaults let the client run standalone, e.g., in benchmarks.
+try:
+    param
+except NameError:
+    param = {}
+
+try:
+    timezone
+except NameError:
+    timezone = None
+
+try:
+    long
+except NameError:   # Python 3.
+    long = int
+
 
 class AdsAPIError(Exception):
     """General error."""
     pass
 
 
+class AccessTokenCache(object):
+    """Thread-safe cache of access tokens keyed by refresh token.
+
+    Refresh is single-flight: when a token expires, exactly one caller
+    requests a new one while the others wait and reuse its result. With a
+    token store, the tokens are also shared with (and refreshed once across)
+    other processes.
+    """
+
+    def __init__(self, lifetime=55 * 60, store=None):
+        """
+        Args:
+            lifetime: int, seconds an access token is used before refresh.
+            store: TokenStore, shared store of tokens across processes.
+        """
+        self.lifetime = lifetime
+        self.store = store
+        # Time requests spent waiting on a token refresh.
+        self.stats = {'refresh_waits': 0, 'refresh_wait_seconds': 0.0}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def now():
+        """Get the current time (UTC) in the format of token time."""
+        now = timezone.now() if timezone else datetime.utcnow()
+        return time.mktime(now.timetuple())
+
+    def is_fresh(self, token_time, ahead=0):
+        """Check if a token issued at the token time is still usable.
+
+        Args:
+            token_time: float, in UTC time.
+            ahead: int, seconds the token must still be usable for.
+        """
+        return bool(token_time) and (
+            self.now() + ahead <= float(token_time) + self.lifetime)
+
+    def get(self, refresh_token, fetch_token, access_token=None,
+            token_time=None):
+        """Get a fresh access token, refreshing it when expired.
+
+        Args:
+            refresh_token: string.
+            fetch_token: callable, takes the refresh token and returns
+                a new (access_token, token_time).
+            access_token: string, token known by the caller.
+            token_time: float, in UTC time.
+
+        Returns:
+            Access token and token time (UTC).
+        """
+        token = self.peek(refresh_token, access_token, token_time)
+        if token[0]:
+            return token
+
+        entry = self._get_entry(refresh_token)
+        start_time = time.time()
+        token = self._refresh_entry(entry, refresh_token, fetch_token)
+        with self._lock:
+            self.stats['refresh_waits'] += 1
+            self.stats['refresh_wait_seconds'] += time.time() - start_time
+        return token
+
+    def peek(self, refresh_token, access_token=None, token_time=None):
+        """Get the cached access token without refreshing it.
+
+        Args:
+            refresh_token: string.
+            access_token: string, token known by the caller.
+            token_time: float, in UTC time.
+
+        Returns:
+            Access token and token time (UTC), (None, None) if expired.
+        """
+        entry = self._get_entry(refresh_token)
+        if access_token and token_time and (
+                not entry['token'][1] or
+                float(token_time) > entry['token'][1]):
+            entry['token'] = (access_token, float(token_time))
+        token = entry['token']
+        if token[0] and self.is_fresh(token[1]):
+            return token
+        return (None, None)
+
+    def put(self, refresh_token, access_token, token_time, save=True):
+        """Cache an access token refreshed by the caller, e.g., from an
+        event loop, and save it to the store.
+
+        Args:
+            refresh_token: string.
+            access_token: string.
+            token_time: float, in UTC time.
+            save: boolean, False if the caller saved it to the store.
+        """
+        entry = self._get_entry(refresh_token)
+        entry['token'] = (access_token, float(token_time))
+        if self.store and save:
+            self.store.save(refresh_token, access_token, token_time)
+
+    def refresh_ahead(self, refresh_token, fetch_token, ahead):
+        """Refresh the access token if it expires within the given time.
+
+        Args:
+            refresh_token: string.
+            fetch_token: callable, refer to get().
+            ahead: int, seconds the token must still be usable for.
+
+        Returns:
+            Access token and token time (UTC).
+        """
+        entry = self._get_entry(refresh_token)
+        token = entry['token']
+        if token[0] and self.is_fresh(token[1], ahead):
+            return token
+
+        return self._refresh_entry(entry, refresh_token, fetch_token, ahead)
+
+    def _refresh_entry(self, entry, refresh_token, fetch_token, ahead=0):
+        """Refresh the token of the cache entry once across callers."""
+        with entry['lock']:
+            # Another caller may have refreshed while this one was waiting.
+            token = entry['token']
+            if not (token[0] and self.is_fresh(token[1], ahead)):
+                token = self._refresh(refresh_token, fetch_token, ahead)
+                entry['token'] = token
+        return token
+
+    def _refresh(self, refresh_token, fetch_token, ahead=0):
+        """Get the token of the store if fresh, otherwise fetch a new one."""
+        store = self.store
+        if not store:
+            return fetch_token(refresh_token)
+
+        token = store.load(refresh_token)
+        if token[0] and self.is_fresh(token[1], ahead):
+            return token
+
+        with store.lock(refresh_token):
+            # Another process may have refreshed while this one was waiting.
+            token = store.load(refresh_token)
+            if not (token[0] and self.is_fresh(token[1], ahead)):
+                token = fetch_token(refresh_token)
+                store.save(refresh_token, token[0], token[1])
+        return token
+
+    def invalidate(self, refresh_token):
+        """Drop the cached access token of the refresh token.
+
+        Args:
+            refresh_token: string.
+        """
+        with self._lock:
+            self._tokens.pop(refresh_token, None)
+
+    def _get_entry(self, refresh_token):
+        """Get the cache entry of the refresh token, create it if missing."""
+        with self._lock:
+            entry = self._tokens.get(refresh_token)
+            if entry is None:
+                entry = {'lock': threading.Lock(), 'token': (None, None)}
+                self._tokens[refresh_token] = entry
+        return entry
+
+
 class AdsAPIClient(object):
     """API reference: https://advertising.amazon.com/API
     """
@@ -32,9 +236,27 @@ class AdsAPIClient(object):
     ENTITY_TYPE_PROFILES = 'profiles'
     ENTITY_TYPE_REPORTS = 'reports'
 
+    # ID field of each type of entity.
+    _ENTITY_ID_FIELDS = {
+        ENTITY_TYPE_AD_GROUPS: 'adGroupId',
+        ENTITY_TYPE_CAMPAIGNS: 'campaignId',
+        ENTITY_TYPE_BIDDABLE_KEYWORDS: 'keywordId',
+        ENTITY_TYPE_NEGATIVE_KEYWORDS: 'keywordId',
+        ENTITY_TYPE_PRODUCT_ADS: 'adId',
+    }
+
     MIN_DAILY_BUDGET = 1.0
     MIN_BID = 0.02
 
+    REPORT_METRICS = (
+        'impressions,clicks,cost,attributedConversions1dSameSKU,'
+        'attributedConversions1d,attributedSales1dSameSKU,'
+        'attributedSales1d,attributedConversions7dSameSKU,'
+        'attributedConversions7d,attributedSales7dSameSKU,'
+        'attributedSales7d,attributedConversions30dSameSKU,'
+        'attributedConversions30d,attributedSales30dSameSKU,'
+        'attributedSales30d')
+
     _API_ENDPOINT_EU = 'https://advertising-api-eu.amazon.com/v1/%s'
     _API_ENDPOINT_NA = 'https://advertising-api.amazon.com/v1/%s'
     _API_ENDPOINT_TEST = 'https://advertising-api-test.amazon.com/v1/%s'
@@ -53,6 +275,59 @@ class AdsAPIClient(object):
     }
 
     _PAGE_SIZE = 1000           # 5000 entities by default.
+    _PAGE_WORKERS = 1           # Pages fetched concurrently, 1: serially.
+    # Queries of a URL longer than this are split into sub-queries of the
+    # IDs of their ID filters, run concurrently.
+    _MAX_URL_LENGTH = 4000
+    _PAGING_PARAMS_LENGTH = 64  # Room left in the URL for startIndex/count.
+    _SPLIT_WORKERS = 4          # Sub-queries run concurrently.
+    _SPLIT_QUEUE_SIZE = 2       # Pages buffered per sub-query running.
+    _BATCH_SIZE = 1000          # Maximum entities per mutation request.
+    _BATCH_WORKERS = 4          # Mutation requests sent concurrently.
+    _BATCH_RETRIES = 3          # Retries of the entities failed transiently.
+    _BATCH_RETRY_DELAY = 1.0    # Seconds before the first retry, doubled.
+
+    # Error codes of per-entity results which are worth a retry. HTTP status
+    # codes are used by the entities of a failed batch.
+    _RETRYABLE_ERROR_CODES = frozenset([
+        'INTERNAL_ERROR', 'SERVER_IS_BUSY', 'SERVICE_UNAVAILABLE',
+        'THROTTLED', 'TOO_MANY_REQUESTS', '429', '500', '502', '503', '504',
+    ])
+    # Creations are only retried on the codes which guarantee nothing was
+    # written, a created entity would be duplicated otherwise.
+    _RETRYABLE_CREATE_ERROR_CODES = frozenset([
+        'THROTTLED', 'TOO_MANY_REQUESTS', '429',
+    ])
+
+    # Connection pools of the HTTP sessions shared per regional endpoint.
+    _POOL_CONNECTIONS = 10      # Number of hosts to keep pools for.
+    _POOL_MAXSIZE = 20          # Maximum keep-alive connections per host.
+    _POOL_BLOCK = True          # Wait for a free connection at the limit.
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    # Access tokens shared by all clients of the process.
+    _token_cache = AccessTokenCache()
+    _token_refresher = TokenRefresher()
+    _TOKEN_REFRESH_AHEAD = 5 * 60   # Renew tokens 5 minutes before expiry.
+
+    # Requests per second shared by all clients of a regional endpoint and
+    # of a profile; the rates adapt to the throttling (429) observed.
+    _RATE_LIMITS = {'region': 20, 'profile': 5}
+    _THROTTLE_RETRIES = 5       # Retries of a throttled request.
+    _THROTTLE_DELAY = 1.0       # Seconds to wait without Retry-After.
+    _scheduler = RequestScheduler(_RATE_LIMITS)
+
+    # Reports of all clients are polled and downloaded by one poller.
+    _REPORT_WORKERS = 8         # Concurrent report status checks/downloads.
+    _REPORT_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk of report download.
+    _report_poller = None
+    _report_poller_lock = threading.Lock()
+    _report_cache = None
+
+    # Latency, sizes and retries of the requests, shared with other clients.
+    _metrics = REQUEST_METRICS
 
     def __init__(self, profile_id, country, access_token, refresh_token,
                  token_time, expires_in=3600):
@@ -62,25 +337,201 @@ class AdsAPIClient(object):
         self.client_auth = HTTPBasicAuth(self.client_id, self.client_secret)
         self.profile_id = str(profile_id)
         self.api_endpoint = AdsAPIClient._COUNTRY_TO_ENDPOINT_MAP[country]
+        self.session = AdsAPIClient.get_session(self.api_endpoint)
         self.access_token = access_token
         self.refresh_token = refresh_token
         self.token_time = token_time
         self.expires_in = expires_in
         self.headers = None
+        self._headers_cache = {}
 
     def _rebuild_auth(self, content_type='application/json'):
         """Rebuild authentication headers.
 
         Args:
             content_type: string, typically 'application/json'.
+
+        Returns:
+            The authentication headers, which are also kept in self.headers.
         """
-        self.access_token, self.token_time = (
+        access_token, self.token_time = (
             AdsAPIClient.refresh_access_token(
                 self.refresh_token, self.access_token, self.token_time))
-        self.headers = {'Authorization': 'Bearer ' + self.access_token,
-                        'Amazon-Advertising-API-Scope': self.profile_id}
-        if content_type:
-            self.headers['Content-Type'] = content_type
+        if access_token != self.access_token:
+            self.access_token = access_token
+            self._headers_cache = {}
+
+        # Reuse the headers built for the token until it is refreshed.
+        headers = self._headers_cache.get(content_type)
+        if headers is None:
+            headers = {'Authorization': 'Bearer ' + self.access_token,
+                       'Amazon-Advertising-API-Scope': self.profile_id}
+            if content_type:
+                headers['Content-Type'] = content_type
+            self._headers_cache[content_type] = headers
+        self.headers = headers
+        return headers
+
+    @staticmethod
+    def configure_sessions(pool_connections=None, pool_maxsize=None,
+                           pool_block=None):
+        """Configure the connection pools of the shared HTTP sessions.
+
+        Sessions created before are closed, so the new settings apply to
+        every client built afterwards.
+
+        Args:
+            pool_connections: int, number of hosts to keep pools for.
+            pool_maxsize: int, maximum keep-alive connections per host.
+            pool_block: boolean, if True, wait for a free connection when
+                the per-host limit is reached instead of opening a new one.
+        """
+        with AdsAPIClient._sessions_lock:
+            if pool_connections is not None:
+                AdsAPIClient._POOL_CONNECTIONS = pool_connections
+            if pool_maxsize is not None:
+                AdsAPIClient._POOL_MAXSIZE = pool_maxsize
+            if pool_block is not None:
+                AdsAPIClient._POOL_BLOCK = pool_block
+            for session in AdsAPIClient._sessions.values():
+                session.close()
+            AdsAPIClient._sessions.clear()
+
+    @staticmethod
+    def get_session(api_endpoint):
+        """Get the keep-alive HTTP session shared by an API endpoint.
+
+        All clients of the same region reuse one session, so the TCP and TLS
+        connections are pooled across pages, mutations and clients.
+
+        Args:
+            api_endpoint: string, e.g., _API_ENDPOINT_NA, _API_ENDPOINT_TOKEN.
+
+        Returns:
+            An object of type requests.Session.
+        """
+        with AdsAPIClient._sessions_lock:
+            session = AdsAPIClient._sessions.get(api_endpoint)
+            if session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=AdsAPIClient._POOL_CONNECTIONS,
+                    pool_maxsize=AdsAPIClient._POOL_MAXSIZE,
+                    pool_block=AdsAPIClient._POOL_BLOCK)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                AdsAPIClient._sessions[api_endpoint] = session
+        return session
+
+    @staticmethod
+    def set_token_store(store):
+        """Share access tokens with other processes via a token store.
+
+        Args:
+            store: TokenStore, e.g., FileTokenStore, SQLiteTokenStore;
+                None to keep tokens in this process only.
+        """
+        AdsAPIClient._token_cache.store = store
+
+    @staticmethod
+    def start_token_refresher(refresh_token, ahead=_TOKEN_REFRESH_AHEAD,
+                              jitter=60):
+        """Renew the access token of the refresh token in the background.
+
+        The token is renewed at a random time between ahead and
+        ahead + jitter seconds before it expires, so API calls never wait
+        for a token refresh.
+
+        Args:
+            refresh_token: string.
+            ahead: int, seconds before expiry to renew the token.
+            jitter: int, maximum random seconds added to ahead.
+        """
+        def refresh():
+            AdsAPIClient._token_cache.refresh_ahead(
+                refresh_token, AdsAPIClient._request_access_token,
+                ahead + random.uniform(0, jitter))
+
+        # Get a valid token right away, then keep it renewed.
+        refresh()
+        AdsAPIClient._token_refresher.add_job(refresh_token, refresh)
+
+    @staticmethod
+    def stop_token_refresher(refresh_token=None):
+        """Stop renewing the access token in the background.
+
+        Args:
+            refresh_token: string, None to stop renewing all tokens.
+        """
+        if refresh_token:
+            AdsAPIClient._token_refresher.remove_job(refresh_token)
+        else:
+            AdsAPIClient._token_refresher.stop()
+
+    @staticmethod
+    def get_token_stats():
+        """Get metrics of access token refresh.
+
+        Returns:
+            A dict:
+                {
+                    'refresh_waits': <number of calls waiting on refresh>,
+                    'refresh_wait_seconds': <total seconds waited>,
+                    'background_refreshes': <runs of background refresh>,
+                    'background_errors': <failed background refreshes>,
+                }
+        """
+        stats = dict(AdsAPIClient._token_cache.stats)
+        stats['background_refreshes'] = (
+            AdsAPIClient._token_refresher.stats['runs'])
+        stats['background_errors'] = (
+            AdsAPIClient._token_refresher.stats['errors'])
+        return stats
+
+    @staticmethod
+    def configure_rate_limits(region=None, profile=None):
+        """Configure the rate limits of the requests.
+
+        Buckets created before are dropped, so the new rates apply to the
+        following requests.
+
+        Args:
+            region: float, requests per second of a regional endpoint.
+            profile: float, requests per second of a profile.
+        """
+        if region is not None:
+            AdsAPIClient._RATE_LIMITS['region'] = region
+        if profile is not None:
+            AdsAPIClient._RATE_LIMITS['profile'] = profile
+        AdsAPIClient._scheduler = RequestScheduler(AdsAPIClient._RATE_LIMITS)
+
+    @staticmethod
+    def set_request_metrics(metrics):
+        """Record the metrics of the requests to another registry.
+
+        Args:
+            metrics: RequestMetrics.
+        """
+        AdsAPIClient._metrics = metrics
+
+    @staticmethod
+    def get_request_metrics():
+        """Get the registry of the metrics of the requests.
+
+        Returns:
+            An object of type RequestMetrics, whose export_prometheus()
+            exports the metrics.
+        """
+        return AdsAPIClient._metrics
+
+    @staticmethod
+    def set_report_cache(cache):
+        """Serve reports of finalized days from an on-disk cache.
+
+        Args:
+            cache: ReportCache, None to disable caching.
+        """
+        AdsAPIClient._report_cache = cache
 
     @staticmethod
     def get_tokens(auth_code):
@@ -113,9 +564,14 @@ class AdsAPIClient(object):
         headers = {
             'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
         }
-        response = requests.post(url=AdsAPIClient._API_ENDPOINT_TOKEN,
-                                 data=data,
-                                 headers=headers)
+        session = AdsAPIClient.get_session(AdsAPIClient._API_ENDPOINT_TOKEN)
+        start_time = time.time()
+        response = session.post(url=AdsAPIClient._API_ENDPOINT_TOKEN,
+                                data=data,
+                                headers=headers)
+        AdsAPIClient._record_request(
+            'POST', AdsAPIClient._API_ENDPOINT_TOKEN, None, response,
+            time.time() - start_time, 0)
         response_json = response.json()
         if response.status_code == 200 or (
                 response_json and response_json.get('refresh_token')):
@@ -123,8 +579,7 @@ class AdsAPIClient(object):
                         response.content)
             if 'token_time' not in response_json:
                 # UTC time.
-                response_json['token_time'] = time.mktime(
-                    timezone.now().timetuple())
+                response_json['token_time'] = AccessTokenCache.now()
             return response_json
         else:
             logger.exception(response.content)
@@ -143,31 +598,44 @@ class AdsAPIClient(object):
         Returns:
             Access token and token time (UTC).
         """
-        # Check if the token time has passed almost beyond one hour.
-        if (not access_token or not token_time or
-                time.mktime(timezone.now().timetuple()) > (
-                    float(token_time) + 55 * 60)):
-            response = requests.post(
-                url=AdsAPIClient._API_ENDPOINT_TOKEN,
-                data={
-                    'grant_type': 'refresh_token',
-                    'client_id': 'Your Client ID',
-                    'client_secret': 'Your Client Secret',
-                    'refresh_token': refresh_token,
-                },
-                headers={
-                    'Content-Type':
-                    'application/x-www-form-urlencoded;charset=UTF-8',
-                }
-            )
-            logger.info(response.json())
-            if response.status_code != 200:
-                raise AdsAPIError(response.status_code, response.content)
+        # Clients of the same refresh token share the cached access token,
+        # and only one of them refreshes it once it is almost one hour old.
+        return AdsAPIClient._token_cache.get(
+            refresh_token, AdsAPIClient._request_access_token,
+            access_token, token_time)
+
+    @staticmethod
+    def _request_access_token(refresh_token):
+        """Request a new access token from the token endpoint.
 
-            access_token = response.json().get('access_token')
-            token_time = time.mktime(timezone.now().timetuple())
+        Args:
+            refresh_token: string.
+
+        Returns:
+            Access token and token time (UTC).
+        """
+        session = AdsAPIClient.get_session(AdsAPIClient._API_ENDPOINT_TOKEN)
+        # No rate limit, but throttled refreshes are retried and recorded
+        # like the other requests.
+        response = AdsAPIClient._send_scheduled(
+            (), session, 'POST', AdsAPIClient._API_ENDPOINT_TOKEN,
+            data={
+                'grant_type': 'refresh_token',
+                'client_id': 'Your Client ID',
+                'client_secret': 'Your Client Secret',
+                'refresh_token': refresh_token,
+            },
+            headers={
+                'Content-Type':
+                'application/x-www-form-urlencoded;charset=UTF-8',
+            }
+        )
+        logger.info(response.json())
+        if response.status_code != 200:
+            raise AdsAPIError(response.status_code, response.content)
 
-        return (access_token, token_time)
+        return (response.json().get('access_token'),
+                AccessTokenCache.now())
 
     @staticmethod
     def get_profiles(refresh_token):
@@ -184,18 +652,30 @@ class AdsAPIClient(object):
             'Content-Type': 'application/json',
             'Authorization': 'Bearer ' + access_token,
         }
-        profiles = []
-        for api_endpoint in (AdsAPIClient._API_ENDPOINT_NA,
-                             # AdsAPIClient._API_ENDPOINT_TEST,
-                             AdsAPIClient._API_ENDPOINT_EU):
-            response = requests.get(
-                url=api_endpoint % AdsAPIClient.ENTITY_TYPE_PROFILES,
+        def get_region_profiles(api_endpoint):
+            response = AdsAPIClient._send_scheduled(
+                (('region', api_endpoint), ),
+                AdsAPIClient.get_session(api_endpoint), 'GET',
+                api_endpoint % AdsAPIClient.ENTITY_TYPE_PROFILES,
                 headers=headers)
             logger.info('Response headers: %s', response.headers)
             if response.status_code == 200:
-                profiles.extend(response.json())
+                return response.json()
+            return []
 
-        return profiles
+        # Look up the regions concurrently.
+        api_endpoints = (AdsAPIClient._API_ENDPOINT_NA,
+                         # AdsAPIClient._API_ENDPOINT_TEST,
+                         AdsAPIClient._API_ENDPOINT_EU)
+        pool = ThreadPool(len(api_endpoints))
+        try:
+            region_profiles = pool.map(get_region_profiles, api_endpoints)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [profile for profiles in region_profiles
+                for profile in profiles]
 
     @staticmethod
     def get_keyword_to_create(campaign_id, adgroup_id, keyword_text,
@@ -460,25 +940,9 @@ class AdsAPIClient(object):
         Return:
             A list of product ads.
         """
-        params = {}
-        if ad_ids:
-            params['adIdFilter'] = ','.join(str(i) for i in ad_ids)
-        if adgroup_ids:
-            params['adGroupIdFilter'] = ','.join(str(i) for i in adgroup_ids)
-        if asin:
-            params['asin'] = asin
-        if campaign_ids:
-            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
-        if campaign_type:
-            params['campaignType'] = campaign_type
-        if sku:
-            params['sku'] = sku
-        if state:
-            params['stateFilter'] = ','.join(str(i) for i in state)
-        if load_extended_fields:
-            entity_type = self.ENTITY_TYPE_PRODUCT_ADS + '/extended'
-        else:
-            entity_type = self.ENTITY_TYPE_PRODUCT_ADS
+        entity_type, params = self._get_ads_query(
+            ad_ids, adgroup_ids, asin, campaign_ids, campaign_type, sku, state,
+            load_extended_fields)
 
         return self._get_entities(entity_type, params)
 
@@ -500,21 +964,9 @@ class AdsAPIClient(object):
         Return:
             A list of ad groups.
         """
-        params = {}
-        if adgroup_ids:
-            params['adGroupIdFilter'] = ','.join(str(i) for i in adgroup_ids)
-        if campaign_ids:
-            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
-        if campaign_type:
-            params['campaignType'] = campaign_type
-        if name:
-            params['name'] = name
-        if state:
-            params['stateFilter'] = ','.join(str(i) for i in state)
-        if load_extended_fields:
-            entity_type = self.ENTITY_TYPE_AD_GROUPS + '/extended'
-        else:
-            entity_type = self.ENTITY_TYPE_AD_GROUPS
+        entity_type, params = self._get_adgroups_query(
+            adgroup_ids, campaign_ids, campaign_type, name, state,
+            load_extended_fields)
 
         adgroups = self._get_entities(entity_type, params)
         return adgroups
@@ -532,19 +984,101 @@ class AdsAPIClient(object):
                 the ad groups.
 
         Return:
-            A dict of campaign details.
+            A dict of campaign details, with nested ad groups if ads or
+            keywords are loaded, refer to get_campaign_trees().
         """
         if not campaign_id:
             return None
 
-        campaigns = [
-            c for c in self.get_campaigns(
-                campaign_ids=[campaign_id],
-                load_extended_fields=load_extended_fields,
+        if load_nested_ads or load_nested_keywords:
+            campaigns = self.get_campaign_trees(
+                [campaign_id], load_extended_fields=load_extended_fields,
                 load_nested_ads=load_nested_ads,
-                load_nested_keywords=load_nested_keywords)]
+                load_nested_keywords=load_nested_keywords,
+                load_nested_negative_keywords=False)
+        else:
+            campaigns = list(self.get_campaigns(
+                campaign_ids=[campaign_id],
+                load_extended_fields=load_extended_fields))
         return campaigns[0] if campaigns else None
 
+    def get_campaign_trees(self, campaign_ids, load_extended_fields=True,
+                           load_nested_ads=True, load_nested_keywords=True,
+                           load_nested_negative_keywords=True):
+        """Get campaigns with their ad groups, ads and keywords nested.
+
+        Each level is fetched by one query filtered by the campaign IDs, and
+        the queries run concurrently; the entities are then joined to their
+        parents by ID.
+
+        Args:
+            campaign_ids: long[], IDs of campaigns.
+            load_extended_fields: boolean, if True, load a complete fields
+                of the entities.
+            load_nested_ads: boolean, if True, load ads of the ad groups.
+            load_nested_keywords: boolean, if True, load keywords of
+                the ad groups.
+            load_nested_negative_keywords: boolean, if True, load negative
+                keywords of the ad groups.
+
+        Return:
+            A list of campaigns as:
+                {
+                    'campaignId': <campaign id>,
+                    ...
+                    'adgroups': [
+                        {
+                            'adGroupId': <ad group id>,
+                            ...
+                            'ads': [<product ad>, ...],
+                            'keywords': [<biddable keyword>, ...],
+                            'negativeKeywords': [<negative keyword>, ...],
+                        },
+                    ],
+                }
+        """
+        if not campaign_ids:
+            return []
+
+        queries = [
+            self._get_campaigns_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields),
+            self._get_adgroups_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields),
+        ]
+        nested_keys = []
+        if load_nested_ads:
+            nested_keys.append('ads')
+            queries.append(self._get_ads_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields))
+        if load_nested_keywords:
+            nested_keys.append('keywords')
+            queries.append(self._get_keywords_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields))
+        if load_nested_negative_keywords:
+            nested_keys.append('negativeKeywords')
+            queries.append(self._get_keywords_query(
+                campaign_ids=campaign_ids, is_biddable=False,
+                load_extended_fields=load_extended_fields))
+
+        pool = ThreadPool(len(queries))
+        try:
+            results = pool.map(
+                lambda query: self._get_entities(*query), queries)
+        finally:
+            pool.close()
+            pool.join()
+
+        campaigns, adgroups = results[:2]
+        self._merge_up_entities(campaigns, adgroups, 'campaignId', 'adgroups')
+        for key, entities in zip(nested_keys, results[2:]):
+            self._merge_up_entities(adgroups, entities, 'adGroupId', key)
+        return campaigns
+
     def get_campaigns(self, campaign_ids=None, campaign_type=None, name=None,
                       state=None, load_extended_fields=True):
         """Get a list of campaigns.
@@ -560,19 +1094,8 @@ class AdsAPIClient(object):
         Return:
             An iterator of campaign.
         """
-        params = {}
-        if campaign_ids:
-            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
-        if campaign_type:
-            params['campaignType'] = campaign_type
-        if name:
-            params['name'] = name
-        if state:
-            params['stateFilter'] = state
-        if load_extended_fields:
-            entity_type = self.ENTITY_TYPE_CAMPAIGNS + '/extended'
-        else:
-            entity_type = self.ENTITY_TYPE_CAMPAIGNS
+        entity_type, params = self._get_campaigns_query(
+            campaign_ids, campaign_type, name, state, load_extended_fields)
 
         campaigns = self._get_entities(entity_type, params)
         for campaign in campaigns:
@@ -599,99 +1122,183 @@ class AdsAPIClient(object):
         Return:
             A list of biddable keywords or negative keywords.
         """
-        params = {}
-        if adgroup_ids:
-            params['adGroupIdFilter'] = ','.join(str(i) for i in adgroup_ids)
-        if campaign_ids:
-            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
-        if campaign_type:
-            params['campaignType'] = campaign_type
-        if keyword_ids:
-            params['keywordIdFilter'] = ','.join(str(i) for i in keyword_ids)
-        if keyword_text:
-            params['keywordText'] = keyword_text
-        if match_type:
-            params['matchTypeFilter'] = match_type
-        if state:
-            params['stateFilter'] = state
-        if is_biddable:
-            entity_type = self.ENTITY_TYPE_BIDDABLE_KEYWORDS
-        else:
-            entity_type = self.ENTITY_TYPE_NEGATIVE_KEYWORDS
-        if load_extended_fields:
-            entity_type += '/extended'
+        entity_type, params = self._get_keywords_query(
+            adgroup_ids, campaign_ids, campaign_type, keyword_ids,
+            keyword_text, match_type, state, is_biddable,
+            load_extended_fields)
 
         return self._get_entities(entity_type, params)
 
-    def get_report(self, entity_type, report_date, query=None):
+    def get_report(self, entity_type, report_date, query=None,
+                   columnar=False):
         """Get performance report of campaigns/adGroups/...
 
         Args:
             entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
             report_date: string, in format: 'YYYYMMDD'.
             query: string, it can only be used in Keyword reports.
+            columnar: boolean, if True, return the report as NumPy columns.
 
         Return:
-            A performance report.
+            A performance report, a list of rows or a ColumnarReport.
         """
-        # Request a report.
-        url = self.api_endpoint % (entity_type + '/report')
-        data = {
-            'campaignType': 'sponsoredProducts',
-            'segment': query,
-            'reportDate': report_date,
-            'metrics': (
-                'impressions,clicks,cost,attributedConversions1dSameSKU,'
-                'attributedConversions1d,attributedSales1dSameSKU,'
-                'attributedSales1d,attributedConversions7dSameSKU,'
-                'attributedConversions7d,attributedSales7dSameSKU,'
-                'attributedSales7d,attributedConversions30dSameSKU,'
-                'attributedConversions30d,attributedSales30dSameSKU,'
-                'attributedSales30d'),
-        }
-        self._rebuild_auth()
-        response = requests.post(url=url, headers=self.headers, json=data)
-        if response.status_code != 202:
-            logger.exception(response.content)
-            raise AdsAPIError(response.status_code, response.content)
+        if columnar:
+            return ColumnarReport.from_rows(
+                self.iter_report(entity_type, report_date, query),
+                self.REPORT_METRICS)
 
-        report_id = response.json()['reportId']
+        return self.submit_report(entity_type, report_date, query).result()
 
-        # Generate the requested report.
-        url = self.api_endpoint % (
-            self.ENTITY_TYPE_REPORTS + '/' + report_id)
-        download_uri = None
-        for _ in range(0, 60):
-            self._rebuild_auth()
-            response = requests.get(url, headers=self.headers)
-            if response.status_code == 200:
-                if response.json()['status'] == 'SUCCESS':
-                    logger.info(response.json())
-                    download_uri = response.json().get('location')
-                    break
-            else:
-                logger.exception(response.json())
-                if (response.status_code == 404 and
-                        response.json().get('code') == 'NOT_FOUND'):
-                    break
-                else:
-                    raise AdsAPIError(response.status_code, response.content)
-            time.sleep(5)
+    def iter_report(self, entity_type, report_date, query=None):
+        """Get performance report rows as they are downloaded.
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
 
+        Return:
+            An iterator of the rows of the performance report.
+        """
+        cache, key = self._get_report_cache_key(
+            entity_type, report_date, query)
+        if cache:
+            rows = cache.load(key)
+            if rows is not None:
+                for row in rows:
+                    yield row
+                return
+
+        report_id = self._request_report(entity_type, report_date, query)
+        future = ReportFuture(report_id)
+        # Wait for the report to be generated, then stream it here.
+        AdsAPIClient._get_report_poller().add(
+            future,
+            lambda: self._get_report_status(report_id),
+            lambda download_uri: download_uri)
+        download_uri = future.result()
         if not download_uri:
-            logger.exception('Failed to generate the requested report.')
-            return []
+            return
 
-        # Download the report.
-        self._rebuild_auth(content_type=None)
-        # response = requests.get(download_uri, headers=headers, stream=True)
-        response = requests.get(download_uri, headers=self.headers)
-        if response.status_code == 200:
-            report = GzipFile('', 'r', 0, BytesIO(response.content)).read()
-            return json.loads(report)
-        else:
-            logger.exception(response.content)
-            raise AdsAPIError(response.status_code, response.content)
+        if not cache:
+            for row in self._iter_report_rows(download_uri):
+                yield row
+            return
+
+        # Cache the rows as they are yielded, a report left partially read
+        # or failed is not cached.
+        writer = cache.open_writer(key)
+        try:
+            for row in self._iter_report_rows(download_uri):
+                writer.write(row)
+                yield row
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def iter_ads(self, by_page=False, **kwargs):
+        """Iterate product ads as they are downloaded page by page.
+
+        Args:
+            by_page: boolean, if True, yield lists of product ads per page.
+            kwargs: filters of product ads, refer to get_ads().
+
+        Return:
+            An iterator of product ads, or of pages of them if by_page.
+        """
+        entity_type, params = self._get_ads_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def iter_adgroups(self, by_page=False, **kwargs):
+        """Iterate ad groups as they are downloaded page by page.
+
+        Args:
+            by_page: boolean, if True, yield lists of ad groups per page.
+            kwargs: filters of ad groups, refer to get_adgroups().
+
+        Return:
+            An iterator of ad groups, or of pages of them if by_page.
+        """
+        entity_type, params = self._get_adgroups_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def iter_campaigns(self, by_page=False, **kwargs):
+        """Iterate campaigns as they are downloaded page by page.
+
+        Args:
+            by_page: boolean, if True, yield lists of campaigns per page.
+            kwargs: filters of campaigns, refer to get_campaigns().
+
+        Return:
+            An iterator of campaigns, or of pages of them if by_page.
+        """
+        entity_type, params = self._get_campaigns_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def iter_keywords(self, by_page=False, **kwargs):
+        """Iterate keywords as they are downloaded page by page.
+
+        Args:
+            by_page: boolean, if True, yield lists of keywords per page.
+            kwargs: filters of keywords, refer to get_keywords().
+
+        Return:
+            An iterator of keywords, or of pages of them if by_page.
+        """
+        entity_type, params = self._get_keywords_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def submit_report(self, entity_type, report_date, query=None):
+        """Request a performance report without waiting for it.
+
+        The report is polled and downloaded in the background together with
+        all other outstanding reports of the process.
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+
+        Return:
+            A ReportFuture, whose result() is the performance report.
+        """
+        cache, key = self._get_report_cache_key(
+            entity_type, report_date, query)
+        if cache:
+            rows = cache.load(key)
+            if rows is not None:
+                future = ReportFuture()
+                future.set_result(list(rows))
+                return future
+
+        def download(download_uri):
+            rows = self._download_report(download_uri)
+            if cache:
+                cache.save(key, rows)
+            return rows
+
+        report_id = self._request_report(entity_type, report_date, query)
+        future = ReportFuture(report_id)
+        AdsAPIClient._get_report_poller().add(
+            future, lambda: self._get_report_status(report_id), download)
+        return future
+
+    def submit_reports(self, entity_types, report_dates, query=None):
+        """Request performance reports of entity types and dates at once.
+
+        Args:
+            entity_types: string[], types of entity, refer to _ENTITY_TYPE_*.
+            report_dates: string[], in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+
+        Return:
+            A dict of ReportFuture keyed by (entity_type, report_date).
+        """
+        return dict(
+            ((entity_type, report_date),
+             self.submit_report(entity_type, report_date, query))
+            for entity_type in entity_types for report_date in report_dates)
 
     def update_ad(self, ad_id, state=None):
         """Update a product ad.
@@ -797,13 +1404,13 @@ class AdsAPIClient(object):
         Return:
             Updated biddable keywords or negative keywords.
         """
-        data = [
-            {
-                'bid': max(float(bid), AdsAPIClient.MIN_BID) if bid else None,
-                'state': state,
-                'keywordId': k_id,
-            } for k_id in keyword_ids
-        ]
+        # Fields left as None are not sent, so they are left unchanged.
+        fields = {}
+        if bid:
+            fields['bid'] = max(float(bid), AdsAPIClient.MIN_BID)
+        if state:
+            fields['state'] = state
+        data = [dict(fields, keywordId=k_id) for k_id in keyword_ids]
         if is_biddable:
             entity_type = self.ENTITY_TYPE_BIDDABLE_KEYWORDS
         else:
@@ -844,17 +1451,7 @@ class AdsAPIClient(object):
         Return:
             Created entities.
         """
-        # Build URL endpoint for POST method.
-        url = self.api_endpoint % entity_type
-
-        self._rebuild_auth()
-        response = requests.post(
-            url, data=json.dumps(data), headers=self.headers)
-        if response.status_code != 207:
-            raise AdsAPIError(
-                response.status_code, response.json()['details'])
-
-        return response.json()
+        return self._mutate_entities('POST', entity_type, data, 207)
 
     def _delete_entities(self, entity_type, entity_id_field, entity_ids):
         """Archive entities as deleted.
@@ -869,22 +1466,151 @@ class AdsAPIClient(object):
         Return:
             Archived entities.
         """
-        # Build URL endpoint for PUT method.
-        url = self.api_endpoint % entity_type
-
         data = [{entity_id_field: long(entity_id), 'state': 'archived'}
                 for entity_id in entity_ids]
-        self._rebuild_auth()
-        response = requests.put(
-            url, data=json.dumps(data), headers=self.headers)
-        if response.status_code != 200:
-            raise AdsAPIError(
-                response.status_code, response.json()['details'])
+        return self._mutate_entities('PUT', entity_type, data, 200)
 
-        return response.json()
+    @staticmethod
+    def _merge_up_entities(parents, children, id_field, key):
+        """Nest the children entities in their parents by a hash join.
+
+        Args:
+            parents: dict[], parent entities, e.g., ad groups.
+            children: dict[], child entities, e.g., keywords.
+            id_field: string, ID field of the parents, e.g., 'adGroupId'.
+            key: string, field of the list of children in the parents.
+        """
+        children_by_id = {}
+        for parent in parents:
+            parent[key] = children_by_id[parent[id_field]] = []
+        for child in children:
+            nested = children_by_id.get(child.get(id_field))
+            if nested is not None:
+                nested.append(child)
+
+    def _get_adgroups_query(self, adgroup_ids=None, campaign_ids=None,
+                            campaign_type=None, name=None,
+                            state=('enabled', 'paused'),
+                            load_extended_fields=True):
+        """Get entity type and search parameters of ad groups.
+
+        Refer to get_adgroups() for the arguments.
+
+        Return:
+            A tuple of (entity_type, params).
+        """
+        params = {}
+        if adgroup_ids:
+            params['adGroupIdFilter'] = ','.join(str(i) for i in adgroup_ids)
+        if campaign_ids:
+            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
+        if campaign_type:
+            params['campaignType'] = campaign_type
+        if name:
+            params['name'] = name
+        if state:
+            params['stateFilter'] = ','.join(str(i) for i in state)
+        if load_extended_fields:
+            entity_type = self.ENTITY_TYPE_AD_GROUPS + '/extended'
+        else:
+            entity_type = self.ENTITY_TYPE_AD_GROUPS
+
+        return (entity_type, params)
+
+    def _get_ads_query(self, ad_ids=None, adgroup_ids=None, asin=None,
+                       campaign_ids=None, campaign_type=None, sku=None,
+                       state=('enabled', 'paused'), load_extended_fields=True):
+        """Get entity type and search parameters of product ads.
+
+        Refer to get_ads() for the arguments.
+
+        Return:
+            A tuple of (entity_type, params).
+        """
+        params = {}
+        if ad_ids:
+            params['adIdFilter'] = ','.join(str(i) for i in ad_ids)
+        if adgroup_ids:
+            params['adGroupIdFilter'] = ','.join(str(i) for i in adgroup_ids)
+        if asin:
+            params['asin'] = asin
+        if campaign_ids:
+            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
+        if campaign_type:
+            params['campaignType'] = campaign_type
+        if sku:
+            params['sku'] = sku
+        if state:
+            params['stateFilter'] = ','.join(str(i) for i in state)
+        if load_extended_fields:
+            entity_type = self.ENTITY_TYPE_PRODUCT_ADS + '/extended'
+        else:
+            entity_type = self.ENTITY_TYPE_PRODUCT_ADS
+
+        return (entity_type, params)
+
+    def _get_campaigns_query(self, campaign_ids=None, campaign_type=None,
+                             name=None, state=None, load_extended_fields=True):
+        """Get entity type and search parameters of campaigns.
+
+        Refer to get_campaigns() for the arguments.
+
+        Return:
+            A tuple of (entity_type, params).
+        """
+        params = {}
+        if campaign_ids:
+            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
+        if campaign_type:
+            params['campaignType'] = campaign_type
+        if name:
+            params['name'] = name
+        if state:
+            params['stateFilter'] = state
+        if load_extended_fields:
+            entity_type = self.ENTITY_TYPE_CAMPAIGNS + '/extended'
+        else:
+            entity_type = self.ENTITY_TYPE_CAMPAIGNS
+
+        return (entity_type, params)
+
+    def _get_keywords_query(self, adgroup_ids=None, campaign_ids=None,
+                            campaign_type=None, keyword_ids=None,
+                            keyword_text=None, match_type=None, state=None,
+                            is_biddable=True, load_extended_fields=True):
+        """Get entity type and search parameters of keywords.
+
+        Refer to get_keywords() for the arguments.
+
+        Return:
+            A tuple of (entity_type, params).
+        """
+        params = {}
+        if adgroup_ids:
+            params['adGroupIdFilter'] = ','.join(str(i) for i in adgroup_ids)
+        if campaign_ids:
+            params['campaignIdFilter'] = ','.join(str(i) for i in campaign_ids)
+        if campaign_type:
+            params['campaignType'] = campaign_type
+        if keyword_ids:
+            params['keywordIdFilter'] = ','.join(str(i) for i in keyword_ids)
+        if keyword_text:
+            params['keywordText'] = keyword_text
+        if match_type:
+            params['matchTypeFilter'] = match_type
+        if state:
+            params['stateFilter'] = state
+        if is_biddable:
+            entity_type = self.ENTITY_TYPE_BIDDABLE_KEYWORDS
+        else:
+            entity_type = self.ENTITY_TYPE_NEGATIVE_KEYWORDS
+        if load_extended_fields:
+            entity_type += '/extended'
+
+        return (entity_type, params)
 
     def _get_entities(self, entity_type, params=None, page_offset=-1,
-                      page_size=_PAGE_SIZE):
+                      page_size=_PAGE_SIZE, page_workers=None):
         """Get entities (e.g., Campaign, Ads).
 
         Args:
@@ -893,9 +1619,14 @@ class AdsAPIClient(object):
             page_offset: int, start index of a page of entities. If page_offset
                 equals to -1, fetch all pages; otherwise, fetch only one page.
             page_size: int, maximum number of entities to return in the page.
+            page_workers: int, number of pages fetched concurrently when
+                fetching all pages, _PAGE_WORKERS by default.
 
         Return:
             A list of entities.
+
+        Raises:
+            AdsAPIError: a page failed.
         """
         # Build URL endpoint for GET method.
         url = self.api_endpoint % entity_type
@@ -903,50 +1634,731 @@ class AdsAPIClient(object):
         if not params:
             params = {}
 
-        entities = []
-        if page_offset == -1:
-            params['startIndex'] = 0
-            params['count'] = page_size
-            more_pages = True
-            while more_pages:
-                self._rebuild_auth()
-                response = requests.get(
-                    url, headers=self.headers, params=params)
-                if (response.status_code == 200 and
-                        isinstance(response.json(), list) and
-                        len(response.json()) > 0):
-                    entities.extend(response.json())
-                    params['startIndex'] += page_size
-                    more_pages = len(response.json()) == page_size
-                else:
-                    more_pages = False
-        else:
+        if page_offset != -1:
             params['startIndex'] = page_offset
             params['count'] = page_size
             self._rebuild_auth()
-            response = requests.get(url, headers=self.headers, params=params)
-            entities = response.json()
+            response = self._send(
+                'GET', url, headers=self.headers, params=params)
+            return response.json()
+
+        entities = []
+        for page in self._iter_pages(url, params, page_size, page_workers):
+            entities.extend(page)
 
         return entities
 
-    def _update_entities(self, entity_type, data):
-        """Update entities, e.g., Campaign, Ad Group.
+    def _iter_entities(self, entity_type, params=None, by_page=False,
+                       page_size=_PAGE_SIZE, page_workers=None):
+        """Iterate all entities (e.g., Campaign, Ads) page by page.
+
+        Only the pages being fetched are held in memory, so callers can
+        process the first page while the following ones are downloaded. A
+        failed page raises from the iterator after the pages before it, so
+        an iteration which ends normally has seen all the entities.
 
         Args:
             entity_type: string, type of the entity, e.g., 'adGroups'.
-            data: dict[], list of data to be updated.
+            params: dict, search parameters.
+            by_page: boolean, if True, yield lists of entities per page.
+            page_size: int, maximum number of entities to return in the page.
+            page_workers: int, number of pages fetched concurrently,
+                _PAGE_WORKERS by default.
 
         Return:
-            Updated entities.
+            An iterator of entities, or of pages of entities if by_page.
+
+        Raises:
+            AdsAPIError: a page failed.
         """
-        # Build URL endpoint for PUT method.
         url = self.api_endpoint % entity_type
+        for page in self._iter_pages(
+                url, params or {}, page_size, page_workers):
+            if by_page:
+                yield page
+            else:
+                for entity in page:
+                    yield entity
+
+    def _iter_pages(self, url, params, page_size, page_workers=None):
+        """Iterate all non-empty pages of entities in order.
+
+        A query whose URL would be too long is split into sub-queries by
+        _split_id_filters(), _SPLIT_WORKERS of which run concurrently. The
+        pages of the sub-queries are yielded as they arrive, in the order
+        of the sub-queries, with the entities seen already dropped. A
+        sub-query waits once _SPLIT_QUEUE_SIZE of its pages are buffered,
+        so the memory used is bounded however slow the caller is.
+
+        Args:
+            url: string, URL endpoint of the entities.
+            params: dict, search parameters.
+            page_size: int, maximum number of entities to return in the page.
+            page_workers: int, number of pages fetched concurrently per
+                query, _PAGE_WORKERS by default.
+
+        Return:
+            An iterator of lists of entities.
+
+        Raises:
+            AdsAPIError: a page of the query or of a sub-query failed.
+        """
+        queries = self._split_id_filters(url, params)
+        if len(queries) == 1:
+            for page in self._iter_query_pages(
+                    url, params, page_size, page_workers):
+                yield page
+            return
+
+        logger.info('Split query of %s into %d sub-queries.', url,
+                    len(queries))
+        stopped = threading.Event()
+
+        def put(pages, item):
+            # Wait for room in the queue, False if the caller stopped.
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def fetch(query, pages):
+            # Pass the pages of the sub-query to the caller, then None.
+            try:
+                for page in self._iter_query_pages(
+                        url, query, page_size, page_workers):
+                    if not put(pages, page):
+                        return
+                put(pages, None)
+            except Exception as e:
+                put(pages, e)
+
+        id_field = self._get_id_field(url)
+        seen = set()
+        queries = iter(queries)
+        pending = deque()
+        pool = ThreadPool(self._SPLIT_WORKERS)
+        try:
+            for query in queries:
+                pending.append(Queue(self._SPLIT_QUEUE_SIZE))
+                pool.apply_async(fetch, (query, pending[-1]))
+                if len(pending) == self._SPLIT_WORKERS:
+                    break
+
+            while pending:
+                pages = pending.popleft()
+                page = pages.get()
+                while page is not None:
+                    if isinstance(page, Exception):
+                        raise page
+                    page = self._drop_seen(page, id_field, seen)
+                    if page:
+                        yield page
+                    page = pages.get()
+                for query in queries:
+                    pending.append(Queue(self._SPLIT_QUEUE_SIZE))
+                    pool.apply_async(fetch, (query, pending[-1]))
+                    break
+        finally:
+            # Stop the sub-queries running if the caller stopped early.
+            stopped.set()
+            pool.close()
+            pool.join()
+
+    def _split_id_filters(self, url, params):
+        """Split a query into sub-queries of URLs within _MAX_URL_LENGTH.
+
+        The room left in the URL by the other parameters is shared equally
+        by the ID filters (e.g., keywordIdFilter), an ID filter shorter than
+        its share keeps all its IDs and leaves the rest to the others. The
+        IDs of each ID filter are split into chunks within its share, and
+        the sub-queries are the combinations of the chunks. They get the
+        union of the entities of the query.
 
-        self._rebuild_auth()
-        response = requests.put(
-            url, data=json.dumps(data), headers=self.headers)
-        if response.status_code != 207:
+        Args:
+            url: string, URL endpoint of the entities.
+            params: dict, search parameters.
+
+        Return:
+            A list of search parameters, [params] if short enough.
+        """
+        length = (len(url) + 1 + len(urlencode(params)) +
+                  self._PAGING_PARAMS_LENGTH)
+        id_filters = [
+            key for key, value in params.items()
+            if key.endswith('IdFilter') and ',' in str(value)]
+        if length <= self._MAX_URL_LENGTH or not id_filters:
+            return [params]
+
+        # Encoded length of the values of the ID filters, with the commas
+        # encoded as '%2C'.
+        lengths = dict(
+            (key, len(urlencode({key: params[key]})) - len(key) - 1)
+            for key in id_filters)
+        budget = sum(lengths.values()) - (length - self._MAX_URL_LENGTH)
+
+        queries = [params]
+        id_filters.sort(key=lambda k: lengths[k])
+        for index, key in enumerate(id_filters):
+            share = budget // (len(id_filters) - index)
+            if lengths[key] <= share:
+                budget -= lengths[key]
+                continue
+            budget -= share
+            chunks = self._chunk_ids(str(params[key]).split(','), share)
+            queries = [dict(query, **{key: chunk})
+                       for query in queries for chunk in chunks]
+        return queries
+
+    @staticmethod
+    def _chunk_ids(ids, budget):
+        """Split IDs into comma separated chunks within an encoded length.
+
+        Args:
+            ids: string[], IDs, the repeated ones are dropped.
+            budget: int, encoded length of a chunk, at least one ID each.
+
+        Return:
+            A list of strings.
+        """
+        chunks = [[]]
+        chunk_length = 0
+        seen = set()
+        for entity_id in ids:
+            if entity_id in seen:
+                continue
+            seen.add(entity_id)
+            if chunks[-1] and chunk_length + len(entity_id) + 3 > budget:
+                chunks.append([])
+                chunk_length = 0
+            chunks[-1].append(entity_id)
+            chunk_length += len(entity_id) + 3
+        return [','.join(chunk) for chunk in chunks]
+
+    @staticmethod
+    def _get_id_field(url):
+        """Get the ID field of the entities of a URL, None if unknown."""
+        entity_type = AdsAPIClient._get_service_name(url).split('/')[0]
+        return AdsAPIClient._ENTITY_ID_FIELDS.get(entity_type)
+
+    @staticmethod
+    def _drop_seen(page, id_field, seen):
+        """Drop the entities of a page whose ID is seen, add the others.
+
+        The entities without an ID are kept, as they cannot be told apart.
+        """
+        if not id_field:
+            return page
+        entities = []
+        for entity in page:
+            entity_id = entity.get(id_field)
+            if entity_id is None:
+                entities.append(entity)
+            elif entity_id not in seen:
+                seen.add(entity_id)
+                entities.append(entity)
+        return entities
+
+    def _iter_query_pages(self, url, params, page_size, page_workers=None):
+        """Iterate all non-empty pages of entities of a query in order.
+
+        Refer to _iter_pages() for the arguments.
+
+        Return:
+            An iterator of lists of entities.
+        """
+        page_workers = page_workers or self._PAGE_WORKERS
+        if page_workers > 1:
+            for page in self._iter_pages_concurrently(
+                    url, params, page_size, page_workers):
+                yield page
+            return
+
+        start_index = 0
+        more_pages = True
+        while more_pages:
+            page = self._get_page(url, params, start_index, page_size)
+            if page:
+                yield page
+                start_index += page_size
+            more_pages = len(page) == page_size
+
+    def _get_page(self, url, params, start_index, page_size):
+        """Get a page of entities.
+
+        Args:
+            url: string, URL endpoint of the entities.
+            params: dict, search parameters.
+            start_index: int, start index of the page.
+            page_size: int, maximum number of entities to return in the page.
+
+        Return:
+            A list of entities, empty if no more entities.
+
+        Raises:
+            AdsAPIError: the page failed, so that a failed listing is never
+                taken for a complete one.
+        """
+        page_params = dict(params, startIndex=start_index, count=page_size)
+        headers = self._rebuild_auth()
+        response = self._send('GET', url, headers=headers, params=page_params)
+        if response.status_code != 200:
+            raise AdsAPIError(response.status_code, response.text)
+
+        try:
+            page = response.json()
+        except ValueError:
+            raise AdsAPIError(response.status_code, response.text)
+        if not isinstance(page, list):
+            raise AdsAPIError(response.status_code, response.text)
+        return page
+
+    def _iter_pages_concurrently(self, url, params, page_size,
+                                 page_workers):
+        """Iterate all pages of entities with pages fetched concurrently.
+
+        Pages ahead are requested speculatively, and the fetching stops at the
+        first short or empty page. Pages are yielded in order; a failed page
+        raises its AdsAPIError when its turn comes.
+
+        Args:
+            url: string, URL endpoint of the entities.
+            params: dict, search parameters.
+            page_size: int, maximum number of entities to return in the page.
+            page_workers: int, maximum number of pages fetched concurrently.
+
+        Return:
+            An iterator of lists of entities.
+        """
+        pool = ThreadPool(page_workers)
+        try:
+            pending = deque()
+            start_index = 0
+            for _ in range(page_workers):
+                pending.append(pool.apply_async(
+                    self._get_page, (url, params, start_index, page_size)))
+                start_index += page_size
+
+            while pending:
+                page = pending.popleft().get()
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    break
+                pending.append(pool.apply_async(
+                    self._get_page, (url, params, start_index, page_size)))
+                start_index += page_size
+        finally:
+            # Wait for the speculative requests beyond the last page.
+            pool.close()
+            pool.join()
+
+    def _mutate_entities(self, method, entity_type, data, status_code):
+        """Create, update or archive entities in batches.
+
+        The data is split into batches of _BATCH_SIZE entities which are
+        sent concurrently, and the per-entity results of the batches are
+        merged in the order of the data. Entities of a failed batch get an
+        error result with the HTTP status code.
+
+        Only the entities failed with a retryable error code are sent again,
+        up to _BATCH_RETRIES times with exponential backoff; the entities
+        failed permanently keep their error results. If all the entities are
+        still in failed batches after the retries, the error is raised.
+
+        Args:
+            method: string, HTTP method, e.g., 'POST', 'PUT'.
+            entity_type: string, type of the entity, e.g., 'adGroups'.
+            data: dict[], list of entities.
+            status_code: int, status code of a successful response.
+
+        Return:
+            A list of per-entity results, e.g.,
+                [
+                    {'code': 'SUCCESS', 'keywordId': <keyword id>},
+                    {'code': 'INVALID_ARGUMENT', 'description': <details>},
+                ]
+
+        Raises:
+            AdsAPIError: all the batches failed.
+        """
+        url = self.api_endpoint % entity_type
+        results, errors = self._mutate_batches(
+            method, url, data, status_code)
+
+        delay = self._BATCH_RETRY_DELAY
+        for _ in range(self._BATCH_RETRIES):
+            retry_indexes = [
+                i for i, result in enumerate(results)
+                if self._is_retryable_result(method, result)]
+            if not retry_indexes:
+                break
+
+            time.sleep(delay * random.uniform(1, 1.5))
+            delay *= 2
+            logger.info('Retry %s %d of %d %s.', method, len(retry_indexes),
+                        len(data), entity_type)
+            retry_results, retry_errors = self._mutate_batches(
+                method, url, [data[i] for i in retry_indexes], status_code)
+            for i, result, error in zip(
+                    retry_indexes, retry_results, retry_errors):
+                results[i] = result
+                errors[i] = error
+
+        self._raise_batch_errors(errors)
+        return results
+
+    @staticmethod
+    def _raise_batch_errors(errors):
+        """Raise the error of the batches if all the entities failed in them.
+
+        Args:
+            errors: AdsAPIError[], error of the batch of each entity, None
+                if the batch succeeded.
+        """
+        if errors and all(errors):
+            raise errors[0]
+
+    def _is_retryable_result(self, method, result):
+        """Check if a per-entity result failed with a transient error.
+
+        Args:
+            method: string, HTTP method, e.g., 'POST', 'PUT'.
+            result: dict, per-entity result of a multi-status response.
+        """
+        if method == 'POST':
+            codes = self._RETRYABLE_CREATE_ERROR_CODES
+        else:
+            codes = self._RETRYABLE_ERROR_CODES
+        return (isinstance(result, dict) and
+                str(result.get('code')) in codes)
+
+    @staticmethod
+    def _get_batch_error_results(error, batch):
+        """Get the per-entity results of a failed batch."""
+        return [{'code': str(error.args[0]), 'description': error.args[1]}
+                for _ in batch]
+
+    def _mutate_batches(self, method, url, data, status_code):
+        """Send entities in concurrent batches and merge their results.
+
+        Args:
+            method: string, HTTP method, e.g., 'POST', 'PUT'.
+            url: string, URL endpoint of the entities.
+            data: dict[], list of entities.
+            status_code: int, status code of a successful response.
+
+        Return:
+            A list of per-entity results in the order of the data, and a
+            list of the AdsAPIError of the batch of each entity, None if the
+            batch succeeded.
+        """
+        batches = [data[i:i + self._BATCH_SIZE]
+                   for i in range(0, len(data), self._BATCH_SIZE)]
+        pool = None
+        if len(batches) > 1:
+            pool = ThreadPool(min(self._BATCH_WORKERS, len(batches)))
+        try:
+            if pool:
+                async_results = [
+                    pool.apply_async(
+                        self._mutate_batch,
+                        (method, url, batch, status_code))
+                    for batch in batches]
+                get_results = [r.get for r in async_results]
+            else:
+                get_results = [
+                    lambda batch=batch: self._mutate_batch(
+                        method, url, batch, status_code)
+                    for batch in batches]
+            results = []
+            errors = []
+            for batch, get_result in zip(batches, get_results):
+                try:
+                    results.extend(get_result())
+                    errors.extend(None for _ in batch)
+                except AdsAPIError as e:
+                    logger.error('Failed to %s %d entities to %s: %s',
+                                 method, len(batch), url, e)
+                    results.extend(self._get_batch_error_results(e, batch))
+                    errors.extend(e for _ in batch)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        return results, errors
+
+    def _mutate_batch(self, method, url, data, status_code):
+        """Send a batch of entities to create, update or archive.
+
+        Args:
+            method: string, HTTP method, e.g., 'POST', 'PUT'.
+            url: string, URL endpoint of the entities.
+            data: dict[], list of entities.
+            status_code: int, status code of a successful response.
+
+        Return:
+            A list of per-entity results.
+
+        Raises:
+            AdsAPIError: the response is not successful, or not JSON.
+        """
+        headers = self._rebuild_auth()
+        response = self._send(
+            method, url, data=json.dumps(data), headers=headers)
+        try:
+            response_json = response.json()
+        except ValueError:
+            raise AdsAPIError(response.status_code, response.text)
+        if response.status_code != status_code:
             raise AdsAPIError(
-                response.status_code, response.json()['details'])
+                response.status_code,
+                AdsAPIClient._get_error_details(response_json, response.text))
+
+        return response_json
+
+    @staticmethod
+    def _get_error_details(response_json, text):
+        """Get the details of an error response, its text if missing.
+
+        Args:
+            response_json: the decoded body of the response.
+            text: string, body of the response.
+        """
+        if isinstance(response_json, dict) and response_json.get('details'):
+            return response_json['details']
+        return text
+
+    @staticmethod
+    def _get_report_poller():
+        """Get the report poller shared by all clients, create it if not."""
+        with AdsAPIClient._report_poller_lock:
+            if AdsAPIClient._report_poller is None:
+                AdsAPIClient._report_poller = ReportPoller(
+                    workers=AdsAPIClient._REPORT_WORKERS)
+        return AdsAPIClient._report_poller
+
+    def _get_report_cache_key(self, entity_type, report_date, query=None):
+        """Get the report cache and the key if the report can be cached.
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+
+        Return:
+            The ReportCache and the key of the report, or (None, None) if
+            caching is disabled or the report is not finalized yet.
+        """
+        cache = AdsAPIClient._report_cache
+        if not cache or not cache.is_final(report_date):
+            return (None, None)
+
+        return (cache, cache.get_key(self.profile_id, entity_type,
+                                     report_date, query, self.REPORT_METRICS))
+
+    def _request_report(self, entity_type, report_date, query=None):
+        """Request a performance report to be generated.
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+
+        Return:
+            ID of the requested report.
+        """
+        url = self.api_endpoint % (entity_type + '/report')
+        data = {
+            'campaignType': 'sponsoredProducts',
+            'segment': query,
+            'reportDate': report_date,
+            'metrics': self.REPORT_METRICS,
+        }
+        headers = self._rebuild_auth()
+        response = self._send('POST', url, headers=headers, json=data)
+        if response.status_code != 202:
+            logger.exception(response.content)
+            raise AdsAPIError(response.status_code, response.content)
+
+        return response.json()['reportId']
+
+    def _get_report_status(self, report_id):
+        """Get the status of a requested report.
+
+        Args:
+            report_id: string, ID of the report.
+
+        Return:
+            The status (e.g., IN_PROGRESS, SUCCESS, FAILURE; None if the
+            report is not found) and the download location of the report.
+        """
+        url = self.api_endpoint % (
+            self.ENTITY_TYPE_REPORTS + '/' + report_id)
+        headers = self._rebuild_auth()
+        response = self._send('GET', url, headers=headers)
+        response_json = response.json()
+        if response.status_code == 200:
+            if response_json['status'] == 'SUCCESS':
+                logger.info(response_json)
+            return (response_json['status'], response_json.get('location'))
+
+        logger.error(response_json)
+        if (response.status_code == 404 and
+                response_json.get('code') == 'NOT_FOUND'):
+            return (None, None)
+        raise AdsAPIError(response.status_code, response.content)
+
+    def _download_report(self, download_uri):
+        """Download a generated report.
+
+        Args:
+            download_uri: string, location of the report.
+
+        Return:
+            A performance report.
+        """
+        return list(self._iter_report_rows(download_uri))
 
-        return response.json()
+    def _iter_report_rows(self, download_uri):
+        """Download a generated report and decode it row by row.
+
+        The report is decompressed and parsed while it is downloaded, so the
+        memory used does not grow with the size of the report.
+
+        Args:
+            download_uri: string, location of the report.
+
+        Return:
+            An iterator of the rows of the performance report.
+        """
+        headers = self._rebuild_auth(content_type=None)
+        response = self._send(
+            'GET', download_uri, headers=headers, stream=True)
+        try:
+            if response.status_code != 200:
+                logger.exception(response.content)
+                raise AdsAPIError(response.status_code, response.content)
+
+            for row in iter_gzip_json_array(
+                    response.iter_content(self._REPORT_CHUNK_SIZE)):
+                yield row
+        finally:
+            response.close()
+
+    def _send(self, method, url, **kwargs):
+        """Send a request under the rate limits of the profile and region.
+
+        Args:
+            method: string, HTTP method, e.g., 'GET', 'PUT'.
+            url: string.
+            kwargs: keyword arguments of requests.Session.request().
+
+        Return:
+            An object of type requests.Response.
+        """
+        keys = (('region', self.api_endpoint),
+                ('profile', self.api_endpoint, self.profile_id))
+        return AdsAPIClient._send_scheduled(
+            keys, self.session, method, url, **kwargs)
+
+    @staticmethod
+    def _send_scheduled(keys, session, method, url, **kwargs):
+        """Send a request once the rate limits of the keys allow it.
+
+        Throttled requests are retried after Retry-After seconds, or after an
+        exponential backoff, up to _THROTTLE_RETRIES times.
+
+        Args:
+            keys: tuple[], keys of the rate limits, refer to RequestScheduler.
+            session: requests.Session.
+            method: string, HTTP method, e.g., 'GET', 'PUT'.
+            url: string.
+            kwargs: keyword arguments of requests.Session.request().
+
+        Return:
+            An object of type requests.Response, the last one if throttled.
+        """
+        scheduler = AdsAPIClient._scheduler
+        delay = AdsAPIClient._THROTTLE_DELAY
+        start_time = time.time()
+        for retry in range(AdsAPIClient._THROTTLE_RETRIES + 1):
+            scheduler.acquire(keys)
+            response = session.request(method, url, **kwargs)
+            if response.status_code != 429:
+                scheduler.succeeded(keys)
+                break
+
+            retry_after = RequestScheduler.parse_retry_after(
+                response.headers.get('Retry-After'))
+            scheduler.throttled(keys, retry_after or delay)
+            delay *= 2
+            logger.warning('Throttled %s %s, retry %d after %s seconds.',
+                           method, url, retry + 1, retry_after or delay / 2)
+
+        AdsAPIClient._record_request(
+            method, url, kwargs.get('params'), response,
+            time.time() - start_time, retry, kwargs.get('stream'))
+        return response
+
+    @staticmethod
+    def _record_request(method, url, params, response, seconds, retries,
+                        stream=False):
+        """Record the metrics of a request.
+
+        Args:
+            method: string, HTTP method, e.g., 'GET', 'PUT'.
+            url: string.
+            params: dict, query parameters, with the paging if any.
+            response: requests.Response, the last response.
+            seconds: float, latency of the request including its retries.
+            retries: int, number of retries of the throttled request.
+            stream: boolean, True if the body is not read yet, its size is
+                then taken from the Content-Length header.
+        """
+        request = getattr(response, 'request', None)
+        body = request.body if request is not None else None
+        if stream:
+            length = response.headers.get('Content-Length')
+            bytes_received = int(length) if length else None
+        else:
+            bytes_received = len(response.content or b'')
+        page = None
+        if params and params.get('count') and 'startIndex' in params:
+            page = int(params['startIndex']) // int(params['count'])
+        AdsAPIClient._metrics.record(
+            'amazon', AdsAPIClient._get_service_name(url), method,
+            response.status_code, seconds,
+            bytes_sent=len(body) if body else 0,
+            bytes_received=bytes_received, retries=retries, page=page)
+
+    @staticmethod
+    def _get_service_name(url):
+        """Get the endpoint of a URL without IDs, e.g., 'reports/{id}'.
+
+        Args:
+            url: string.
+        """
+        if url == AdsAPIClient._API_ENDPOINT_TOKEN:
+            return 'token'
+        path = urlparse(url).path
+        if '/v1/' in path:
+            path = path.split('/v1/', 1)[1]
+        return '/'.join(
+            '{id}' if part[:1].isdigit() or '.' in part else part
+            for part in path.strip('/').split('/'))
+
+    def _update_entities(self, entity_type, data):
+        """Update entities, e.g., Campaign, Ad Group.
+
+        Args:
+            entity_type: string, type of the entity, e.g., 'adGroups'.
+            data: dict[], list of data to be updated.
+
+        Return:
+            Updated entities.
+        """
+        return self._mutate_entities('PUT', entity_type, data, 207)
@@ -0,0 +1,1084 @@
+"""
+Asyncio implementation of Amazon Advertising API. Refer to:
+https://advertising.amazon.com/API
+
+AsyncAdsAPIClient mirrors the public methods of AdsAPIClient as coroutines
+on pooled aiohttp sessions, so one event loop can drive the requests of many
+profiles without a thread per request. Access tokens, rate limits and the
+report cache are shared with the blocking clients of the process.
+
+Requires Python 3.6+ and aiohttp.
+"""
+import asyncio
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import random
+import time
+
+try:
+    import aiohttp
+except ImportError:     # Optional, only required by AsyncAdsAPIClient.
+    aiohttp = None
+
+from .amazon_ads_api import AccessTokenCache
+from .amazon_ads_api import AdsAPIClient
+from .amazon_ads_api import AdsAPIError
+from .rate_limiter import RequestScheduler
+from .report_columns import ColumnarReport
+from .report_stream import ReportDecoder
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAdsAPIClient(AdsAPIClient):
+    """Coroutine counterpart of AdsAPIClient.
+
+    Search parameters and entity data are built as in AdsAPIClient; all
+    the I/O (token refresh, paging, mutations, report polling and download)
+    runs on the event loop.
+    """
+
+    _PAGE_WORKERS = 4           # Pages fetched concurrently, tasks are cheap.
+
+    # Connection pool of the aiohttp session of each regional endpoint.
+    _CONNECTOR_LIMIT = 100      # Maximum connections per session.
+    _KEEPALIVE_TIMEOUT = 30     # Seconds an idle connection is kept.
+    _REQUEST_TIMEOUT = 300      # Seconds before a request is given up.
+
+    # Polling of the generated reports, refer to ReportPoller.
+    _REPORT_MIN_INTERVAL = 1.0
+    _REPORT_MAX_INTERVAL = 30.0
+    _REPORT_BACKOFF = 1.5
+    _REPORT_TIMEOUT = 600
+
+    _async_sessions = {}        # Keyed by (event loop, endpoint).
+    _token_locks = {}           # Keyed by (event loop, refresh token).
+
+    def __init__(self, profile_id, country, access_token, refresh_token,
+                 token_time, expires_in=3600):
+        self.profile_id = str(profile_id)
+        self.api_endpoint = AdsAPIClient._COUNTRY_TO_ENDPOINT_MAP[country]
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.token_time = token_time
+        self.expires_in = expires_in
+        self.headers = None
+        self._headers_cache = {}
+
+    @staticmethod
+    def get_session(api_endpoint):
+        """Get the aiohttp session of the endpoint on the running loop.
+
+        Sessions are created on first use and shared by all clients of the
+        endpoint on the same event loop.
+
+        Args:
+            api_endpoint: string, e.g., _API_ENDPOINT_NA.
+
+        Returns:
+            An object of type aiohttp.ClientSession.
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for AsyncAdsAPIClient.')
+
+        key = (asyncio.get_event_loop(), api_endpoint)
+        session = AsyncAdsAPIClient._async_sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=AsyncAdsAPIClient._CONNECTOR_LIMIT,
+                keepalive_timeout=AsyncAdsAPIClient._KEEPALIVE_TIMEOUT)
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=AsyncAdsAPIClient._REQUEST_TIMEOUT))
+            AsyncAdsAPIClient._async_sessions[key] = session
+        return session
+
+    @staticmethod
+    async def close_sessions():
+        """Close the sessions of the running loop, e.g., before it stops."""
+        loop = asyncio.get_event_loop()
+        for key in list(AsyncAdsAPIClient._async_sessions):
+            if key[0] is loop:
+                session = AsyncAdsAPIClient._async_sessions.pop(key)
+                await session.close()
+        for key in list(AsyncAdsAPIClient._token_locks):
+            if key[0] is loop:
+                del AsyncAdsAPIClient._token_locks[key]
+
+    @staticmethod
+    async def refresh_access_token(refresh_token, access_token=None,
+                                   token_time=None):
+        """Refresh access token using the refresh token.
+
+        Tasks of the same refresh token wait on one refresh. The tokens are
+        cached with those of the blocking clients, and saved to the token
+        store if any.
+
+        Args:
+            refresh_token: string.
+            access_token: string.
+            token_time: float, in UTC time.
+
+        Returns:
+            Access token and token time (UTC).
+        """
+        cache = AdsAPIClient._token_cache
+        token = cache.peek(refresh_token, access_token, token_time)
+        if token[0]:
+            return token
+
+        key = (asyncio.get_event_loop(), refresh_token)
+        lock = AsyncAdsAPIClient._token_locks.get(key)
+        if lock is None:
+            lock = AsyncAdsAPIClient._token_locks[key] = asyncio.Lock()
+        async with lock:
+            # Another task may have refreshed while this one was waiting.
+            token = cache.peek(refresh_token)
+            if token[0]:
+                return token
+
+            if cache.store:
+                token = await AsyncAdsAPIClient._refresh_with_store(
+                    cache.store, refresh_token)
+                cache.put(refresh_token, token[0], token[1], save=False)
+            else:
+                token = await AsyncAdsAPIClient._request_access_token(
+                    refresh_token)
+                cache.put(refresh_token, token[0], token[1])
+        return token
+
+    @staticmethod
+    async def _refresh_with_store(store, refresh_token):
+        """Get the token of the store if fresh, otherwise refresh it under
+        the lock of the store, as AccessTokenCache does for the blocking
+        clients, so that one process refreshes it.
+
+        The store is blocking, it is used from the default executor.
+
+        Args:
+            store: TokenStore.
+            refresh_token: string.
+
+        Returns:
+            Access token and token time (UTC).
+        """
+        cache = AdsAPIClient._token_cache
+        loop = asyncio.get_event_loop()
+        token = await loop.run_in_executor(None, store.load, refresh_token)
+        if token[0] and cache.is_fresh(token[1]):
+            return token
+
+        store_lock = store.lock(refresh_token)
+        acquired = loop.run_in_executor(None, store_lock.__enter__)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # Release the lock once the worker thread gets it.
+            acquired.add_done_callback(
+                lambda f: f.exception() is None and store_lock.__exit__(
+                    None, None, None))
+            raise
+        try:
+            # Another process may have refreshed while this one was waiting.
+            token = await loop.run_in_executor(
+                None, store.load, refresh_token)
+            if not (token[0] and cache.is_fresh(token[1])):
+                token = await AsyncAdsAPIClient._request_access_token(
+                    refresh_token)
+                await loop.run_in_executor(
+                    None, store.save, refresh_token, token[0], token[1])
+        finally:
+            await loop.run_in_executor(
+                None, store_lock.__exit__, None, None, None)
+        return token
+
+    @staticmethod
+    async def _request_access_token(refresh_token):
+        """Request a new access token from the token endpoint.
+
+        Args:
+            refresh_token: string.
+
+        Returns:
+            Access token and token time (UTC).
+        """
+        session = AsyncAdsAPIClient.get_session(
+            AdsAPIClient._API_ENDPOINT_TOKEN)
+        async with session.post(
+                AdsAPIClient._API_ENDPOINT_TOKEN,
+                data={
+                    'grant_type': 'refresh_token',
+                    'client_id': 'Your Client ID',
+                    'client_secret': 'Your Client Secret',
+                    'refresh_token': refresh_token,
+                },
+                headers={
+                    'Content-Type':
+                    'application/x-www-form-urlencoded;charset=UTF-8',
+                }) as response:
+            content = await response.read()
+        if response.status != 200:
+            raise AdsAPIError(response.status, content)
+
+        return (json.loads(content.decode('utf-8')).get('access_token'),
+                AccessTokenCache.now())
+
+    @staticmethod
+    async def get_profiles(refresh_token):
+        """Get the seller's profiles.
+
+        Args:
+            refresh_token: string.
+
+        Return:
+            List of the seller's profiles.
+        """
+        access_token, _ = await AsyncAdsAPIClient.refresh_access_token(
+            refresh_token)
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer ' + access_token,
+        }
+
+        async def get_region_profiles(api_endpoint):
+            status, profiles = await AsyncAdsAPIClient._request_json(
+                (('region', api_endpoint), ),
+                AsyncAdsAPIClient.get_session(api_endpoint), 'GET',
+                api_endpoint % AdsAPIClient.ENTITY_TYPE_PROFILES,
+                headers=headers)
+            return profiles if status == 200 else []
+
+        region_profiles = await asyncio.gather(
+            get_region_profiles(AdsAPIClient._API_ENDPOINT_NA),
+            get_region_profiles(AdsAPIClient._API_ENDPOINT_EU))
+        return [profile for profiles in region_profiles
+                for profile in profiles]
+
+    async def _rebuild_auth(self, content_type='application/json'):
+        """Rebuild authentication headers.
+
+        Args:
+            content_type: string, typically 'application/json'.
+
+        Returns:
+            The authentication headers, which are also kept in self.headers.
+        """
+        access_token, self.token_time = (
+            await AsyncAdsAPIClient.refresh_access_token(
+                self.refresh_token, self.access_token, self.token_time))
+        if access_token != self.access_token:
+            self.access_token = access_token
+            self._headers_cache = {}
+
+        headers = self._headers_cache.get(content_type)
+        if headers is None:
+            headers = {'Authorization': 'Bearer ' + self.access_token,
+                       'Amazon-Advertising-API-Scope': self.profile_id}
+            if content_type:
+                headers['Content-Type'] = content_type
+            self._headers_cache[content_type] = headers
+        self.headers = headers
+        return headers
+
+    async def create_ad(self, campaign_id, adgroup_id, sku, state='enabled'):
+        """Create a product ad, refer to AdsAPIClient.create_ad()."""
+        data = [
+            {
+                'campaignId': campaign_id,
+                'adGroupId': adgroup_id,
+                'sku': sku,
+                'state': state,
+            }
+        ]
+        results = await self._create_entities(
+            self.ENTITY_TYPE_PRODUCT_ADS, data)
+        return results[0]
+
+    async def create_adgroup(self, campaign_id, default_bid, name=None,
+                             state='enabled'):
+        """Create an ad group, refer to AdsAPIClient.create_adgroup()."""
+        data = [
+            {
+                'campaignId': campaign_id,
+                'name': name or ('Ad Group #' +
+                                 datetime.utcnow().strftime('%Y%m%d%H%M%S%f')),
+                'state': state,
+                'defaultBid': max(float(default_bid), AdsAPIClient.MIN_BID),
+            }
+        ]
+        results = await self._create_entities(
+            self.ENTITY_TYPE_AD_GROUPS, data)
+        return results[0]
+
+    async def create_campaign(self, name, daily_budget, start_date,
+                              end_date=None, state='enabled',
+                              campaign_type='sponsoredProducts',
+                              targeting_type='manual'):
+        """Create a campaign, refer to AdsAPIClient.create_campaign()."""
+        data = {
+            'name': name,
+            'dailyBudget': max(
+                float(daily_budget), AdsAPIClient.MIN_DAILY_BUDGET),
+            'startDate': start_date,
+            'state': state,
+            'campaignType': campaign_type,
+            'targetingType': targeting_type,
+        }
+        if end_date:
+            data['endDate'] = end_date
+
+        results = await self._create_entities(
+            self.ENTITY_TYPE_CAMPAIGNS, [data])
+        return results[0]
+
+    async def create_keywords(self, campaign_id, adgroup_id, keyword_texts,
+                              match_type='phrase', state='enabled',
+                              is_biddable=True, bid=None):
+        """Create keywords, refer to AdsAPIClient.create_keywords()."""
+        return await self._await(AdsAPIClient.create_keywords(
+            self, campaign_id, adgroup_id, keyword_texts, match_type, state,
+            is_biddable, bid))
+
+    async def create_keywords_v2(self, data, is_biddable=True):
+        """Create keywords, refer to AdsAPIClient.create_keywords_v2()."""
+        return await self._await(
+            AdsAPIClient.create_keywords_v2(self, data, is_biddable))
+
+    async def delete_ads(self, ad_ids):
+        """Delete product ads, refer to AdsAPIClient.delete_ads()."""
+        return await AdsAPIClient.delete_ads(self, ad_ids)
+
+    async def delete_adgroups(self, adgroup_ids):
+        """Delete adgroups, refer to AdsAPIClient.delete_adgroups()."""
+        return await AdsAPIClient.delete_adgroups(self, adgroup_ids)
+
+    async def delete_campaigns(self, campaign_ids):
+        """Delete campaigns, refer to AdsAPIClient.delete_campaigns()."""
+        return await AdsAPIClient.delete_campaigns(self, campaign_ids)
+
+    async def get_ads(self, *args, **kwargs):
+        """Get a list of product ads, refer to AdsAPIClient.get_ads()."""
+        entity_type, params = self._get_ads_query(*args, **kwargs)
+        return await self._get_entities(entity_type, params)
+
+    async def get_adgroups(self, *args, **kwargs):
+        """Get a list of ad groups, refer to AdsAPIClient.get_adgroups()."""
+        entity_type, params = self._get_adgroups_query(*args, **kwargs)
+        return await self._get_entities(entity_type, params)
+
+    async def get_campaign_by_id(self, campaign_id,
+                                 load_extended_fields=True,
+                                 load_nested_ads=False,
+                                 load_nested_keywords=False):
+        """Get campaign details by campaign ID.
+
+        Refer to AdsAPIClient.get_campaign_by_id() for the arguments.
+
+        Return:
+            A dict of campaign details.
+        """
+        if not campaign_id:
+            return None
+
+        if load_nested_ads or load_nested_keywords:
+            campaigns = await self.get_campaign_trees(
+                [campaign_id], load_extended_fields=load_extended_fields,
+                load_nested_ads=load_nested_ads,
+                load_nested_keywords=load_nested_keywords,
+                load_nested_negative_keywords=False)
+        else:
+            campaigns = await self.get_campaigns(
+                campaign_ids=[campaign_id],
+                load_extended_fields=load_extended_fields)
+        return campaigns[0] if campaigns else None
+
+    async def get_campaign_trees(self, campaign_ids,
+                                 load_extended_fields=True,
+                                 load_nested_ads=True,
+                                 load_nested_keywords=True,
+                                 load_nested_negative_keywords=True):
+        """Get campaigns with their ad groups, ads and keywords nested.
+
+        Refer to AdsAPIClient.get_campaign_trees(); the levels are fetched
+        as concurrent tasks.
+        """
+        if not campaign_ids:
+            return []
+
+        queries = [
+            self._get_campaigns_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields),
+            self._get_adgroups_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields),
+        ]
+        nested_keys = []
+        if load_nested_ads:
+            nested_keys.append('ads')
+            queries.append(self._get_ads_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields))
+        if load_nested_keywords:
+            nested_keys.append('keywords')
+            queries.append(self._get_keywords_query(
+                campaign_ids=campaign_ids,
+                load_extended_fields=load_extended_fields))
+        if load_nested_negative_keywords:
+            nested_keys.append('negativeKeywords')
+            queries.append(self._get_keywords_query(
+                campaign_ids=campaign_ids, is_biddable=False,
+                load_extended_fields=load_extended_fields))
+
+        results = await asyncio.gather(
+            *[self._get_entities(*query) for query in queries])
+
+        campaigns, adgroups = results[:2]
+        self._merge_up_entities(campaigns, adgroups, 'campaignId', 'adgroups')
+        for key, entities in zip(nested_keys, results[2:]):
+            self._merge_up_entities(adgroups, entities, 'adGroupId', key)
+        return campaigns
+
+    async def get_campaigns(self, *args, **kwargs):
+        """Get a list of campaigns, refer to AdsAPIClient.get_campaigns().
+
+        Return:
+            A list of campaigns.
+        """
+        entity_type, params = self._get_campaigns_query(*args, **kwargs)
+        return await self._get_entities(entity_type, params)
+
+    async def get_keywords(self, *args, **kwargs):
+        """Get a list of keywords, refer to AdsAPIClient.get_keywords()."""
+        entity_type, params = self._get_keywords_query(*args, **kwargs)
+        return await self._get_entities(entity_type, params)
+
+    async def get_report(self, entity_type, report_date, query=None,
+                         columnar=False):
+        """Get performance report of campaigns/adGroups/...
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+            columnar: boolean, if True, return the report as NumPy columns.
+
+        Return:
+            A performance report, a list of rows or a ColumnarReport.
+        """
+        rows = [row async for row in self.iter_report(
+            entity_type, report_date, query)]
+        if columnar:
+            return ColumnarReport.from_rows(rows, self.REPORT_METRICS)
+        return rows
+
+    async def iter_report(self, entity_type, report_date, query=None):
+        """Get performance report rows as they are downloaded.
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+
+        Return:
+            An asynchronous iterator of the rows of the performance report.
+        """
+        cache, key = self._get_report_cache_key(
+            entity_type, report_date, query)
+        if cache:
+            rows = cache.load(key)
+            if rows is not None:
+                for row in rows:
+                    yield row
+                return
+
+        report_id = await self._request_report(
+            entity_type, report_date, query)
+        download_uri = await self._wait_report(report_id)
+        if not download_uri:
+            return
+
+        if not cache:
+            async for row in self._iter_report_rows(download_uri):
+                yield row
+            return
+
+        # Cache the rows as they are yielded, a report left partially read
+        # or failed is not cached.
+        writer = cache.open_writer(key)
+        try:
+            async for row in self._iter_report_rows(download_uri):
+                writer.write(row)
+                yield row
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def iter_ads(self, by_page=False, **kwargs):
+        """Iterate product ads as they are downloaded page by page.
+
+        Refer to AdsAPIClient.iter_ads() for the arguments.
+
+        Return:
+            An asynchronous iterator of product ads, or of pages of them.
+        """
+        entity_type, params = self._get_ads_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def iter_adgroups(self, by_page=False, **kwargs):
+        """Iterate ad groups as they are downloaded page by page.
+
+        Refer to AdsAPIClient.iter_adgroups() for the arguments.
+
+        Return:
+            An asynchronous iterator of ad groups, or of pages of them.
+        """
+        entity_type, params = self._get_adgroups_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def iter_campaigns(self, by_page=False, **kwargs):
+        """Iterate campaigns as they are downloaded page by page.
+
+        Refer to AdsAPIClient.iter_campaigns() for the arguments.
+
+        Return:
+            An asynchronous iterator of campaigns, or of pages of them.
+        """
+        entity_type, params = self._get_campaigns_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def iter_keywords(self, by_page=False, **kwargs):
+        """Iterate keywords as they are downloaded page by page.
+
+        Refer to AdsAPIClient.iter_keywords() for the arguments.
+
+        Return:
+            An asynchronous iterator of keywords, or of pages of them.
+        """
+        entity_type, params = self._get_keywords_query(**kwargs)
+        return self._iter_entities(entity_type, params, by_page=by_page)
+
+    def submit_report(self, entity_type, report_date, query=None):
+        """Request a performance report without waiting for it.
+
+        Args:
+            entity_type: string, type of entity, refer to: _ENTITY_TYPE_*.
+            report_date: string, in format: 'YYYYMMDD'.
+            query: string, it can only be used in Keyword reports.
+
+        Return:
+            An asyncio task, whose result is the performance report.
+        """
+        return asyncio.ensure_future(
+            self.get_report(entity_type, report_date, query))
+
+    async def update_ad(self, ad_id, state=None):
+        """Update a product ad, refer to AdsAPIClient.update_ad()."""
+        return await self._await(AdsAPIClient.update_ad(self, ad_id, state))
+
+    async def update_adgroup(self, adgroup_id, name=None, default_bid=None,
+                             state=None):
+        """Update an ad group, refer to AdsAPIClient.update_adgroup()."""
+        return await self._await(AdsAPIClient.update_adgroup(
+            self, adgroup_id, name, default_bid, state))
+
+    async def update_campaign(self, campaign_id, name=None, state=None,
+                              daily_budget=None, start_date=None,
+                              end_date=None, premium_bid_adjustment=None):
+        """Update a campaign, refer to AdsAPIClient.update_campaign()."""
+        return await self._await(AdsAPIClient.update_campaign(
+            self, campaign_id, name, state, daily_budget, start_date,
+            end_date, premium_bid_adjustment))
+
+    async def update_keywords(self, keyword_ids, bid=None, state=None,
+                              is_biddable=True):
+        """Update keywords, refer to AdsAPIClient.update_keywords()."""
+        return await self._await(AdsAPIClient.update_keywords(
+            self, keyword_ids, bid, state, is_biddable))
+
+    async def update_keywords_v2(self, data, is_biddable=True):
+        """Update keywords, refer to AdsAPIClient.update_keywords_v2()."""
+        return await self._await(
+            AdsAPIClient.update_keywords_v2(self, data, is_biddable))
+
+    @staticmethod
+    async def _await(result):
+        """Await the mutation started by a method of AdsAPIClient, which
+        returns None when there is nothing to mutate."""
+        if result is None:
+            return None
+        return await result
+
+    def _delete_entities(self, entity_type, entity_id_field, entity_ids):
+        """Archive entities as deleted.
+
+        Refer to AdsAPIClient._delete_entities().
+        """
+        data = [{entity_id_field: int(entity_id), 'state': 'archived'}
+                for entity_id in entity_ids]
+        return self._mutate_entities('PUT', entity_type, data, 200)
+
+    async def _get_entities(self, entity_type, params=None, page_offset=-1,
+                            page_size=AdsAPIClient._PAGE_SIZE,
+                            page_workers=None):
+        """Get entities (e.g., Campaign, Ads).
+
+        Refer to AdsAPIClient._get_entities() for the arguments.
+
+        Return:
+            A list of entities.
+        """
+        url = self.api_endpoint % entity_type
+        params = params or {}
+        if page_offset != -1:
+            return await self._get_page(url, params, page_offset, page_size)
+
+        entities = []
+        async for page in self._iter_pages(
+                url, params, page_size, page_workers):
+            entities.extend(page)
+        return entities
+
+    async def _iter_entities(self, entity_type, params=None, by_page=False,
+                             page_size=AdsAPIClient._PAGE_SIZE,
+                             page_workers=None):
+        """Iterate all entities (e.g., Campaign, Ads) page by page.
+
+        Refer to AdsAPIClient._iter_entities() for the arguments.
+
+        Return:
+            An asynchronous iterator of entities, or of pages of entities
+            if by_page.
+        """
+        url = self.api_endpoint % entity_type
+        # The pages are closed explicitly, so their requests are cancelled
+        # as soon as the caller stops.
+        pages = self._iter_pages(url, params or {}, page_size, page_workers)
+        try:
+            async for page in pages:
+                if by_page:
+                    yield page
+                else:
+                    for entity in page:
+                        yield entity
+        finally:
+            await pages.aclose()
+
+    async def _iter_pages(self, url, params, page_size, page_workers=None):
+        """Iterate all non-empty pages of entities in order.
+
+        Refer to AdsAPIClient._iter_pages(); the sub-queries of a split
+        query run as concurrent tasks, _SPLIT_WORKERS at a time, each
+        waiting once _SPLIT_QUEUE_SIZE of its pages are buffered.
+
+        Return:
+            An asynchronous iterator of lists of entities.
+        """
+        queries = self._split_id_filters(url, params)
+        if len(queries) == 1:
+            pages = self._iter_query_pages(
+                url, params, page_size, page_workers)
+            try:
+                async for page in pages:
+                    yield page
+            finally:
+                await pages.aclose()
+            return
+
+        logger.info('Split query of %s into %d sub-queries.', url,
+                    len(queries))
+
+        async def fetch(query, pages):
+            # Pass the pages of the sub-query to the caller, then None.
+            query_pages = self._iter_query_pages(
+                url, query, page_size, page_workers)
+            try:
+                async for page in query_pages:
+                    await pages.put(page)
+                await pages.put(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await pages.put(e)
+            finally:
+                await query_pages.aclose()
+
+        def start(query):
+            pages = asyncio.Queue(self._SPLIT_QUEUE_SIZE)
+            tasks.append(asyncio.ensure_future(fetch(query, pages)))
+            pending.append(pages)
+
+        id_field = self._get_id_field(url)
+        seen = set()
+        queries = iter(queries)
+        pending = deque()
+        tasks = []
+        try:
+            for query in queries:
+                start(query)
+                if len(pending) == self._SPLIT_WORKERS:
+                    break
+
+            while pending:
+                pages = pending.popleft()
+                page = await pages.get()
+                while page is not None:
+                    if isinstance(page, Exception):
+                        raise page
+                    page = self._drop_seen(page, id_field, seen)
+                    if page:
+                        yield page
+                    page = await pages.get()
+                for query in queries:
+                    start(query)
+                    break
+        finally:
+            # Stop the sub-queries running if the caller stopped early.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _iter_query_pages(self, url, params, page_size,
+                                page_workers=None):
+        """Iterate all non-empty pages of entities of a query in order.
+
+        Pages ahead are requested speculatively as tasks, and the fetching
+        stops at the first short or empty page.
+
+        Args:
+            url: string, URL endpoint of the entities.
+            params: dict, search parameters.
+            page_size: int, maximum number of entities to return in the page.
+            page_workers: int, number of pages fetched concurrently,
+                _PAGE_WORKERS by default.
+
+        Return:
+            An asynchronous iterator of lists of entities.
+        """
+        page_workers = page_workers or self._PAGE_WORKERS
+        pending = deque()
+        start_index = 0
+        try:
+            for _ in range(page_workers):
+                pending.append(asyncio.ensure_future(
+                    self._get_page(url, params, start_index, page_size)))
+                start_index += page_size
+
+            while pending:
+                page = await pending.popleft()
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    break
+                pending.append(asyncio.ensure_future(
+                    self._get_page(url, params, start_index, page_size)))
+                start_index += page_size
+        finally:
+            # Drop the speculative requests beyond the last page.
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _get_page(self, url, params, start_index, page_size):
+        """Get a page of entities.
+
+        Refer to AdsAPIClient._get_page() for the arguments.
+
+        Return:
+            A list of entities, empty if no more entities.
+
+        Raises:
+            AdsAPIError: the page failed.
+        """
+        page_params = dict(params, startIndex=start_index, count=page_size)
+        headers = await self._rebuild_auth()
+        status, page = await self._send(
+            'GET', url, headers=headers, params=page_params)
+        if status != 200 or not isinstance(page, list):
+            raise AdsAPIError(status, page)
+        return page
+
+    async def _mutate_entities(self, method, entity_type, data,
+                               status_code):
+        """Create, update or archive entities in batches.
+
+        Refer to AdsAPIClient._mutate_entities(); the batches are sent as
+        concurrent tasks, and the retries sleep on the event loop.
+        """
+        url = self.api_endpoint % entity_type
+        results, errors = await self._mutate_batches(
+            method, url, data, status_code)
+
+        delay = self._BATCH_RETRY_DELAY
+        for _ in range(self._BATCH_RETRIES):
+            retry_indexes = [
+                i for i, result in enumerate(results)
+                if self._is_retryable_result(method, result)]
+            if not retry_indexes:
+                break
+
+            await asyncio.sleep(delay * random.uniform(1, 1.5))
+            delay *= 2
+            logger.info('Retry %s %d of %d %s.', method, len(retry_indexes),
+                        len(data), entity_type)
+            retry_results, retry_errors = await self._mutate_batches(
+                method, url, [data[i] for i in retry_indexes], status_code)
+            for i, result, error in zip(
+                    retry_indexes, retry_results, retry_errors):
+                results[i] = result
+                errors[i] = error
+
+        self._raise_batch_errors(errors)
+        return results
+
+    async def _mutate_batches(self, method, url, data, status_code):
+        """Send entities in concurrent batches and merge their results.
+
+        Refer to AdsAPIClient._mutate_batches().
+        """
+        batches = [data[i:i + self._BATCH_SIZE]
+                   for i in range(0, len(data), self._BATCH_SIZE)]
+        slots = asyncio.Semaphore(self._BATCH_WORKERS)
+
+        async def mutate_batch(batch):
+            async with slots:
+                return await self._mutate_batch(
+                    method, url, batch, status_code)
+
+        batch_results = await asyncio.gather(
+            *[mutate_batch(batch) for batch in batches],
+            return_exceptions=True)
+        results = []
+        errors = []
+        for batch, batch_result in zip(batches, batch_results):
+            if isinstance(batch_result, AdsAPIError):
+                logger.error('Failed to %s %d entities to %s: %s',
+                             method, len(batch), url, batch_result)
+                results.extend(
+                    self._get_batch_error_results(batch_result, batch))
+                errors.extend(batch_result for _ in batch)
+            elif isinstance(batch_result, BaseException):
+                raise batch_result
+            else:
+                results.extend(batch_result)
+                errors.extend(None for _ in batch)
+
+        return results, errors
+
+    async def _mutate_batch(self, method, url, data, status_code):
+        """Send a batch of entities to create, update or archive.
+
+        Refer to AdsAPIClient._mutate_batch().
+        """
+        headers = await self._rebuild_auth()
+        status, response_json = await self._send(
+            method, url, data=json.dumps(data), headers=headers)
+        if status != status_code:
+            raise AdsAPIError(status, self._get_error_details(
+                response_json, json.dumps(response_json)))
+
+        return response_json
+
+    async def _request_report(self, entity_type, report_date, query=None):
+        """Request a performance report to be generated.
+
+        Refer to AdsAPIClient._request_report().
+        """
+        url = self.api_endpoint % (entity_type + '/report')
+        data = {
+            'campaignType': 'sponsoredProducts',
+            'segment': query,
+            'reportDate': report_date,
+            'metrics': self.REPORT_METRICS,
+        }
+        headers = await self._rebuild_auth()
+        status, response_json = await self._send(
+            'POST', url, headers=headers, json=data)
+        if status != 202:
+            logger.error(response_json)
+            raise AdsAPIError(status, response_json)
+
+        return response_json['reportId']
+
+    async def _get_report_status(self, report_id):
+        """Get the status of a requested report.
+
+        Refer to AdsAPIClient._get_report_status().
+        """
+        url = self.api_endpoint % (
+            self.ENTITY_TYPE_REPORTS + '/' + report_id)
+        headers = await self._rebuild_auth()
+        status, response_json = await self._send('GET', url, headers=headers)
+        if not isinstance(response_json, dict):
+            # Empty or unexpected body, e.g., of a gateway error.
+            raise AdsAPIError(status, response_json)
+        if status == 200:
+            return (response_json['status'], response_json.get('location'))
+
+        logger.error(response_json)
+        if status == 404 and response_json.get('code') == 'NOT_FOUND':
+            return (None, None)
+        raise AdsAPIError(status, response_json)
+
+    async def _wait_report(self, report_id):
+        """Poll the status of a report until it is generated.
+
+        The interval between two checks grows by _REPORT_BACKOFF, as with
+        the ReportPoller of the blocking clients.
+
+        Args:
+            report_id: string, ID of the report.
+
+        Return:
+            The download location, None if the report failed or timed out.
+        """
+        interval = self._REPORT_MIN_INTERVAL
+        deadline = time.time() + self._REPORT_TIMEOUT
+        while True:
+            await asyncio.sleep(interval)
+            status, location = await self._get_report_status(report_id)
+            if status == 'SUCCESS':
+                return location
+            if status != 'IN_PROGRESS':
+                logger.error('Report %s is %s.', report_id, status)
+                return None
+            if time.time() > deadline:
+                logger.error('Report %s timed out.', report_id)
+                return None
+            interval = min(interval * self._REPORT_BACKOFF,
+                           self._REPORT_MAX_INTERVAL)
+
+    async def _iter_report_rows(self, download_uri):
+        """Download a generated report and decode it row by row.
+
+        Args:
+            download_uri: string, location of the report.
+
+        Return:
+            An asynchronous iterator of the rows of the performance report.
+        """
+        headers = await self._rebuild_auth(content_type=None)
+        response = await self._send_scheduled(
+            self._get_rate_keys(), self.get_session(self.api_endpoint),
+            'GET', download_uri, headers=headers)
+        try:
+            if response.status != 200:
+                content = await response.read()
+                logger.error(content)
+                raise AdsAPIError(response.status, content)
+
+            decoder = ReportDecoder()
+            async for chunk in response.content.iter_chunked(
+                    self._REPORT_CHUNK_SIZE):
+                for row in decoder.feed(chunk):
+                    yield row
+            for row in decoder.close():
+                yield row
+        finally:
+            response.release()
+
+    def _get_rate_keys(self):
+        """Get the keys of the rate limits of the profile and region."""
+        return (('region', self.api_endpoint),
+                ('profile', self.api_endpoint, self.profile_id))
+
+    async def _send(self, method, url, **kwargs):
+        """Send a request under the rate limits of the profile and region.
+
+        Args:
+            method: string, HTTP method, e.g., 'GET', 'PUT'.
+            url: string.
+            kwargs: keyword arguments of aiohttp.ClientSession.request().
+
+        Return:
+            The status code and the decoded JSON body of the response.
+        """
+        return await AsyncAdsAPIClient._request_json(
+            self._get_rate_keys(), self.get_session(self.api_endpoint),
+            method, url, **kwargs)
+
+    @staticmethod
+    async def _request_json(keys, session, method, url, **kwargs):
+        """Send a scheduled request and read its JSON body.
+
+        Refer to _send_scheduled() for the arguments.
+
+        Return:
+            The status code and the decoded JSON body, None if empty.
+
+        Raises:
+            AdsAPIError: the body is not JSON.
+        """
+        response = await AsyncAdsAPIClient._send_scheduled(
+            keys, session, method, url, **kwargs)
+        try:
+            content = await response.read()
+        finally:
+            response.release()
+        text = content.decode('utf-8', 'replace')
+        try:
+            return (response.status, json.loads(text) if content else None)
+        except ValueError:
+            raise AdsAPIError(response.status, text)
+
+    @staticmethod
+    async def _send_scheduled(keys, session, method, url, **kwargs):
+        """Send a request once the rate limits of the keys allow it.
+
+        The rate limits are shared with the blocking clients; the waits
+        sleep on the event loop. Throttled requests are retried after
+        Retry-After seconds, or after an exponential backoff, up to
+        _THROTTLE_RETRIES times.
+
+        Args:
+            keys: tuple[], keys of the rate limits, refer to RequestScheduler.
+            session: aiohttp.ClientSession.
+            method: string, HTTP method, e.g., 'GET', 'PUT'.
+            url: string.
+            kwargs: keyword arguments of aiohttp.ClientSession.request().
+
+        Return:
+            An object of type aiohttp.ClientResponse, the last one if
+            throttled; the caller reads and releases it.
+        """
+        scheduler = AdsAPIClient._scheduler
+        delay = AdsAPIClient._THROTTLE_DELAY
+        start_time = time.time()
+        for retry in range(AdsAPIClient._THROTTLE_RETRIES + 1):
+            wait = scheduler.reserve(keys)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            response = await session.request(method, url, **kwargs)
+            if response.status != 429:
+                scheduler.succeeded(keys)
+                break
+
+            retry_after = RequestScheduler.parse_retry_after(
+                response.headers.get('Retry-After'))
+            scheduler.throttled(keys, retry_after or delay)
+            if retry == AdsAPIClient._THROTTLE_RETRIES:
+                break
+            response.release()
+            delay *= 2
+            logger.warning('Throttled %s %s, retry %d after %s seconds.',
+                           method, url, retry + 1, retry_after or delay / 2)
+
+        # The latency is measured until the response headers, as the body
+        # is read by the caller.
+        params = kwargs.get('params')
+        page = None
+        if params and params.get('count') and 'startIndex' in params:
+            page = int(params['startIndex']) // int(params['count'])
+        data = kwargs.get('data')
+        AdsAPIClient._metrics.record(
+            'amazon', AdsAPIClient._get_service_name(url), method,
+            response.status, time.time() - start_time,
+            bytes_sent=len(data) if isinstance(data, str) else None,
+            bytes_received=response.content_length, retries=retry,
+            page=page)
+        return response
@@ -0,0 +1,500 @@
+"""
+Local mirror of the Amazon campaign hierarchy in SQLite.
+
+EntitySync pulls the campaigns, ad groups, keywords, negative keywords and
+product ads of a profile into an EntityStore, whose indexed lookups by
+campaign, ad group, state, match type, SKU and ASIN replace paged API calls
+for data which changes slowly.
+
+Between full syncs, EntitySync.sync_changes() applies only the entities
+inserted, updated or archived since the last sync, which are told by the
+lastUpdatedDate of the extended fields, so a profile can be synced every few
+minutes. A full sync is run every reconcile_interval to catch anything
+missed.
+"""
+import json
+import logging
+import numbers
+import sqlite3
+import threading
+import time
+
+try:
+    basestring
+except NameError:   # Python 3.
+    basestring = str
+
+
+logger = logging.getLogger(__name__)
+
+
+class EntityStore(object):
+    """Entities of many profiles stored in a local SQLite database.
+
+    Each thread reads through its own connection, so lookups do not reopen
+    the database; writes are atomic per entity type and do not block the
+    readers (WAL journal).
+    """
+
+    ENTITY_TYPES = ('campaigns', 'adGroups', 'keywords', 'negativeKeywords',
+                    'productAds')
+    ID_FIELDS = {
+        'campaigns': 'campaignId',
+        'adGroups': 'adGroupId',
+        'keywords': 'keywordId',
+        'negativeKeywords': 'keywordId',
+        'productAds': 'adId',
+    }
+    # Values bound per IN clause, longer lists of values are looked up from
+    # a temporary table. SQLite allows 999 variables per statement.
+    _MAX_VARIABLES = 100
+
+    def __init__(self, path):
+        """
+        Args:
+            path: string, path of the SQLite database file.
+        """
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entities ('
+                'profile_id TEXT, entity_type TEXT, entity_id INTEGER, '
+                'campaign_id INTEGER, adgroup_id INTEGER, state TEXT, '
+                'match_type TEXT, sku TEXT, asin TEXT, '
+                'last_updated INTEGER, data TEXT, '
+                'PRIMARY KEY (profile_id, entity_type, entity_id))')
+            for column in ('campaign_id', 'adgroup_id', 'sku', 'asin'):
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS entities_%s ON entities '
+                    '(profile_id, entity_type, %s)' % (column, column))
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state ('
+                'profile_id TEXT, entity_type TEXT, synced_at REAL, '
+                'reconciled_at REAL, '
+                'PRIMARY KEY (profile_id, entity_type))')
+            # Add the column of the incremental syncs to the databases
+            # created before them.
+            columns = set(row[1] for row in conn.execute(
+                'PRAGMA table_info(sync_state)'))
+            if 'reconciled_at' not in columns:
+                conn.execute(
+                    'ALTER TABLE sync_state ADD COLUMN reconciled_at REAL')
+
+    def _connect(self):
+        """Get the connection of the current thread, open it if missing."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the connection of the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def replace(self, profile_id, entity_type, pages):
+        """Replace all the entities of a type of a profile.
+
+        The pages are staged in a temporary table while downloaded, then
+        written in one short transaction once all the pages are, so the
+        stored entities are left unchanged if the pages raise.
+
+        Args:
+            profile_id: long.
+            entity_type: string, e.g., 'keywords'.
+            pages: iterator of lists of entities, e.g., pages downloaded.
+
+        Returns:
+            Number of entities stored.
+        """
+        profile_id = str(profile_id)
+        count = 0
+        conn = self._connect()
+        self._start_staging(conn)
+        try:
+            for page in pages:
+                rows = [self._get_row(profile_id, entity_type, entity)
+                        for entity in page]
+                self._stage_rows(conn, rows)
+                count += len(page)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+        with conn:
+            conn.execute(
+                'DELETE FROM entities WHERE profile_id = ? AND '
+                'entity_type = ?', (profile_id, entity_type))
+            self._write_staged_rows(conn)
+            now = time.time()
+            conn.execute(
+                'INSERT OR REPLACE INTO sync_state (profile_id, '
+                'entity_type, synced_at, reconciled_at) VALUES (?, ?, ?, ?)',
+                (profile_id, entity_type, now, now))
+        return count
+
+    @staticmethod
+    def _start_staging(conn):
+        """Create or empty the temporary table of the staged rows.
+
+        The temporary table is private to the connection, so staging rows
+        does not lock the database.
+        """
+        conn.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS staged_entities AS '
+            'SELECT * FROM entities WHERE 0')
+        conn.execute('DELETE FROM staged_entities')
+        conn.commit()
+
+    @staticmethod
+    def _stage_rows(conn, rows):
+        """Add rows of entities to the temporary table."""
+        conn.executemany(
+            'INSERT INTO staged_entities VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    @staticmethod
+    def _write_staged_rows(conn):
+        """Write the staged rows to the entities, in the order staged."""
+        conn.execute(
+            'INSERT OR REPLACE INTO entities SELECT * FROM staged_entities '
+            'ORDER BY rowid')
+        conn.execute('DELETE FROM staged_entities')
+
+    def apply_changes(self, profile_id, entity_type, pages):
+        """Apply the changes since the last sync of an entity type.
+
+        The pages must hold all the entities which are not archived, so that
+        the stored entities missing from them are archived. The entities
+        are written if not stored yet or updated since stored, as told by
+        their own lastUpdatedDate. The changed entities are staged while
+        downloaded, then written in one short transaction once all the
+        pages are, so nothing is written nor archived if the pages raise.
+
+        Args:
+            profile_id: long.
+            entity_type: string, e.g., 'keywords'.
+            pages: iterator of lists of enabled or paused entities, with
+                extended fields.
+
+        Returns:
+            A dict of the number of entities written:
+                {'inserted': 2, 'updated': 10, 'archived': 1}
+        """
+        profile_id = str(profile_id)
+        counts = {'inserted': 0, 'updated': 0, 'archived': 0}
+        conn = self._connect()
+        stored = dict(
+            (entity_id, (last_updated, is_archived))
+            for entity_id, last_updated, is_archived in conn.execute(
+                "SELECT entity_id, last_updated, state = 'archived' "
+                'FROM entities WHERE profile_id = ? AND '
+                'entity_type = ?', (profile_id, entity_type)))
+
+        id_field = self.ID_FIELDS[entity_type]
+        seen = set()
+        self._start_staging(conn)
+        try:
+            for page in pages:
+                rows = []
+                for entity in page:
+                    entity_id = entity[id_field]
+                    seen.add(entity_id)
+                    last_updated = entity.get('lastUpdatedDate') or 0
+                    if entity_id not in stored:
+                        counts['inserted'] += 1
+                    elif last_updated > (stored[entity_id][0] or 0):
+                        counts['updated'] += 1
+                    else:
+                        continue
+                    rows.append(
+                        self._get_row(profile_id, entity_type, entity))
+                self._stage_rows(conn, rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+        archived = [entity_id for entity_id, (_, is_archived) in
+                    stored.items()
+                    if not is_archived and entity_id not in seen]
+        with conn:
+            self._write_staged_rows(conn)
+            for entity_id in archived:
+                data = json.loads(conn.execute(
+                    'SELECT data FROM entities WHERE profile_id = ? AND '
+                    'entity_type = ? AND entity_id = ?',
+                    (profile_id, entity_type, entity_id)).fetchone()[0])
+                data['state'] = 'archived'
+                conn.execute(
+                    "UPDATE entities SET state = 'archived', data = ? "
+                    'WHERE profile_id = ? AND entity_type = ? AND '
+                    'entity_id = ?',
+                    (json.dumps(data, separators=(',', ':')), profile_id,
+                     entity_type, entity_id))
+            counts['archived'] = len(archived)
+
+            conn.execute(
+                'INSERT OR IGNORE INTO sync_state (profile_id, entity_type) '
+                'VALUES (?, ?)', (profile_id, entity_type))
+            conn.execute(
+                'UPDATE sync_state SET synced_at = ? WHERE profile_id = ? '
+                'AND entity_type = ?', (time.time(), profile_id, entity_type))
+        return counts
+
+    def _get_row(self, profile_id, entity_type, entity):
+        """Get the row of an entity."""
+        entity_id = entity[self.ID_FIELDS[entity_type]]
+        return (
+            profile_id, entity_type, entity_id,
+            entity_id if entity_type == 'campaigns' else
+            entity.get('campaignId'),
+            entity.get('adGroupId'), entity.get('state'),
+            entity.get('matchType'), entity.get('sku'), entity.get('asin'),
+            entity.get('lastUpdatedDate'),
+            json.dumps(entity, separators=(',', ':')))
+
+    def get_sync_state(self, profile_id, entity_type):
+        """Get the state of the syncs of an entity type of a profile.
+
+        Returns:
+            None if never synced, otherwise:
+                {
+                    'synced_at': <time of the last sync>,
+                    'reconciled_at': <time of the last full sync>,
+                }
+        """
+        row = self._connect().execute(
+            'SELECT synced_at, reconciled_at FROM '
+            'sync_state WHERE profile_id = ? AND entity_type = ?',
+            (str(profile_id), entity_type)).fetchone()
+        if not row:
+            return None
+        return {
+            'synced_at': row[0],
+            'reconciled_at': row[1],
+        }
+
+    def get_synced_at(self, profile_id, entity_type):
+        """Get the time of the last sync of an entity type of a profile.
+
+        Returns:
+            A timestamp, None if never synced.
+        """
+        state = self.get_sync_state(profile_id, entity_type)
+        return state['synced_at'] if state else None
+
+    def get_entities(self, profile_id, entity_type, entity_ids=None,
+                     campaign_ids=None, adgroup_ids=None, state=None,
+                     match_type=None, sku=None, asin=None):
+        """Look up stored entities.
+
+        Args:
+            profile_id: long.
+            entity_type: string, e.g., 'keywords'.
+            entity_ids: long[], IDs of the entities.
+            campaign_ids: long[], IDs of campaigns.
+            adgroup_ids: long[], IDs of ad groups.
+            state: string or string[], e.g., 'enabled,paused'.
+            match_type: string or string[], e.g., 'exact'.
+            sku: string.
+            asin: string.
+
+        Returns:
+            A list of entities, as returned by the API.
+        """
+        filters = []
+        for column, values in (('entity_id', entity_ids),
+                               ('campaign_id', campaign_ids),
+                               ('adgroup_id', adgroup_ids),
+                               ('state', state),
+                               ('match_type', match_type),
+                               ('sku', sku), ('asin', asin)):
+            if not values:
+                continue
+            if isinstance(values, basestring):
+                values = values.split(',')
+            elif isinstance(values, numbers.Number):
+                values = [values]
+            seen = set()
+            filters.append((column, [v for v in values
+                                     if not (v in seen or seen.add(v))]))
+
+        clauses = ['profile_id = ?', 'entity_type = ?']
+        args = [str(profile_id), entity_type]
+        staged = []
+        for column, values in filters:
+            if len(values) <= self._MAX_VARIABLES:
+                clauses.append('%s IN (%s)' % (
+                    column, ','.join('?' * len(values))))
+                args.extend(values)
+                continue
+            # Too many values to bind, look them up from the temporary
+            # table instead.
+            index = len(clauses)
+            clauses.append(
+                '%s IN (SELECT value FROM filter_values WHERE '
+                'filter = %d)' % (column, index))
+            staged.extend((index, value) for value in values)
+
+        conn = self._connect()
+        if not staged:
+            return [json.loads(row[0]) for row in conn.execute(
+                'SELECT data FROM entities WHERE %s ORDER BY rowid' %
+                ' AND '.join(clauses), args)]
+
+        with conn:
+            conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS filter_values '
+                '(filter INTEGER, value)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS temp.filter_values_value '
+                'ON filter_values (filter, value)')
+            conn.executemany(
+                'INSERT INTO filter_values VALUES (?, ?)', staged)
+            try:
+                return [json.loads(row[0]) for row in conn.execute(
+                    'SELECT data FROM entities WHERE %s ORDER BY rowid' %
+                    ' AND '.join(clauses), args)]
+            finally:
+                conn.execute('DELETE FROM filter_values')
+
+    def get_campaigns(self, profile_id, campaign_ids=None, state=None):
+        """Look up stored campaigns, refer to get_entities()."""
+        return self.get_entities(profile_id, 'campaigns',
+                                 campaign_ids=campaign_ids, state=state)
+
+    def get_adgroups(self, profile_id, adgroup_ids=None, campaign_ids=None,
+                     state=None):
+        """Look up stored ad groups, refer to get_entities()."""
+        return self.get_entities(profile_id, 'adGroups',
+                                 entity_ids=adgroup_ids,
+                                 campaign_ids=campaign_ids, state=state)
+
+    def get_ads(self, profile_id, ad_ids=None, adgroup_ids=None,
+                campaign_ids=None, sku=None, asin=None, state=None):
+        """Look up stored product ads, refer to get_entities()."""
+        return self.get_entities(profile_id, 'productAds', entity_ids=ad_ids,
+                                 campaign_ids=campaign_ids,
+                                 adgroup_ids=adgroup_ids, state=state,
+                                 sku=sku, asin=asin)
+
+    def get_keywords(self, profile_id, adgroup_ids=None, campaign_ids=None,
+                     keyword_ids=None, match_type=None, state=None,
+                     is_biddable=True):
+        """Look up stored biddable or negative keywords, refer to
+        get_entities()."""
+        return self.get_entities(
+            profile_id, 'keywords' if is_biddable else 'negativeKeywords',
+            entity_ids=keyword_ids, campaign_ids=campaign_ids,
+            adgroup_ids=adgroup_ids, state=state, match_type=match_type)
+
+
+class EntitySync(object):
+    """Mirror the entities of a profile into an EntityStore."""
+
+    # Entities of all states are mirrored, archived ones included.
+    ALL_STATES = 'enabled,paused,archived'
+    # Archived entities never change, so they are skipped by the
+    # incremental syncs.
+    LIVE_STATES = 'enabled,paused'
+
+    def __init__(self, client, store, entity_types=EntityStore.ENTITY_TYPES,
+                 max_age=3600, reconcile_interval=86400):
+        """
+        Args:
+            client: AdsAPIClient of the profile.
+            store: EntityStore.
+            entity_types: string[], entity types to mirror.
+            max_age: float, seconds after which a mirrored entity type is
+                synced again by sync_if_stale().
+            reconcile_interval: float, seconds after which sync_changes()
+                runs a full sync instead of an incremental one.
+        """
+        self.client = client
+        self.store = store
+        self.entity_types = entity_types
+        self.max_age = max_age
+        self.reconcile_interval = reconcile_interval
+
+    def sync(self, entity_types=None):
+        """Download all the entities and replace the mirrored ones.
+
+        Args:
+            entity_types: string[], entity types to sync, all by default.
+
+        Returns:
+            A dict of the number of entities stored per entity type.
+        """
+        counts = {}
+        for entity_type in entity_types or self.entity_types:
+            start_time = time.time()
+            pages = self.client._iter_entities(
+                entity_type + '/extended', {'stateFilter': self.ALL_STATES},
+                by_page=True)
+            counts[entity_type] = self.store.replace(
+                self.client.profile_id, entity_type, pages)
+            logger.info('Synced %d %s of profile %s in %.2f seconds.',
+                        counts[entity_type], entity_type,
+                        self.client.profile_id, time.time() - start_time)
+        return counts
+
+    def sync_changes(self, entity_types=None):
+        """Apply the changes since the last sync, refer to
+        EntityStore.apply_changes().
+
+        Entity types never synced, or not fully synced within
+        reconcile_interval seconds, are fully synced instead.
+
+        Args:
+            entity_types: string[], entity types to sync, all by default.
+
+        Returns:
+            A dict of the changes per entity type, refer to
+            EntityStore.apply_changes(), or {'stored': <count>} for the
+            entity types fully synced.
+        """
+        changes = {}
+        now = time.time()
+        for entity_type in entity_types or self.entity_types:
+            state = self.store.get_sync_state(
+                self.client.profile_id, entity_type)
+            if (not state or (state['reconciled_at'] or 0) +
+                    self.reconcile_interval <= now):
+                changes[entity_type] = {
+                    'stored': self.sync([entity_type])[entity_type]}
+                continue
+
+            start_time = time.time()
+            pages = self.client._iter_entities(
+                entity_type + '/extended', {'stateFilter': self.LIVE_STATES},
+                by_page=True)
+            changes[entity_type] = self.store.apply_changes(
+                self.client.profile_id, entity_type, pages)
+            logger.info('Applied %s of %s of profile %s in %.2f seconds.',
+                        changes[entity_type], entity_type,
+                        self.client.profile_id, time.time() - start_time)
+        return changes
+
+    def sync_if_stale(self):
+        """Sync the changes of the entity types not synced within max_age
+        seconds, refer to sync_changes().
+
+        Returns:
+            A dict of the changes per entity type synced.
+        """
+        now = time.time()
+        stale = [
+            entity_type for entity_type in self.entity_types
+            if (self.store.get_synced_at(
+                self.client.profile_id, entity_type) or 0) + self.max_age <=
+            now]
+        return self.sync_changes(stale) if stale else {}
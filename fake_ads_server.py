@@ -0,0 +1,641 @@
+"""
+Local stand-in of Amazon Advertising API for benchmarks and tests.
+
+FakeAdsServer serves the endpoints used by AdsAPIClient from memory: the
+token endpoint, profiles, the entities with their /extended variants and
+paging, multi-status (207) mutations, and the report request, status and
+gzip download flow. Latency, throttling (429) and errors are injected as
+configured, so the client can be exercised offline:
+
+    server = FakeAdsServer(latency=0.005, throttle_rate=0.01).start()
+    server.populate(1, campaigns=10, adgroups=10, keywords=100)
+    server.install(AdsAPIClient)
+    ...
+    server.uninstall()
+    server.stop()
+"""
+import gzip
+import io
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+    from urlparse import urlparse
+except ImportError:     # Python 3.
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+    from urllib.parse import urlparse
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeAdsServer(object):
+    """In-memory Amazon Advertising API served on a local port."""
+
+    # ID field of each entity type.
+    ID_FIELDS = {
+        'campaigns': 'campaignId',
+        'adGroups': 'adGroupId',
+        'keywords': 'keywordId',
+        'negativeKeywords': 'keywordId',
+        'productAds': 'adId',
+    }
+    # Fields only returned by the /extended variants.
+    EXTENDED_FIELDS = ('creationDate', 'lastUpdatedDate', 'servingStatus')
+    # Query parameters filtering a field by a comma separated list.
+    LIST_FILTERS = {
+        'campaignIdFilter': 'campaignId',
+        'adGroupIdFilter': 'adGroupId',
+        'keywordIdFilter': 'keywordId',
+        'adIdFilter': 'adId',
+        'stateFilter': 'state',
+        'matchTypeFilter': 'matchType',
+    }
+    # Query parameters filtering a field by value.
+    VALUE_FILTERS = ('campaignType', 'name', 'keywordText', 'sku', 'asin')
+    MAX_PAGE_SIZE = 5000
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0,
+                 throttle_rate=0.0, error_rate=0.0, entity_error_rate=0.0,
+                 rate_limit=None, retry_after=1, report_delay=0.0,
+                 report_rows=None, seed=0):
+        """
+        Args:
+            host: string, interface to listen on.
+            port: int, port to listen on, 0 for any free port.
+            latency: float or (min, max), seconds added to each response.
+            throttle_rate: float, probability of a 429 response.
+            error_rate: float, probability of a 500 response.
+            entity_error_rate: float, probability of a retryable error
+                result per entity of a mutation.
+            rate_limit: int, requests per second per profile, above which
+                requests are throttled; None for unlimited.
+            retry_after: int, Retry-After seconds of random 429 responses.
+            report_delay: float, seconds before a report is generated.
+            report_rows: int, rows of each report; by default one row per
+                entity of the report type.
+            seed: int, seed of the injected failures and metrics.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.entity_error_rate = entity_error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.report_delay = report_delay
+        self.report_rows = report_rows
+        self.stats = {}
+        self._random = random.Random(seed)
+        self._profiles = {}
+        self._entities = {}     # Keyed by (profile id, entity type).
+        self._filtered = {}     # Filtered entities of the last queries.
+        self._reports = {}
+        self._report_contents = {}  # Generated once per type and metrics.
+        self._windows = {}      # Requests per (profile, second).
+        self._ids = itertools.count(1)
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._installed = None
+
+    @property
+    def url(self):
+        """Base URL of the running server, e.g., 'http://127.0.0.1:8000'."""
+        return 'http://%s:%d' % (self.host, self.port)
+
+    @property
+    def api_endpoint(self):
+        """API endpoint in the format of AdsAPIClient._API_ENDPOINT_*."""
+        return self.url + '/v1/%s'
+
+    @property
+    def token_endpoint(self):
+        """Token endpoint in the format of AdsAPIClient."""
+        return self.url + '/auth/o2/token'
+
+    def start(self):
+        """Serve the API from a background thread.
+
+        Returns:
+            The server itself.
+        """
+        server = self
+
+        class Handler(_RequestHandler):
+            fake = server
+
+        self._server = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='FakeAdsServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def install(self, client_class):
+        """Point the endpoints of a client class to this server.
+
+        Args:
+            client_class: AdsAPIClient or a subclass of it.
+        """
+        names = ['_API_ENDPOINT_NA', '_API_ENDPOINT_EU', '_API_ENDPOINT_TEST',
+                 '_API_ENDPOINT_TOKEN', '_COUNTRY_TO_ENDPOINT_MAP']
+        self._installed = (client_class, dict(
+            (name, getattr(client_class, name)) for name in names))
+        client_class._API_ENDPOINT_NA = self.api_endpoint
+        client_class._API_ENDPOINT_EU = self.api_endpoint
+        client_class._API_ENDPOINT_TEST = self.api_endpoint
+        client_class._API_ENDPOINT_TOKEN = self.token_endpoint
+        client_class._COUNTRY_TO_ENDPOINT_MAP = dict(
+            (country, self.api_endpoint)
+            for country in client_class._COUNTRY_TO_ENDPOINT_MAP)
+
+    def uninstall(self):
+        """Restore the endpoints of the client class installed."""
+        if self._installed:
+            client_class, endpoints = self._installed
+            for name, value in endpoints.items():
+                setattr(client_class, name, value)
+            self._installed = None
+
+    def add_profile(self, profile_id, country='US'):
+        """Add an advertising profile.
+
+        Args:
+            profile_id: long.
+            country: string, country code, e.g., 'US'.
+        """
+        with self._lock:
+            self._profiles[str(profile_id)] = {
+                'profileId': int(profile_id),
+                'countryCode': country,
+                'currencyCode': 'USD',
+                'dailyBudget': 1000.0,
+                'timezone': 'America/Los_Angeles',
+                'accountInfo': {'marketplaceStringId': 'ATVPDKIKX0DER',
+                                'sellerStringId': 'A%d' % int(profile_id)},
+            }
+
+    def populate(self, profile_id, campaigns=1, adgroups=1, keywords=0,
+                 ads=0, negative_keywords=0, country='US'):
+        """Generate a campaign hierarchy for a profile.
+
+        Args:
+            profile_id: long, the profile is added if missing.
+            campaigns: int, number of campaigns.
+            adgroups: int, number of ad groups per campaign.
+            keywords: int, number of keywords per ad group.
+            ads: int, number of product ads per ad group.
+            negative_keywords: int, number of negative keywords per ad group.
+            country: string, country code of the profile if added.
+        """
+        if str(profile_id) not in self._profiles:
+            self.add_profile(profile_id, country)
+
+        for c in range(campaigns):
+            campaign_id = self._add('campaigns', profile_id, {
+                'name': 'Campaign %d' % c,
+                'campaignType': 'sponsoredProducts',
+                'targetingType': 'manual',
+                'state': 'enabled',
+                'dailyBudget': 10.0,
+                'startDate': '20180101',
+                'premiumBidAdjustment': False,
+            })
+            for a in range(adgroups):
+                adgroup_id = self._add('adGroups', profile_id, {
+                    'campaignId': campaign_id,
+                    'name': 'Ad Group %d' % a,
+                    'defaultBid': 0.5,
+                    'state': 'enabled',
+                })
+                parent = {'campaignId': campaign_id, 'adGroupId': adgroup_id}
+                for k in range(keywords):
+                    self._add('keywords', profile_id, dict(
+                        parent, keywordText='keyword %d %d' % (a, k),
+                        matchType='exact', bid=0.5, state='enabled'))
+                for k in range(negative_keywords):
+                    self._add('negativeKeywords', profile_id, dict(
+                        parent, keywordText='negative %d %d' % (a, k),
+                        matchType='negativeExact', state='enabled'))
+                for k in range(ads):
+                    self._add('productAds', profile_id, dict(
+                        parent, sku='SKU-%d-%d' % (a, k), state='enabled'))
+
+    def get_entities(self, profile_id, entity_type):
+        """Get the stored entities of a profile.
+
+        Args:
+            profile_id: long.
+            entity_type: string, e.g., 'keywords'.
+
+        Returns:
+            A list of entities, including their extended fields.
+        """
+        with self._lock:
+            table = self._entities.get((str(profile_id), entity_type))
+            return list(table['list']) if table else []
+
+    def _add(self, entity_type, profile_id, entity):
+        """Store a new entity and return its ID."""
+        entity_id = next(self._ids)
+        now = int(time.time() * 1000)
+        entity[self.ID_FIELDS[entity_type]] = entity_id
+        entity.update({'creationDate': now, 'lastUpdatedDate': now,
+                       'servingStatus': 'DELIVERING'})
+        with self._lock:
+            table = self._get_table(str(profile_id), entity_type)
+            table['index'][entity_id] = entity
+            table['list'].append(entity)
+            table['version'] += 1
+        return entity_id
+
+    def _get_table(self, profile_id, entity_type):
+        """Get the entities of a type, create the table if missing."""
+        key = (profile_id, entity_type)
+        table = self._entities.get(key)
+        if table is None:
+            table = {'list': [], 'index': {}, 'version': 0}
+            self._entities[key] = table
+        return table
+
+    def _count(self, name, status):
+        """Count a response by endpoint and status."""
+        key = '%s %d' % (name, status)
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _inject(self, profile_id):
+        """Apply the latency and draw an injected failure.
+
+        Returns:
+            (status, body, headers) of the failure, None to proceed.
+        """
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self._random.uniform(latency[0], latency[1])
+        if latency:
+            time.sleep(latency)
+
+        if self.rate_limit and profile_id:
+            second = int(time.time())
+            with self._lock:
+                key = (profile_id, second)
+                self._windows[key] = self._windows.get(key, 0) + 1
+                count = self._windows[key]
+                self._windows.pop((profile_id, second - 2), None)
+            if count > self.rate_limit:
+                return (429, {'code': 'TOO_MANY_REQUESTS',
+                              'details': 'Rate limit exceeded.'},
+                        {'Retry-After': '1'})
+
+        draw = self._random.random()
+        if draw < self.throttle_rate:
+            return (429, {'code': 'TOO_MANY_REQUESTS',
+                          'details': 'Throttled.'},
+                    {'Retry-After': str(self.retry_after)})
+        if draw < self.throttle_rate + self.error_rate:
+            return (500, {'code': 'INTERNAL_ERROR',
+                          'details': 'Injected error.'}, {})
+        return None
+
+    def _list_entities(self, profile_id, entity_type, query):
+        """Handle GET of a page of entities."""
+        extended = entity_type.endswith('/extended')
+        entity_type = entity_type.split('/')[0]
+        start_index = int(query.get('startIndex', 0))
+        count = min(int(query.get('count', self.MAX_PAGE_SIZE)),
+                    self.MAX_PAGE_SIZE)
+        filters = tuple(sorted(
+            (name, value) for name, value in query.items()
+            if name in self.LIST_FILTERS or name in self.VALUE_FILTERS))
+
+        with self._lock:
+            table = self._get_table(profile_id, entity_type)
+            entities = table['list']
+            if filters:
+                # Paging re-runs the same query, keep its filtered entities.
+                key = (profile_id, entity_type, filters)
+                cached = self._filtered.get(key)
+                if cached and cached[0] == table['version']:
+                    entities = cached[1]
+                else:
+                    entities = self._filter(entities, filters)
+                    if len(self._filtered) > 100:
+                        self._filtered.clear()
+                    self._filtered[key] = (table['version'], entities)
+            page = entities[start_index:start_index + count]
+
+        if not extended:
+            page = [dict((k, v) for k, v in entity.items()
+                         if k not in self.EXTENDED_FIELDS)
+                    for entity in page]
+        return (200, page)
+
+    def _filter(self, entities, filters):
+        """Select the entities matching the query filters."""
+        tests = []
+        for name, value in filters:
+            if name in self.LIST_FILTERS:
+                tests.append((self.LIST_FILTERS[name],
+                              set(value.split(','))))
+            else:
+                tests.append((name, set([value])))
+        return [entity for entity in entities
+                if all(str(entity.get(field)) in values
+                       for field, values in tests)]
+
+    def _get_entity(self, profile_id, entity_type, entity_id):
+        """Handle GET of an entity by ID."""
+        extended = entity_type.endswith('/extended')
+        entity_type = entity_type.split('/')[0]
+        with self._lock:
+            entity = self._get_table(profile_id, entity_type)['index'].get(
+                int(entity_id))
+        if entity is None:
+            return (404, {'code': 'NOT_FOUND',
+                          'details': 'Entity not found.'})
+        if not extended:
+            entity = dict((k, v) for k, v in entity.items()
+                          if k not in self.EXTENDED_FIELDS)
+        return (200, entity)
+
+    def _mutate(self, method, profile_id, entity_type, items):
+        """Handle POST (create) and PUT (update) of entities."""
+        id_field = self.ID_FIELDS[entity_type]
+        if not isinstance(items, list):
+            return (400, {'code': 'INVALID_ARGUMENT',
+                          'details': 'Expected a list of entities.'})
+
+        results = []
+        for item in items:
+            if self._random.random() < self.entity_error_rate:
+                results.append({'code': 'SERVER_IS_BUSY',
+                                'description': 'Injected error.'})
+                continue
+            if method == 'POST':
+                entity = dict((k, v) for k, v in item.items()
+                              if v is not None)
+                entity_id = self._add(entity_type, profile_id, entity)
+                results.append({'code': 'SUCCESS', id_field: entity_id})
+                continue
+
+            with self._lock:
+                table = self._get_table(profile_id, entity_type)
+                entity = table['index'].get(int(item.get(id_field) or 0))
+                if entity is not None:
+                    entity.update((k, v) for k, v in item.items()
+                                  if v is not None)
+                    entity['lastUpdatedDate'] = int(time.time() * 1000)
+                    table['version'] += 1
+            if entity is None:
+                results.append({'code': 'NOT_FOUND',
+                                'description': 'Entity not found.'})
+            else:
+                results.append({'code': 'SUCCESS',
+                                id_field: entity[id_field]})
+
+        # Archiving, as sent by AdsAPIClient._delete_entities(), answers
+        # 200 like the v1 API; other mutations are multi-status.
+        archive = method == 'PUT' and items and all(
+            set(item) == set([id_field, 'state']) and
+            item['state'] == 'archived' for item in items)
+        return (200 if archive else 207, results)
+
+    def _request_report(self, profile_id, entity_type, data):
+        """Handle POST of a report request."""
+        report_id = 'amzn1.clicksAPI.v1.p1.%d' % next(self._ids)
+        with self._lock:
+            self._reports[report_id] = {
+                'profile_id': profile_id,
+                'entity_type': entity_type,
+                'metrics': (data.get('metrics') or 'impressions').split(','),
+                'ready_at': time.time() + self.report_delay,
+                'content': None,
+            }
+        return (202, {'reportId': report_id, 'recordType': entity_type,
+                      'status': 'IN_PROGRESS',
+                      'statusDetails': 'Report is being generated.'})
+
+    def _get_report_status(self, report_id):
+        """Handle GET of the status of a report."""
+        report = self._reports.get(report_id)
+        if report is None:
+            return (404, {'code': 'NOT_FOUND',
+                          'details': 'Report not found.'})
+        if time.time() < report['ready_at']:
+            return (200, {'reportId': report_id, 'status': 'IN_PROGRESS',
+                          'statusDetails': 'Report is being generated.'})
+        return (200, {'reportId': report_id, 'status': 'SUCCESS',
+                      'statusDetails': 'Report has been successfully '
+                                       'generated.',
+                      'location': self.api_endpoint % (
+                          'reports/%s/download' % report_id),
+                      'fileSize': len(self._get_report_content(report))})
+
+    def _get_report_content(self, report):
+        """Get the gzipped JSON rows of a report, generate them once."""
+        if report['content'] is not None:
+            return report['content']
+        with self._lock:
+            table = self._get_table(report['profile_id'],
+                                    report['entity_type'])
+            key = (report['profile_id'], report['entity_type'],
+                   tuple(report['metrics']), table['version'])
+            content = self._report_contents.get(key)
+        if content is not None:
+            report['content'] = content
+            return content
+
+        id_field = self.ID_FIELDS.get(report['entity_type'], 'campaignId')
+        if self.report_rows is None:
+            ids = [entity[id_field] for entity in self.get_entities(
+                report['profile_id'], report['entity_type'])]
+        else:
+            ids = range(1, self.report_rows + 1)
+        rand = random.Random(len(ids))
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(b'[')
+            for i, entity_id in enumerate(ids):
+                row = {id_field: entity_id}
+                for metric in report['metrics']:
+                    if (metric == 'cost' or
+                            metric.startswith('attributedSales')):
+                        row[metric] = round(rand.uniform(0, 100), 2)
+                    else:
+                        row[metric] = rand.randint(0, 1000)
+                f.write((b',' if i else b'') + json.dumps(
+                    row, separators=(',', ':')).encode('utf-8'))
+            f.write(b']')
+        report['content'] = buf.getvalue()
+        with self._lock:
+            self._report_contents[key] = report['content']
+        return report['content']
+
+    def _issue_token(self, form):
+        """Handle POST to the token endpoint."""
+        if not form.get('refresh_token'):
+            return (400, {'error': 'invalid_request',
+                          'error_description': 'Missing refresh token.'})
+        return (200, {'access_token': 'Atza|fake-%d' % next(self._tokens),
+                      'refresh_token': form['refresh_token'],
+                      'token_type': 'bearer', 'expires_in': 3600})
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Route the requests of the API to the FakeAdsServer."""
+
+    fake = None                 # FakeAdsServer, set by start().
+    protocol_version = 'HTTP/1.1'   # Keep-alive like the real API.
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately, do not hold back the
+        # body until the headers are acknowledged.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass                    # Keep benchmark output quiet.
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        parts = [p for p in url.path.split('/') if p]
+        fake = self.fake
+
+        if parts == ['auth', 'o2', 'token'] and method == 'POST':
+            form = dict((k, v[-1]) for k, v in parse_qs(
+                body.decode('utf-8')).items())
+            return self._reply('token', fake._issue_token(form))
+        if not parts or parts[0] != 'v1':
+            return self._reply('unknown', (404, {'code': 'NOT_FOUND'}))
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._reply('unauthorized', (401, {
+                'code': 'UNAUTHORIZED', 'details': 'Missing access token.'}))
+
+        parts = parts[1:]
+        profile_id = self.headers.get('Amazon-Advertising-API-Scope')
+        name = '%s %s' % (method, '/'.join(
+            p if not p[0].isdigit() and '.' not in p else '<id>'
+            for p in parts))
+        failure = fake._inject(profile_id)
+        if failure:
+            return self._reply(name, failure[:2], failure[2])
+
+        try:
+            data = json.loads(body.decode('utf-8')) if body else None
+        except ValueError:
+            return self._reply(name, (400, {
+                'code': 'INVALID_ARGUMENT', 'details': 'Invalid JSON.'}))
+
+        if parts == ['profiles'] and method == 'GET':
+            return self._reply(name, (200, list(fake._profiles.values())))
+        if not profile_id:
+            return self._reply(name, (400, {
+                'code': 'INVALID_ARGUMENT', 'details': 'Missing scope.'}))
+
+        if parts[0] == 'reports' and method == 'GET':
+            if len(parts) == 3 and parts[2] == 'download':
+                report = fake._reports.get(parts[1])
+                if report is None or time.time() < report['ready_at']:
+                    return self._reply(name, (404, {'code': 'NOT_FOUND'}))
+                return self._reply_bytes(
+                    name, fake._get_report_content(report))
+            return self._reply(name, fake._get_report_status(parts[1]))
+
+        entity_type = parts[0]
+        if entity_type not in fake.ID_FIELDS:
+            return self._reply(name, (404, {'code': 'NOT_FOUND'}))
+        if len(parts) == 2 and parts[1] == 'report' and method == 'POST':
+            return self._reply(name, fake._request_report(
+                profile_id, entity_type, data or {}))
+        if method == 'GET':
+            if parts[-1].isdigit():
+                return self._reply(name, fake._get_entity(
+                    profile_id, '/'.join(parts[:-1]), parts[-1]))
+            return self._reply(name, fake._list_entities(
+                profile_id, '/'.join(parts), query))
+        return self._reply(name, fake._mutate(
+            method, profile_id, entity_type, data))
+
+    def _reply(self, name, response, headers=None):
+        status, body = response
+        self._reply_bytes(name, json.dumps(body).encode('utf-8'), status,
+                          'application/json', headers)
+
+    def _reply_bytes(self, name, content, status=200,
+                     content_type='application/octet-stream', headers=None):
+        self.fake._count(name, status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Serve a local Amazon Advertising API.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--profiles', type=int, default=1)
+    parser.add_argument('--campaigns', type=int, default=10)
+    parser.add_argument('--adgroups', type=int, default=10)
+    parser.add_argument('--keywords', type=int, default=10)
+    args = parser.parse_args()
+
+    fake_server = FakeAdsServer(
+        port=args.port, latency=args.latency,
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate)
+    for profile in range(1, args.profiles + 1):
+        fake_server.populate(profile, campaigns=args.campaigns,
+                             adgroups=args.adgroups, keywords=args.keywords,
+                             ads=1)
+    fake_server.start()
+    print('Serving %s' % fake_server.api_endpoint)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake_server.stop()
@@ -4,7 +4,10 @@ from copy import deepcopy
 from datetime import date
 from datetime import datetime
 import logging
+import random
 import suds
+import threading
+import time
 import urllib
 
 from googleads.adwords import AdWordsClient
@@ -13,6 +16,8 @@ from googleads.oauth2 import GoogleRefreshTokenClient
 from .google_api_setting import COUNTRIES
 from .google_api_setting import LANGUAGES
 from .google_api_setting import SELECTOR_FIELDS
+from .request_metrics import REQUEST_METRICS
+from .token_store import TokenRefresher
 
 
 
@@ -67,21 +72,111 @@ class GoogleAdsClient(ads_api.AdsAPIClient):
     TARGET_CONTENT_NETWORK = 'true'
     TARGET_PARTNER_SEARCH_NETWORK = 'false'
 
+    _TOKEN_LIFETIME = 3600          # Seconds an OAuth2 access token lasts.
+    _TOKEN_REFRESH_AHEAD = 5 * 60   # Renew tokens 5 minutes before expiry.
+
+    # Background thread renewing OAuth2 tokens of all clients.
+    _token_refresher = TokenRefresher()
+    # Refreshes of expired tokens waited for by API calls.
+    _token_wait_stats = {'refresh_waits': 0, 'refresh_wait_seconds': 0.0}
+    _token_wait_lock = threading.Lock()
+
+    # Latency and outcome of the API calls, shared with other clients.
+    _metrics = REQUEST_METRICS
+
     def __init__(self):
         super(GoogleAdsClient, self).__init__()
         self.client = None
+        self.oauth2_client = None
+        self.token_time = None
+        self._token_lock = threading.Lock()
 
     def _auth_impl(self):
+        self.oauth2_client = GoogleRefreshTokenClient(
+            'Your Client ID',
+            'Your Client Secret',
+            'Your Refresh Token')
         self.client = AdWordsClient(
             'Your Developer Token',
-            GoogleRefreshTokenClient(
-                'Your Client ID',
-                'Your Client Secret',
-                'Your Refresh Token'),
+            self.oauth2_client,
             'Your User Agent ID'
         )
         self.client.SetClientCustomerId('Your Client Customer ID')
 
+    def start_token_refresher(self, ahead=_TOKEN_REFRESH_AHEAD, jitter=60):
+        """Renew the OAuth2 access token in the background.
+
+        The token is renewed at a random time between ahead and
+        ahead + jitter seconds before it expires, so API calls never wait
+        for a token refresh.
+
+        Args:
+            ahead: int, seconds before expiry to renew the token.
+            jitter: int, maximum random seconds added to ahead.
+        """
+        if not self.client:
+            self._auth_impl()
+
+        def refresh():
+            with self._token_lock:
+                if (self.token_time and time.time() < (
+                        self.token_time + self._TOKEN_LIFETIME - ahead -
+                        random.uniform(0, jitter))):
+                    return
+                self.oauth2_client.Refresh()
+                self.token_time = time.time()
+
+        # Get a valid token right away, then keep it renewed.
+        refresh()
+        self._token_refresher.add_job(id(self), refresh)
+
+    def stop_token_refresher(self):
+        """Stop renewing the OAuth2 access token in the background."""
+        self._token_refresher.remove_job(id(self))
+
+    @classmethod
+    def get_token_stats(cls):
+        """Get metrics of the OAuth2 token refresh.
+
+        Returns:
+            A dict:
+                {
+                    'runs': <runs of background refresh>,
+                    'errors': <failed background refreshes>,
+                    'refresh_seconds': <total seconds spent refreshing in
+                                        the background>,
+                    'refresh_waits': <refreshes waited for by API calls>,
+                    'refresh_wait_seconds': <total seconds waited>,
+                }
+        """
+        stats = dict(cls._token_refresher.stats)
+        with cls._token_wait_lock:
+            stats.update(cls._token_wait_stats)
+        return stats
+
+    def _is_token_valid(self):
+        return bool(self.token_time and
+                    time.time() < self.token_time + self._TOKEN_LIFETIME)
+
+    def _wait_for_token(self):
+        """Refresh the OAuth2 token if it expired, before an API call.
+
+        The time spent here is the wait on the request path which the
+        background refresher avoids.
+        """
+        if self.oauth2_client is None or self._is_token_valid():
+            return
+        start_time = time.time()
+        with self._token_lock:
+            # Another thread may have refreshed it while this one waited.
+            if not self._is_token_valid():
+                self.oauth2_client.Refresh()
+                self.token_time = time.time()
+        with self._token_wait_lock:
+            self._token_wait_stats['refresh_waits'] += 1
+            self._token_wait_stats['refresh_wait_seconds'] += (
+                time.time() - start_time)
+
     def _create_ad(self, adgroup_id, creative, dest_url=None, display_url=None,
                    status='ENABLED', **kwargs):
         """Create an ad which is assigned to an ad group.
@@ -742,7 +837,14 @@ class GoogleAdsClient(ads_api.AdsAPIClient):
         if 'paging' in selector:
             logger.debug('GoogleAdsClient get entity %s, %s',
                          service_name, selector)
-            page = service.get(selector)
+            paging = selector['paging']
+            page_number = None
+            if isinstance(paging, dict) and paging.get('numberResults'):
+                page_number = (int(paging.get('startIndex', 0)) //
+                               int(paging['numberResults']))
+            page = self._call_service(
+                service_name, 'get', lambda: service.get(selector),
+                page_number)
             if page and 'entries' in page:
                 entities = page['entries']
         else:
@@ -753,7 +855,9 @@ class GoogleAdsClient(ads_api.AdsAPIClient):
                 selector['paging'] = self._get_paging(offset, page_size)
                 logger.debug('GoogleAdsClient get entity %s, %s',
                              service_name, selector)
-                page = service.get(selector)
+                page = self._call_service(
+                    service_name, 'get', lambda: service.get(selector),
+                    offset // page_size)
                 if page and 'entries' in page:
                     entities.extend(page['entries'])
                     offset += page_size
@@ -845,13 +949,16 @@ class GoogleAdsClient(ads_api.AdsAPIClient):
             report['selector']['predicates'] = predicates
 
         downloader = self.client.GetReportDownloader(self.API_VERSION)
-        csv_str = downloader.DownloadReportAsString(
-            report,
-            skip_report_header=True,
-            skip_column_header=True,
-            skip_report_summary=True,
-            include_zero_impressions=False
-        )
+        csv_str = self._call_service(
+            'ReportDownloader', report_type,
+            lambda: downloader.DownloadReportAsString(
+                report,
+                skip_report_header=True,
+                skip_column_header=True,
+                skip_report_summary=True,
+                include_zero_impressions=False
+            ),
+            size=len)
         # return [dict(zip(fields, row))
         #         for row in csv_util.parse_csv_string(csv_str)]
         for row in csv_util.parse_csv_string(csv_str):
@@ -995,7 +1102,8 @@ class GoogleAdsClient(ads_api.AdsAPIClient):
 
         service = self.client.GetService(
             service_name, version=self.API_VERSION)
-        response = service.mutate(operations)
+        response = self._call_service(
+            service_name, 'mutate', lambda: service.mutate(operations))
         self.client.partial_failure = False
         if partial_failure:
             return (response['value'],
@@ -1004,6 +1112,42 @@ class GoogleAdsClient(ads_api.AdsAPIClient):
         else:
             return response['value']
 
+    def _call_service(self, service_name, operation, call, page=None,
+                      size=None):
+        """Call an API service and record the metrics of the call.
+
+        The SOAP messages are not exposed by the service proxies, so only
+        the size of report downloads is recorded.
+
+        Args:
+            service_name: string, service name, e.g., 'CampaignService'.
+            operation: string, e.g., 'get', 'mutate', or the report type.
+            call: callable, sends the request and returns the response.
+            page: int, zero-based page number of a paged get.
+            size: callable, takes the response and returns its size.
+
+        Returns:
+            The response of the call.
+        """
+        self._wait_for_token()
+        start_time = time.time()
+        status = 'OK'
+        response = None
+        try:
+            response = call()
+            return response
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self._metrics.record(
+                'google', service_name, operation, status,
+                time.time() - start_time,
+                bytes_received=(
+                    size(response) if size and response is not None
+                    else None),
+                page=page)
+
     def _update_keywords_impl(self, adgroup_id, criterion_ids, max_cpc=None,
                               status=None):
         """Update bid amount or status of keywords.
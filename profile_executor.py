@@ -0,0 +1,152 @@
+"""
+Fan-out of an operation across many Amazon advertising profiles.
+
+MultiProfileExecutor discovers the profiles of a seller, builds a client per
+profile and runs a callable for each of them on a worker pool, capping the
+number of concurrent operations per regional endpoint.
+"""
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+from .amazon_ads_api import AdsAPIClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class MultiProfileExecutor(object):
+    """Run an operation for each profile of a seller concurrently."""
+
+    def __init__(self, refresh_token, workers=16, region_concurrency=8,
+                 client_class=AdsAPIClient):
+        """
+        Args:
+            refresh_token: string, refresh token of the seller.
+            workers: int, maximum operations running concurrently.
+            region_concurrency: int, maximum operations running concurrently
+                against one regional endpoint.
+            client_class: class of the clients, AdsAPIClient by default.
+        """
+        self.refresh_token = refresh_token
+        self.workers = workers
+        self.region_concurrency = region_concurrency
+        self.client_class = client_class
+        self._region_slots = {}
+        self._lock = threading.Lock()
+
+    def get_clients(self, countries=None, profile_ids=None):
+        """Discover the profiles of the seller and build their clients.
+
+        Args:
+            countries: string[], country codes of the profiles to keep,
+                e.g., ['US', 'UK']; None to keep all.
+            profile_ids: long[], IDs of the profiles to keep; None to keep
+                all.
+
+        Returns:
+            A list of clients, one per profile.
+        """
+        profiles = self.client_class.get_profiles(self.refresh_token)
+        access_token, token_time = self.client_class.refresh_access_token(
+            self.refresh_token)
+        if profile_ids:
+            profile_ids = set(str(i) for i in profile_ids)
+
+        clients = []
+        for profile in profiles:
+            country = profile.get('countryCode')
+            if countries and country not in countries:
+                continue
+            if profile_ids and str(profile['profileId']) not in profile_ids:
+                continue
+            if country not in self.client_class._COUNTRY_TO_ENDPOINT_MAP:
+                logger.warning('Skip profile %s of unsupported country %s.',
+                               profile['profileId'], country)
+                continue
+            clients.append(self.client_class(
+                profile['profileId'], country, access_token,
+                self.refresh_token, token_time))
+        return clients
+
+    def run(self, operation, clients=None):
+        """Run the operation for each client.
+
+        Args:
+            operation: callable, takes a client and returns the result of
+                the profile, e.g., lambda client: client.get_keywords().
+            clients: list of clients, all profiles of the seller by default.
+
+        Returns:
+            A dict keyed by profile ID:
+                {
+                    <profile id>: {
+                        'result': <result of the operation or None>,
+                        'error': <exception raised or None>,
+                        'seconds': <duration of the operation>,
+                        'queue_seconds': <wait for a slot of the region>,
+                    },
+                }
+        """
+        if clients is None:
+            clients = self.get_clients()
+        if not clients:
+            return {}
+
+        pool = ThreadPool(min(self.workers, len(clients)))
+        try:
+            outcomes = pool.map(
+                lambda client: self._run_one(operation, client),
+                self._interleave_regions(clients))
+        finally:
+            pool.close()
+            pool.join()
+
+        return dict(outcomes)
+
+    def _run_one(self, operation, client):
+        """Run the operation for a client under the cap of its region."""
+        slots = self._get_region_slots(client.api_endpoint)
+        queue_time = time.time()
+        result = error = None
+        with slots:
+            start_time = time.time()
+            try:
+                result = operation(client)
+            except Exception as e:
+                logger.exception('Operation failed for profile %s.',
+                                 client.profile_id)
+                error = e
+            end_time = time.time()
+        return (client.profile_id, {
+            'result': result,
+            'error': error,
+            'seconds': end_time - start_time,
+            'queue_seconds': start_time - queue_time,
+        })
+
+    def _get_region_slots(self, api_endpoint):
+        """Get the semaphore capping the operations of a region."""
+        with self._lock:
+            slots = self._region_slots.get(api_endpoint)
+            if slots is None:
+                slots = threading.BoundedSemaphore(self.region_concurrency)
+                self._region_slots[api_endpoint] = slots
+        return slots
+
+    @staticmethod
+    def _interleave_regions(clients):
+        """Order the clients round-robin by region, so that workers are not
+        all blocked on the cap of one region."""
+        regions = {}
+        for client in clients:
+            regions.setdefault(client.api_endpoint, []).append(client)
+        queues = list(regions.values())
+        ordered = []
+        while queues:
+            for queue in list(queues):
+                ordered.append(queue.pop(0))
+                if not queue:
+                    queues.remove(queue)
+        return ordered
@@ -0,0 +1,200 @@
+"""
+Rate limiting of API requests with adaptive token buckets.
+
+Requests share buckets keyed by scope (e.g., per profile and per regional
+endpoint). A request waits until every bucket of its keys has capacity;
+throttled responses pause the buckets for Retry-After seconds and halve
+their rates, which then recover slowly while requests succeed.
+"""
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Token bucket which reserves capacity for the waiting callers.
+
+    Each acquire() takes a token right away, possibly driving the balance
+    negative, and sleeps until its token is refilled. Callers are released
+    in the order they arrived, as capacity frees up.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=None, max_rate=None):
+        """
+        Args:
+            rate: float, tokens refilled per second.
+            capacity: float, maximum burst of tokens, rate by default.
+            min_rate: float, lower bound of the adapted rate, rate / 16
+                by default.
+            max_rate: float, upper bound of the adapted rate, rate by default.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.min_rate = float(min_rate or self.rate / 16)
+        self.max_rate = float(max_rate or self.rate)
+        self._tokens = self.capacity
+        self._paused_until = 0.0
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, block until it is available.
+
+        Returns:
+            Seconds waited for the token.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self):
+        """Take a token without blocking.
+
+        Returns:
+            Seconds the caller must wait before using the token.
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self._tokens -= 1
+            return max(-self._tokens / self.rate, self._paused_until - now, 0)
+
+    def pause(self, seconds):
+        """Hold back all callers for the given seconds, e.g., Retry-After.
+
+        Args:
+            seconds: float.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    def throttled(self):
+        """Decrease the rate multiplicatively after a throttled response."""
+        with self._lock:
+            self._refill(time.time())
+            self.rate = max(self.rate / 2, self.min_rate)
+
+    def succeeded(self):
+        """Increase the rate additively after a successful response."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.time())
+                self.rate = min(
+                    self.rate + self.max_rate / 100, self.max_rate)
+
+    def _refill(self, now):
+        """Add the tokens refilled since the last update."""
+        self._tokens = min(
+            self._tokens + (now - self._updated_at) * self.rate,
+            self.capacity)
+        self._updated_at = now
+
+
+class RequestScheduler(object):
+    """Schedule requests under the token buckets of their keys.
+
+    A key is a tuple whose first element is the scope of the bucket, e.g.,
+    ('region', <endpoint>) or ('profile', <endpoint>, <profile id>); the
+    bucket of a key is created with the rate of its scope.
+    """
+
+    def __init__(self, rates):
+        """
+        Args:
+            rates: dict, requests per second of each scope, e.g.,
+                {'region': 20, 'profile': 5}.
+        """
+        self.rates = rates
+        self.stats = {'requests': 0, 'throttled': 0, 'wait_seconds': 0.0}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, key):
+        """Get the token bucket of the key, create it if missing.
+
+        Args:
+            key: tuple, (scope, ...).
+
+        Returns:
+            An object of type TokenBucket.
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rates[key[0]])
+                self._buckets[key] = bucket
+        return bucket
+
+    def acquire(self, keys):
+        """Block until every bucket of the keys allows a request.
+
+        Args:
+            keys: tuple[], keys of the request.
+        """
+        wait = self.reserve(keys)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, keys):
+        """Reserve a request in every bucket of the keys without blocking,
+        e.g., for callers sleeping on an event loop.
+
+        Args:
+            keys: tuple[], keys of the request.
+
+        Returns:
+            Seconds the caller must wait before sending the request.
+        """
+        wait = 0.0
+        for key in keys:
+            wait = max(wait, self.get_bucket(key).reserve())
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['wait_seconds'] += wait
+        return wait
+
+    def throttled(self, keys, retry_after=None):
+        """Slow down the buckets of a throttled request.
+
+        Args:
+            keys: tuple[], keys of the request.
+            retry_after: float, seconds to hold back the requests.
+        """
+        for key in keys:
+            bucket = self.get_bucket(key)
+            bucket.throttled()
+            if retry_after:
+                bucket.pause(retry_after)
+        with self._lock:
+            self.stats['throttled'] += 1
+
+    def succeeded(self, keys):
+        """Speed up the buckets of a successful request.
+
+        Args:
+            keys: tuple[], keys of the request.
+        """
+        for key in keys:
+            self.get_bucket(key).succeeded()
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Parse the value of a Retry-After header.
+
+        Args:
+            value: string, seconds or an HTTP date.
+
+        Returns:
+            Seconds to wait, None if the value is missing or invalid.
+        """
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date:
+                return max(mktime_tz(date) - time.time(), 0)
+        return None
@@ -0,0 +1,209 @@
+"""
+Backfill of performance reports over a date range.
+
+ReportBackfill plans one report per profile, entity type and day, keeps a
+bounded number of them in flight via the asynchronous report API, and
+checkpoints each completed report so an interrupted run resumes where it
+stopped.
+"""
+from datetime import datetime
+from datetime import timedelta
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReportBackfill(object):
+    """Backfill reports of many profiles, entity types and days."""
+
+    def __init__(self, clients, entity_types, start_date, end_date, handler,
+                 checkpoint_path=None, max_in_flight=20, segments=None,
+                 progress_callback=None, progress_every=50):
+        """
+        Args:
+            clients: AdsAPIClient[], one client per profile.
+            entity_types: string[], e.g., 'campaigns', 'adGroups'.
+            start_date: string, first day in format: 'YYYYMMDD'.
+            end_date: string, last day (inclusive) in format: 'YYYYMMDD'.
+            handler: callable, takes (profile_id, entity_type, report_date,
+                rows); called from worker threads as reports complete.
+            checkpoint_path: string, file recording the completed reports.
+            max_in_flight: int, maximum reports requested but not completed.
+            segments: dict, segment of the reports per entity type, e.g.,
+                {'keywords': 'query'}.
+            progress_callback: callable, takes the dict of progress.
+            progress_every: int, number of completed reports between two
+                progress reports.
+        """
+        self.clients = clients
+        self.entity_types = entity_types
+        self.start_date = start_date
+        self.end_date = end_date
+        self.handler = handler
+        self.checkpoint_path = checkpoint_path
+        self.max_in_flight = max_in_flight
+        self.segments = segments or {}
+        self.progress_callback = progress_callback
+        self.progress_every = progress_every
+        self.progress = {}
+        self._lock = threading.Lock()
+
+    def get_dates(self):
+        """Get the days of the date range in format: 'YYYYMMDD'."""
+        day = datetime.strptime(self.start_date, '%Y%m%d')
+        end = datetime.strptime(self.end_date, '%Y%m%d')
+        dates = []
+        while day <= end:
+            dates.append(day.strftime('%Y%m%d'))
+            day += timedelta(days=1)
+        return dates
+
+    def plan(self):
+        """Plan the reports not completed by previous runs.
+
+        Returns:
+            A list of (client, entity_type, report_date), the latest days
+            first.
+        """
+        completed = self._load_checkpoint()
+        return [
+            (client, entity_type, report_date)
+            for report_date in reversed(self.get_dates())
+            for client in self.clients
+            for entity_type in self.entity_types
+            if self._get_key(client.profile_id, entity_type, report_date)
+            not in completed]
+
+    def run(self):
+        """Run the backfill until all planned reports complete.
+
+        Returns:
+            A dict of progress:
+                {
+                    'total': <number of planned reports>,
+                    'completed': <number of completed reports>,
+                    'failed': <number of failed reports>,
+                    'elapsed_seconds': <seconds since started>,
+                    'reports_per_second': <throughput>,
+                }
+        """
+        plan = self.plan()
+        self.progress = {
+            'total': len(plan),
+            'completed': 0,
+            'failed': 0,
+            'elapsed_seconds': 0.0,
+            'reports_per_second': 0.0,
+        }
+        start_time = time.time()
+        slots = threading.Semaphore(self.max_in_flight)
+        all_done = threading.Event()
+        if not plan:
+            all_done.set()
+
+        def finish(item, future=None):
+            try:
+                rows = None
+                if future and future.status == 'SUCCESS':
+                    rows = future.result()
+                    self.handler(item[0].profile_id, item[1], item[2], rows)
+                    self._save_checkpoint(item)
+                else:
+                    logger.error('Failed to backfill %s %s of %s: %s.',
+                                 item[1], item[2], item[0].profile_id,
+                                 future.status if future else None)
+            except Exception:
+                logger.exception('Failed to backfill %s %s of %s.',
+                                 item[1], item[2], item[0].profile_id)
+                rows = None
+            finally:
+                slots.release()
+            self._update_progress(rows is not None, start_time)
+            with self._lock:
+                done = self.progress['completed'] + self.progress['failed']
+            if done == len(plan):
+                all_done.set()
+
+        for item in plan:
+            slots.acquire()
+            client, entity_type, report_date = item
+            try:
+                future = client.submit_report(
+                    entity_type, report_date,
+                    self.segments.get(entity_type))
+            except Exception:
+                logger.exception('Failed to request %s %s of %s.',
+                                 entity_type, report_date, client.profile_id)
+                finish(item)
+                continue
+            future.add_done_callback(
+                lambda f, item=item: finish(item, f))
+
+        all_done.wait()
+        self._update_progress(None, start_time)
+        return dict(self.progress)
+
+    def _update_progress(self, succeeded, start_time):
+        """Count a completed report and report the progress periodically."""
+        with self._lock:
+            if succeeded is not None:
+                self.progress['completed' if succeeded else 'failed'] += 1
+            elapsed = time.time() - start_time
+            done = self.progress['completed'] + self.progress['failed']
+            self.progress['elapsed_seconds'] = elapsed
+            self.progress['reports_per_second'] = (
+                done / elapsed if elapsed else 0.0)
+            progress = dict(self.progress)
+
+        if succeeded is None or (done % self.progress_every == 0 and
+                                 done < progress['total']):
+            logger.info('Backfilled %d/%d reports (%d failed), %.2f/s.',
+                        done, progress['total'], progress['failed'],
+                        progress['reports_per_second'])
+            if self.progress_callback:
+                self.progress_callback(progress)
+
+    @staticmethod
+    def _get_key(profile_id, entity_type, report_date):
+        """Get the checkpoint key of a report."""
+        return '%s|%s|%s' % (profile_id, entity_type, report_date)
+
+    def _load_checkpoint(self):
+        """Load the keys of the completed reports."""
+        if not (self.checkpoint_path and
+                os.path.exists(self.checkpoint_path)):
+            return set()
+
+        completed = set()
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                try:
+                    completed.add(json.loads(line)['key'])
+                except (ValueError, KeyError):
+                    continue    # Partially written line of a crashed run.
+        return completed
+
+    def _save_checkpoint(self, item):
+        """Record a completed report in the checkpoint file."""
+        if not self.checkpoint_path:
+            return
+
+        client, entity_type, report_date = item
+        line = json.dumps({
+            'key': self._get_key(client.profile_id, entity_type, report_date),
+            'time': time.time(),
+        })
+        with self._lock:
+            with open(self.checkpoint_path, 'ab+') as f:
+                # End the partially written line of a crashed run first.
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        line = '\n' + line
+                f.write((line + '\n').encode('utf-8'))
@@ -0,0 +1,215 @@
+"""
+On-disk cache of finalized performance reports.
+
+Report metrics of a day keep changing within the attribution window, so only
+reports of days older than the window are cached. Cached reports are stored
+as gzipped JSON arrays under a content-addressed key of the report request.
+"""
+from datetime import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from .report_stream import iter_gzip_json_array
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCache(object):
+    """Cache of reports keyed by profile, entity type, date, segment and
+    metrics."""
+
+    _CHUNK_SIZE = 64 * 1024     # Bytes read per chunk of a cached report.
+
+    def __init__(self, directory, attribution_days=30):
+        """
+        Args:
+            directory: string, directory of the cached reports.
+            attribution_days: int, days a report may still change.
+        """
+        self.directory = directory
+        self.attribution_days = attribution_days
+        self.stats = {'hits': 0, 'misses': 0, 'saves': 0}
+
+    @staticmethod
+    def get_key(profile_id, entity_type, report_date, segment, metrics):
+        """Get the content address of a report request.
+
+        Args:
+            profile_id: string, ID of the profile.
+            entity_type: string, type of entity, e.g., 'keywords'.
+            report_date: string, in format: 'YYYYMMDD'.
+            segment: string, segment of the report, e.g., 'query'.
+            metrics: string, comma separated metrics of the report.
+
+        Returns:
+            A hex digest string.
+        """
+        request = json.dumps(
+            [str(profile_id), entity_type, report_date, segment,
+             sorted(metrics.split(','))])
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def is_final(self, report_date):
+        """Check if the report of the date is out of the attribution window.
+
+        Args:
+            report_date: string, in format: 'YYYYMMDD'.
+        """
+        age = datetime.utcnow() - datetime.strptime(report_date, '%Y%m%d')
+        return age.days > self.attribution_days
+
+    def load(self, key):
+        """Load a cached report.
+
+        Args:
+            key: string, refer to get_key().
+
+        Returns:
+            An iterator of the rows of the report, None if not cached.
+        """
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        return self._iter_rows(path)
+
+    def save(self, key, rows):
+        """Save a report to the cache.
+
+        Args:
+            key: string, refer to get_key().
+            rows: dict[], rows of the report.
+        """
+        writer = self.open_writer(key)
+        for row in rows:
+            writer.write(row)
+        writer.commit()
+
+    def open_writer(self, key):
+        """Open a writer to save a report to the cache row by row.
+
+        Args:
+            key: string, refer to get_key().
+
+        Returns:
+            A ReportCacheWriter; the report is cached on commit() only.
+        """
+        return ReportCacheWriter(self, key, self._get_path(key))
+
+    def _get_path(self, key):
+        """Get the path of a cached report, sharded by the key prefix."""
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+    def _iter_rows(self, path):
+        """Decode a cached report row by row."""
+        with open(path, 'rb') as f:
+            for row in iter_gzip_json_array(
+                    iter(lambda: f.read(self._CHUNK_SIZE), b'')):
+                yield row
+
+
+class ReportCacheWriter(object):
+    """Write a report to the cache as its rows are downloaded.
+
+    The rows are written to a temporary file first and the file is moved in
+    place on commit(), readers never see partial data. Failures to write are
+    logged and leave the report uncached.
+    """
+
+    def __init__(self, cache, key, path):
+        """
+        Args:
+            cache: ReportCache, cache of the report.
+            key: string, refer to ReportCache.get_key().
+            path: string, path of the cached report.
+        """
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self._tmp_path = None
+        self._file = None
+        self._gzip_file = None
+        self._separator = b'['
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:     # Created by another process meanwhile.
+                pass
+        try:
+            fd, self._tmp_path = tempfile.mkstemp(dir=directory)
+            self._file = os.fdopen(fd, 'wb')
+            self._gzip_file = gzip.GzipFile(fileobj=self._file, mode='wb')
+        except (IOError, OSError):
+            self._fail()
+
+    def write(self, row):
+        """Append a row of the report.
+
+        Args:
+            row: dict, row of the report.
+        """
+        if self._gzip_file is None:
+            return
+        try:
+            self._gzip_file.write(self._separator + json.dumps(
+                row, separators=(',', ':')).encode('utf-8'))
+        except (IOError, OSError):
+            self._fail()
+            return
+        self._separator = b','
+
+    def commit(self):
+        """Finish the report and move it in place in the cache."""
+        if self._gzip_file is None:
+            return
+        try:
+            if self._separator == b'[':     # Empty report.
+                self._gzip_file.write(b'[')
+            self._gzip_file.write(b']')
+            self._close()
+            os.rename(self._tmp_path, self.path)
+        except (IOError, OSError):
+            self._fail()
+            return
+        self.cache.stats['saves'] += 1
+
+    def abort(self):
+        """Drop the partially written report, e.g., download failed."""
+        if self._gzip_file is None:
+            return
+        try:
+            self._close()
+        except (IOError, OSError):
+            pass
+        self._remove()
+
+    def _close(self):
+        gzip_file, self._gzip_file = self._gzip_file, None
+        f, self._file = self._file, None
+        try:
+            if gzip_file is not None:
+                gzip_file.close()
+        finally:
+            if f is not None:
+                f.close()
+
+    def _fail(self):
+        logger.exception('Failed to cache report %s.', self.key)
+        try:
+            self._close()
+        except (IOError, OSError):
+            pass
+        self._remove()
+
+    def _remove(self):
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -0,0 +1,159 @@
+"""
+Columnar representation of performance reports with NumPy.
+
+A ColumnarReport keeps each metric as a typed array and each ID field as
+interned codes into the array of its distinct IDs, so derived metrics of
+millions of rows are computed with vectorized operations.
+"""
+try:
+    import numpy as np
+except ImportError:     # Optional, only required by ColumnarReport.
+    np = None
+
+
+class ColumnarReport(object):
+    """Performance report stored column by column."""
+
+    ID_FIELDS = ('campaignId', 'adGroupId', 'keywordId', 'adId')
+    ATTRIBUTION_WINDOWS = ('1d', '7d', '30d')
+
+    def __init__(self, metrics, ids):
+        """
+        Args:
+            metrics: dict, NumPy array of each metric.
+            ids: dict, (codes, categories) of each ID field, where
+                categories[codes] are the IDs of the rows.
+        """
+        self.metrics = metrics
+        self.ids = ids
+
+    @classmethod
+    def from_rows(cls, rows, metrics):
+        """Build the columns from the rows of a report.
+
+        Args:
+            rows: iterator of dict, rows of the report.
+            metrics: string, comma separated metrics of the report.
+
+        Returns:
+            An object of type ColumnarReport.
+        """
+        if np is None:
+            raise ImportError('NumPy is required for columnar reports.')
+
+        metric_names = metrics.split(',')
+        values = dict((name, []) for name in metric_names)
+        id_values = dict((name, []) for name in cls.ID_FIELDS)
+        for row in rows:
+            for name in metric_names:
+                values[name].append(row.get(name) or 0)
+            for name in cls.ID_FIELDS:
+                id_values[name].append(row.get(name) or 0)
+
+        columns = dict(
+            (name, np.array(values[name], dtype=cls._get_dtype(name)))
+            for name in metric_names)
+        ids = {}
+        for name in cls.ID_FIELDS:
+            if any(id_values[name]):
+                categories, codes = np.unique(
+                    np.array(id_values[name], dtype=np.int64),
+                    return_inverse=True)
+                ids[name] = (codes.astype(np.int32), categories)
+        return cls(columns, ids)
+
+    @staticmethod
+    def _get_dtype(metric):
+        """Get the array type of a metric: counts are integers."""
+        if metric in ('impressions', 'clicks') or (
+                metric.startswith('attributedConversions')):
+            return np.int64
+        return np.float64
+
+    def __len__(self):
+        for column in self.metrics.values():
+            return len(column)
+        return 0
+
+    def get_ids(self, field):
+        """Get the IDs of the rows.
+
+        Args:
+            field: string, ID field, e.g., 'keywordId'.
+
+        Returns:
+            A NumPy array of IDs.
+        """
+        codes, categories = self.ids[field]
+        return categories[codes]
+
+    def aggregate(self, field):
+        """Sum the metrics of the rows by ID.
+
+        Args:
+            field: string, ID field, e.g., 'campaignId'.
+
+        Returns:
+            An object of type ColumnarReport with one row per distinct ID.
+        """
+        codes, categories = self.ids[field]
+        metrics = {}
+        for name, column in self.metrics.items():
+            total = np.bincount(
+                codes, weights=column, minlength=len(categories))
+            metrics[name] = total.astype(column.dtype)
+        return ColumnarReport(
+            metrics,
+            {field: (np.arange(len(categories), dtype=np.int32),
+                     categories)})
+
+    def ctr(self):
+        """Click-through rate: clicks / impressions."""
+        return self._divide(self.metrics['clicks'],
+                            self.metrics['impressions'])
+
+    def cpc(self):
+        """Cost per click: cost / clicks."""
+        return self._divide(self.metrics['cost'], self.metrics['clicks'])
+
+    def acos(self, window='7d', same_sku=False):
+        """Advertising cost of sales: cost / sales.
+
+        Args:
+            window: string, attribution window, e.g., '1d', '7d', '30d'.
+            same_sku: boolean, if True, count sales of the advertised SKU only.
+        """
+        return self._divide(self.metrics['cost'],
+                            self._get_attributed('Sales', window, same_sku))
+
+    def roas(self, window='7d', same_sku=False):
+        """Return on advertising spend: sales / cost.
+
+        Args: refer to acos().
+        """
+        return self._divide(self._get_attributed('Sales', window, same_sku),
+                            self.metrics['cost'])
+
+    def conversion_rate(self, window='7d', same_sku=False):
+        """Conversion rate: conversions / clicks.
+
+        Args: refer to acos().
+        """
+        return self._divide(
+            self._get_attributed('Conversions', window, same_sku),
+            self.metrics['clicks'])
+
+    def _get_attributed(self, name, window, same_sku):
+        """Get the column of attributed sales or conversions."""
+        if window not in self.ATTRIBUTION_WINDOWS:
+            raise ValueError('Invalid attribution window %s.' % window)
+        return self.metrics['attributed%s%s%s' % (
+            name, window, 'SameSKU' if same_sku else '')]
+
+    @staticmethod
+    def _divide(numerator, denominator):
+        """Divide element-wise, NaN where the denominator is zero."""
+        result = np.full(len(numerator), np.nan)
+        np.divide(numerator, denominator, out=result,
+                  where=denominator != 0)
+        return result
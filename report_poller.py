@@ -0,0 +1,224 @@
+"""
+Asynchronous generation and download of reports.
+
+Reports are requested up front and handed to a ReportPoller, which checks the
+status of all outstanding reports from one thread with adaptive backoff and
+starts downloading each report as soon as it is generated. Callers get a
+ReportFuture per report.
+"""
+import heapq
+import itertools
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReportFuture(object):
+    """Pending result of a report."""
+
+    def __init__(self, report_id=None):
+        """
+        Args:
+            report_id: string, ID of the requested report.
+        """
+        self.report_id = report_id
+        self.status = None      # Final status of the report, e.g., SUCCESS.
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def done(self):
+        """Check if the report is downloaded or failed."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the report.
+
+        Args:
+            timeout: float, seconds to wait, None to wait until done.
+
+        Returns:
+            The downloaded report.
+
+        Raises:
+            The exception raised while generating or downloading the report.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Report %s is not ready.' % self.report_id)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the report and get the exception raised, if any.
+
+        Args:
+            timeout: float, seconds to wait, None to wait until done.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Report %s is not ready.' % self.report_id)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """Call the callback with this future once it is done.
+
+        Args:
+            callback: callable, takes the future.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result, status='SUCCESS'):
+        """Resolve the future with the downloaded report.
+
+        Args:
+            result: the downloaded report, [] if not generated.
+            status: string, final status of the report, e.g., SUCCESS,
+                FAILURE, TIMEOUT; None if the report is not found.
+        """
+        self.status = status
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        """Resolve the future with an error."""
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        """Mark the future done and run its callbacks."""
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception('Report callback failed.')
+
+
+class ReportPoller(object):
+    """Poll the status of outstanding reports and download them.
+
+    A single thread schedules the status checks of all reports; each report
+    is checked again after an interval growing by the backoff factor. The
+    checks run on a worker pool, and the downloads on another one, so long
+    downloads never hold back the status checks.
+    """
+
+    STATUS_SUCCESS = 'SUCCESS'
+    STATUS_IN_PROGRESS = 'IN_PROGRESS'
+
+    def __init__(self, workers=8, min_interval=1.0, max_interval=30.0,
+                 backoff=1.5, timeout=600, download_workers=None):
+        """
+        Args:
+            workers: int, number of concurrent status checks.
+            min_interval: float, seconds before the first status check.
+            max_interval: float, maximum seconds between status checks.
+            backoff: float, growth factor of the interval between checks.
+            timeout: float, seconds before giving up a report.
+            download_workers: int, number of concurrent downloads, as many
+                as workers by default.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self._pool = ThreadPool(workers)
+        self._download_pool = ThreadPool(download_workers or workers)
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add(self, future, get_status, download):
+        """Poll a requested report until it is downloaded.
+
+        Args:
+            future: ReportFuture, resolved with the downloaded report, or
+                with [] if the report failed or timed out.
+            get_status: callable, returns the status and download location
+                of the report; the status is None if the report is gone.
+            download: callable, takes the location, returns the report.
+        """
+        report = {
+            'future': future,
+            'get_status': get_status,
+            'download': download,
+            'interval': self.min_interval,
+            'deadline': time.time() + self.timeout,
+        }
+        self._schedule(report, self.min_interval)
+
+    def pending(self):
+        """Get the number of reports waiting for a status check."""
+        with self._cond:
+            return len(self._heap)
+
+    def _schedule(self, report, delay):
+        """Schedule the next status check of the report."""
+        with self._cond:
+            heapq.heappush(
+                self._heap,
+                (time.time() + delay, next(self._counter), report))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='ReportPoller')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        """Hand the reports due for a status check to the worker pool."""
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(
+                        self._heap[0][0] - now if self._heap else None)
+                _, _, report = heapq.heappop(self._heap)
+            self._pool.apply_async(self._check, (report, ))
+
+    def _check(self, report):
+        """Check the status of the report, download it if generated."""
+        future = report['future']
+        try:
+            status, location = report['get_status']()
+            if status == self.STATUS_SUCCESS:
+                self._download_pool.apply_async(
+                    self._download, (report, location))
+            elif status != self.STATUS_IN_PROGRESS:
+                logger.error('Report %s is %s.', future.report_id, status)
+                future.set_result([], status)
+            elif time.time() > report['deadline']:
+                logger.error('Report %s timed out.', future.report_id)
+                future.set_result([], 'TIMEOUT')
+            else:
+                report['interval'] = min(
+                    report['interval'] * self.backoff, self.max_interval)
+                self._schedule(report, report['interval'])
+        except Exception as e:
+            logger.exception('Failed to get report %s.', future.report_id)
+            future.set_exception(e)
+
+    def _download(self, report, location):
+        """Download the generated report."""
+        future = report['future']
+        try:
+            future.set_result(report['download'](location))
+        except Exception as e:
+            logger.exception('Failed to download report %s.',
+                             future.report_id)
+            future.set_exception(e)
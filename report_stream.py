@@ -0,0 +1,222 @@
+"""
+Incremental decoding of gzipped JSON reports.
+
+Reports are downloaded as gzip compressed JSON arrays. The decoders below
+decompress the downloaded chunks and parse the array row by row, so only
+one chunk and the row being parsed are held in memory. Chunks are pushed to
+the decoders with feed(), which suits both blocking and asyncio downloads.
+"""
+import codecs
+import json
+import zlib
+
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_WHITESPACE = ' \t\n\r'
+
+
+class GunzipDecoder(object):
+    """Decompress gzip data chunk by chunk.
+
+    Data which is not gzip compressed, e.g., already decoded by the HTTP
+    client because of Content-Encoding, is passed through.
+    """
+
+    def __init__(self):
+        self._decompressor = None
+        self._head = b''
+
+    def feed(self, chunk):
+        """Decompress a chunk.
+
+        Args:
+            chunk: bytes.
+
+        Returns:
+            Decompressed bytes, possibly empty.
+        """
+        if self._decompressor is None:
+            # Detect the format once the magic number is complete.
+            self._head += chunk
+            if len(self._head) < len(_GZIP_MAGIC):
+                return b''
+            chunk, self._head = self._head, b''
+            if chunk.startswith(_GZIP_MAGIC):
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                self._decompressor = False
+        if self._decompressor:
+            return self._decompressor.decompress(chunk)
+        return chunk
+
+    def close(self):
+        """Get the remaining decompressed bytes."""
+        if self._head:
+            return self._head
+        if self._decompressor:
+            return self._decompressor.flush()
+        return b''
+
+
+class JSONArrayDecoder(object):
+    """Parse a JSON array incrementally."""
+
+    def __init__(self, encoding='utf-8'):
+        """
+        Args:
+            encoding: string, encoding of the bytes.
+        """
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder(encoding)()
+        self._buf = ''
+        self._started = False
+        self._ended = False
+
+    def feed(self, chunk):
+        """Parse a chunk of the array.
+
+        Args:
+            chunk: bytes.
+
+        Returns:
+            A list of the elements completed by the chunk.
+
+        Raises:
+            ValueError: the data is not a JSON array.
+        """
+        buf = self._buf + self._text_decoder.decode(chunk)
+        pos = 0
+        elements = []
+        while True:
+            # Skip the whitespace and separators before the next element.
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buf) or self._ended:
+                break
+            if not self._started:
+                if buf[pos] != '[':
+                    raise ValueError('Report is not a JSON array.')
+                self._started = True
+                pos += 1
+                continue
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                self._ended = True
+                pos += 1
+                break
+
+            try:
+                element, end = self._decoder.raw_decode(buf, pos)
+            except ValueError:
+                break       # Incomplete element, wait for more data.
+            # An element is complete only if followed by a delimiter, e.g.,
+            # a number split across chunks.
+            next_pos = end
+            while next_pos < len(buf) and buf[next_pos] in _WHITESPACE:
+                next_pos += 1
+            if next_pos == len(buf):
+                break
+            pos = end
+            elements.append(element)
+
+        self._buf = buf[pos:]
+        return elements
+
+    def close(self):
+        """Check that the array is complete.
+
+        Raises:
+            ValueError: the array is truncated.
+        """
+        buf = self._buf + self._text_decoder.decode(b'', True)
+        if not self._ended and (self._started or buf.strip()):
+            raise ValueError('Report is truncated.')
+
+
+class ReportDecoder(object):
+    """Decode the rows of a gzipped JSON report chunk by chunk."""
+
+    def __init__(self):
+        self._gunzip = GunzipDecoder()
+        self._json = JSONArrayDecoder()
+
+    def feed(self, chunk):
+        """Decode a chunk of the report.
+
+        Args:
+            chunk: bytes.
+
+        Returns:
+            A list of the rows completed by the chunk.
+        """
+        data = self._gunzip.feed(chunk)
+        return self._json.feed(data) if data else []
+
+    def close(self):
+        """Get the last rows and check that the report is complete.
+
+        Returns:
+            A list of rows.
+        """
+        data = self._gunzip.close()
+        rows = self._json.feed(data) if data else []
+        self._json.close()
+        return rows
+
+
+def iter_gunzip(chunks):
+    """Decompress gzip data chunk by chunk.
+
+    Args:
+        chunks: iterator of bytes.
+
+    Returns:
+        An iterator of decompressed bytes.
+    """
+    decoder = GunzipDecoder()
+    for chunk in chunks:
+        data = decoder.feed(chunk)
+        if data:
+            yield data
+    data = decoder.close()
+    if data:
+        yield data
+
+
+def iter_json_array(chunks, encoding='utf-8'):
+    """Parse a JSON array incrementally and yield its elements.
+
+    Args:
+        chunks: iterator of bytes, the encoded JSON array.
+        encoding: string, encoding of the bytes.
+
+    Returns:
+        An iterator of the decoded elements of the array.
+
+    Raises:
+        ValueError: the data is not a valid JSON array.
+    """
+    decoder = JSONArrayDecoder(encoding)
+    for chunk in chunks:
+        for element in decoder.feed(chunk):
+            yield element
+    decoder.close()
+
+
+def iter_gzip_json_array(chunks):
+    """Decompress a gzipped JSON array and yield its elements.
+
+    Args:
+        chunks: iterator of bytes, the gzipped JSON array.
+
+    Returns:
+        An iterator of the decoded elements of the array.
+    """
+    decoder = ReportDecoder()
+    for chunk in chunks:
+        for row in decoder.feed(chunk):
+            yield row
+    for row in decoder.close():
+        yield row
@@ -0,0 +1,283 @@
+"""
+Metrics of the outbound requests of the API clients.
+
+Clients report each API call (an HTTP request of Amazon, a SOAP get/mutate
+or report download of Google) to a RequestMetrics registry, which keeps
+counters and latency histograms per client, service and operation. The
+metrics are exported in the Prometheus text format, and each call is also
+passed to the listeners registered, e.g., to ship them elsewhere.
+"""
+import bisect
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Histogram of observed values over fixed bucket bounds."""
+
+    def __init__(self, bounds):
+        """
+        Args:
+            bounds: float[], sorted upper bounds of the buckets.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket is +Inf.
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Count a value in its bucket.
+
+        Args:
+            value: float.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        """Get the number of values up to each bound, +Inf last."""
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class RequestMetrics(object):
+    """Thread-safe registry of the metrics of API calls.
+
+    The metrics are labeled by client (e.g., 'amazon', 'google'), service
+    (e.g., 'keywords/extended', 'CampaignService') and operation (e.g.,
+    'GET', 'mutate'); counters are also labeled by status.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0, 30.0, 60.0)
+    SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2,
+                    100 * 1024 ** 2)
+
+    def __init__(self, namespace='ads_api', latency_buckets=LATENCY_BUCKETS,
+                 size_buckets=SIZE_BUCKETS):
+        """
+        Args:
+            namespace: string, prefix of the exported metric names.
+            latency_buckets: float[], bounds of the latency histograms in
+                seconds.
+            size_buckets: int[], bounds of the response size histograms in
+                bytes.
+        """
+        self.namespace = namespace
+        self.latency_buckets = tuple(latency_buckets)
+        self.size_buckets = tuple(size_buckets)
+        # Counters keyed by (client, service, operation), and by status too
+        # for the requests.
+        self._requests = {}
+        self._retries = {}
+        self._bytes_sent = {}
+        self._bytes_received = {}
+        self._pages = {}
+        self._latency = {}
+        self._response_size = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Pass each recorded call to the listener.
+
+        Args:
+            listener: callable, takes the dict of a call, refer to record().
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop passing the recorded calls to the listener."""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def record(self, client, service, operation, status, seconds,
+               bytes_sent=None, bytes_received=None, retries=0, page=None):
+        """Record an API call.
+
+        Args:
+            client: string, e.g., 'amazon', 'google'.
+            service: string, endpoint or service name, e.g., 'keywords'.
+            operation: string, e.g., 'GET', 'PUT', 'get', 'mutate'.
+            status: string or int, HTTP status or outcome, e.g., 200, 'OK',
+                or the name of the error raised.
+            seconds: float, latency of the call, including its retries.
+            bytes_sent: int, size of the request body, None if unknown.
+            bytes_received: int, size of the response body, None if unknown.
+            retries: int, number of times the call was retried.
+            page: int, zero-based page number of a paged get.
+        """
+        key = (client, service, operation)
+        with self._lock:
+            status_key = key + (str(status), )
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            if retries:
+                self._retries[key] = self._retries.get(key, 0) + retries
+            if bytes_sent:
+                self._bytes_sent[key] = (
+                    self._bytes_sent.get(key, 0) + bytes_sent)
+            if bytes_received is not None:
+                self._bytes_received[key] = (
+                    self._bytes_received.get(key, 0) + bytes_received)
+                self._get_histogram(
+                    self._response_size, key, self.size_buckets).observe(
+                        bytes_received)
+            if page is not None:
+                self._pages[key] = self._pages.get(key, 0) + 1
+            self._get_histogram(
+                self._latency, key, self.latency_buckets).observe(seconds)
+            listeners = list(self._listeners)
+
+        if not listeners:
+            return
+        call = {
+            'client': client,
+            'service': service,
+            'operation': operation,
+            'status': status,
+            'seconds': seconds,
+            'bytes_sent': bytes_sent,
+            'bytes_received': bytes_received,
+            'retries': retries,
+            'page': page,
+        }
+        for listener in listeners:
+            try:
+                listener(call)
+            except Exception:
+                logger.exception('Request metrics listener failed.')
+
+    @staticmethod
+    def _get_histogram(histograms, key, bounds):
+        """Get the histogram of the key, create it if missing."""
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(bounds)
+        return histogram
+
+    def reset(self):
+        """Drop all the recorded metrics."""
+        with self._lock:
+            for metrics in (self._requests, self._retries, self._bytes_sent,
+                            self._bytes_received, self._pages,
+                            self._latency, self._response_size):
+                metrics.clear()
+
+    def get_stats(self):
+        """Get a summary of the recorded metrics.
+
+        Returns:
+            A list of dict per (client, service, operation):
+                [
+                    {
+                        'client': 'amazon',
+                        'service': 'keywords/extended',
+                        'operation': 'GET',
+                        'requests': {'200': 12, '429': 1},
+                        'seconds': <total latency>,
+                        'retries': <total retries>,
+                        'bytes_sent': <total bytes sent>,
+                        'bytes_received': <total bytes received>,
+                        'pages': <number of paged gets>,
+                    },
+                ]
+        """
+        with self._lock:
+            stats = {}
+            for (client, service, operation, status), count in (
+                    self._requests.items()):
+                key = (client, service, operation)
+                if key not in stats:
+                    histogram = self._latency.get(key)
+                    stats[key] = {
+                        'client': client,
+                        'service': service,
+                        'operation': operation,
+                        'requests': {},
+                        'seconds': histogram.sum if histogram else 0.0,
+                        'retries': self._retries.get(key, 0),
+                        'bytes_sent': self._bytes_sent.get(key, 0),
+                        'bytes_received': self._bytes_received.get(key, 0),
+                        'pages': self._pages.get(key, 0),
+                    }
+                stats[key]['requests'][status] = count
+        return [stats[key] for key in sorted(stats)]
+
+    def export_prometheus(self):
+        """Export the metrics in the Prometheus text format.
+
+        Returns:
+            A string.
+        """
+        name = self.namespace + '_request'
+        lines = []
+        with self._lock:
+            self._export_counter(
+                lines, name + 's_total', 'API calls by status.',
+                self._requests, ('client', 'service', 'operation', 'status'))
+            self._export_counter(
+                lines, name + '_retries_total', 'Retries of API calls.',
+                self._retries)
+            self._export_counter(
+                lines, name + '_pages_total', 'Pages fetched by API calls.',
+                self._pages)
+            self._export_counter(
+                lines, name + '_sent_bytes_total',
+                'Bytes sent in request bodies.', self._bytes_sent)
+            self._export_counter(
+                lines, name + '_received_bytes_total',
+                'Bytes received in response bodies.', self._bytes_received)
+            self._export_histogram(
+                lines, name + '_duration_seconds',
+                'Latency of API calls, including retries.', self._latency)
+            self._export_histogram(
+                lines, name + '_response_bytes',
+                'Size of response bodies.', self._response_size)
+        return '\n'.join(lines) + '\n'
+
+    def _export_counter(self, lines, name, help_text, values,
+                        label_names=('client', 'service', 'operation')):
+        """Append the lines of a counter."""
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s counter' % name)
+        for key in sorted(values):
+            lines.append('%s{%s} %s' % (
+                name, self._format_labels(label_names, key), values[key]))
+
+    def _export_histogram(self, lines, name, help_text, histograms):
+        """Append the lines of a histogram."""
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        label_names = ('client', 'service', 'operation')
+        for key in sorted(histograms):
+            histogram = histograms[key]
+            labels = self._format_labels(label_names, key)
+            bounds = [repr(float(b)) for b in histogram.bounds] + ['+Inf']
+            for bound, count in zip(bounds,
+                                    histogram.get_cumulative_counts()):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (
+                    name, labels, bound, count))
+            lines.append('%s_sum{%s} %r' % (name, labels, histogram.sum))
+            lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+    @staticmethod
+    def _format_labels(names, values):
+        """Format the labels of a sample, escaping the values."""
+        return ','.join(
+            '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n'))
+            for name, value in zip(names, values))
+
+
+# Registry shared by the clients of the process.
+REQUEST_METRICS = RequestMetrics()
@@ -0,0 +1,75 @@
+"""
+Fixtures of the tests of the clients against FakeAdsServer.
+
+The repository is a package imported by its directory name, e.g.,
+ads_api_impl, so its parent directory is put on the path.
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_ROOT))
+
+# The asyncio client requires Python 3.6+.
+collect_ignore = []
+if sys.version_info < (3, 6):
+    collect_ignore.append('test_amazon_ads_api_async.py')
+
+
+def import_module(name):
+    """Import a module of the repository package.
+
+    Args:
+        name: string, name of the module, e.g., 'amazon_ads_api'.
+    """
+    return importlib.import_module('%s.%s' % (os.path.basename(_ROOT), name))
+
+
+PROFILE_ID = 1
+
+
+@pytest.fixture
+def make_server(monkeypatch):
+    """Start fake servers installed into AdsAPIClient, stopped after the
+    test.
+
+    The rate limits of the client are lifted and the report poller checks
+    the reports every 10ms, so the tests run fast.
+    """
+    amazon_ads_api = import_module('amazon_ads_api')
+    fake_ads_server = import_module('fake_ads_server')
+    rate_limiter = import_module('rate_limiter')
+    report_poller = import_module('report_poller')
+    client_class = amazon_ads_api.AdsAPIClient
+    monkeypatch.setattr(client_class, '_scheduler',
+                        rate_limiter.RequestScheduler(
+                            {'region': 1e6, 'profile': 1e6}))
+    monkeypatch.setattr(client_class, '_report_poller',
+                        report_poller.ReportPoller(min_interval=0.01))
+    servers = []
+
+    def make(**options):
+        server = fake_ads_server.FakeAdsServer(**options).start()
+        server.install(client_class)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.uninstall()
+        server.stop()
+
+
+@pytest.fixture
+def make_client():
+    """Build clients of the test profile with a fresh access token."""
+    amazon_ads_api = import_module('amazon_ads_api')
+
+    def make():
+        return amazon_ads_api.AdsAPIClient(
+            PROFILE_ID, 'US', 'test-access-token', 'test-refresh-token',
+            amazon_ads_api.AccessTokenCache.now())
+    return make
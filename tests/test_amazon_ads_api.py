@@ -0,0 +1,106 @@
+"""
+Tests of AdsAPIClient paging against FakeAdsServer.
+"""
+import time
+
+import pytest
+
+from conftest import PROFILE_ID
+from conftest import import_module
+
+amazon_ads_api = import_module('amazon_ads_api')
+
+AdsAPIError = amazon_ads_api.AdsAPIError
+
+
+@pytest.mark.parametrize('page_workers', [1, 4])
+def test_failed_page_raises(make_server, make_client, page_workers):
+    server = make_server(error_rate=0.3)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=4, keywords=100)
+    client = make_client()
+
+    with pytest.raises(AdsAPIError) as error:
+        client._get_entities('keywords', page_size=10,
+                             page_workers=page_workers)
+    assert error.value.args[0] == 500
+
+
+def test_forbidden_page_raises(make_server, make_client):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=10)
+    client = make_client()
+    client.profile_id = None    # No scope, answered with a 400.
+
+    with pytest.raises(AdsAPIError) as error:
+        client._get_entities('keywords')
+    assert error.value.args[0] == 400
+
+
+def test_speculative_pages_beyond_the_end(make_server, make_client):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=25)
+    client = make_client()
+
+    keywords = client._get_entities('keywords', page_size=10,
+                                    page_workers=8)
+    assert len(keywords) == 25
+
+
+@pytest.mark.parametrize('page_workers', [1, 4])
+def test_failed_stream_raises(make_server, make_client, page_workers):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=50)
+    client = make_client()
+
+    pages = client._iter_entities('keywords', by_page=True, page_size=10,
+                                  page_workers=page_workers)
+    assert len(next(pages)) == 10
+    server.error_rate = 1.0
+    with pytest.raises(AdsAPIError):
+        for _ in pages:
+            pass
+
+
+def test_failed_split_stream_raises(make_server, make_client, monkeypatch):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=5, keywords=20)
+    monkeypatch.setattr(amazon_ads_api.AdsAPIClient, '_MAX_URL_LENGTH', 300)
+    client = make_client()
+    keyword_ids = [k['keywordId'] for k in
+                   server.get_entities(PROFILE_ID, 'keywords')]
+
+    server.error_rate = 1.0
+    with pytest.raises(AdsAPIError):
+        list(client.iter_keywords(keyword_ids=keyword_ids))
+
+
+def test_split_stream_is_bounded(make_server, make_client, monkeypatch):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=5, keywords=20)
+    monkeypatch.setattr(amazon_ads_api.AdsAPIClient, '_MAX_URL_LENGTH', 300)
+    client = make_client()
+    keyword_ids = [k['keywordId'] for k in
+                   server.get_entities(PROFILE_ID, 'keywords')]
+
+    pages = client._iter_entities(
+        'keywords', {'keywordIdFilter': ','.join(map(str, keyword_ids))},
+        by_page=True, page_size=1)
+    next(pages)
+    time.sleep(0.5)
+    # The sub-queries wait for the caller once their queues are full, with
+    # their next pages requested.
+    requests = server.stats['GET keywords 200']
+    client_class = amazon_ads_api.AdsAPIClient
+    assert requests <= 1 + client_class._SPLIT_WORKERS * (
+        client_class._SPLIT_QUEUE_SIZE + 1 + client_class._PAGE_WORKERS)
+    pages.close()
+    time.sleep(0.5)
+    assert server.stats['GET keywords 200'] <= requests + 4
+
+
+def test_entities_without_ids_are_kept():
+    seen = set()
+    page = [{'keywordId': 1}, {}, {'keywordId': None}, {'keywordId': 1}, {}]
+    assert amazon_ads_api.AdsAPIClient._drop_seen(
+        page, 'keywordId', seen) == page[:3] + page[4:]
+    assert seen == set([1])
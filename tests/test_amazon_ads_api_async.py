@@ -0,0 +1,145 @@
+"""
+Tests of AsyncAdsAPIClient against FakeAdsServer.
+"""
+import asyncio
+
+import pytest
+
+from conftest import PROFILE_ID
+from conftest import import_module
+
+pytest.importorskip('aiohttp')
+
+amazon_ads_api = import_module('amazon_ads_api')
+amazon_ads_api_async = import_module('amazon_ads_api_async')
+token_store = import_module('token_store')
+
+AdsAPIError = amazon_ads_api.AdsAPIError
+AsyncAdsAPIClient = amazon_ads_api_async.AsyncAdsAPIClient
+
+
+def _run(coroutine):
+    """Run a coroutine on a new event loop, closing its sessions after."""
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await AsyncAdsAPIClient.close_sessions()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def _make_client():
+    return AsyncAdsAPIClient(
+        PROFILE_ID, 'US', 'test-access-token', 'test-refresh-token',
+        amazon_ads_api.AccessTokenCache.now())
+
+
+def test_paging(make_server):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=2, adgroups=2, keywords=30)
+    expected = [k['keywordId'] for k in
+                server.get_entities(PROFILE_ID, 'keywords')]
+
+    async def run():
+        client = _make_client()
+        keywords = await client._get_entities(
+            'keywords', page_size=7, page_workers=3)
+        streamed = [k async for k in client.iter_keywords()]
+        return keywords, streamed
+
+    keywords, streamed = _run(run())
+    assert [k['keywordId'] for k in keywords] == expected
+    assert len(streamed) == len(expected)
+
+
+def test_failed_page_raises(make_server):
+    server = make_server(error_rate=0.5)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=4, keywords=50)
+
+    with pytest.raises(AdsAPIError):
+        _run(_make_client()._get_entities('keywords', page_size=10))
+
+
+def test_report_download(make_server, monkeypatch):
+    server = make_server(report_delay=0.05)
+    server.populate(PROFILE_ID, campaigns=2, adgroups=2, keywords=5)
+    monkeypatch.setattr(AsyncAdsAPIClient, '_REPORT_MIN_INTERVAL', 0.01)
+
+    rows = _run(_make_client().get_report('keywords', '20180101'))
+    assert len(rows) == 20
+
+
+def test_report_status_without_json_raises(make_server, monkeypatch):
+    make_server()
+    client = _make_client()
+
+    async def send(method, url, **kwargs):
+        return 502, None
+    monkeypatch.setattr(client, '_send', send)
+
+    with pytest.raises(AdsAPIError) as error:
+        _run(client._get_report_status('amzn1.report.1'))
+    assert error.value.args[0] == 502
+
+
+def test_mutation_retries(make_server, monkeypatch):
+    server = make_server(entity_error_rate=0.2)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=40)
+    monkeypatch.setattr(AsyncAdsAPIClient, '_BATCH_RETRIES', 10)
+    monkeypatch.setattr(AsyncAdsAPIClient, '_BATCH_RETRY_DELAY', 0.01)
+    keywords = server.get_entities(PROFILE_ID, 'keywords')
+
+    results = _run(_make_client().update_keywords_v2(
+        [{'keywordId': k['keywordId'], 'bid': 0.9} for k in keywords]))
+    assert [r['code'] for r in results] == ['SUCCESS'] * len(keywords)
+
+
+def test_refresh_waits_for_the_store_lock(make_server, monkeypatch, tmpdir):
+    make_server()
+    store = token_store.FileTokenStore(str(tmpdir.join('tokens.json')))
+    monkeypatch.setattr(amazon_ads_api.AdsAPIClient, '_token_cache',
+                        amazon_ads_api.AccessTokenCache(store=store))
+    now = amazon_ads_api.AccessTokenCache.now()
+
+    async def run():
+        with store.lock('refresh-token'):
+            refresh = asyncio.ensure_future(
+                AsyncAdsAPIClient.refresh_access_token('refresh-token'))
+            await asyncio.sleep(0.1)
+            # Another process refreshes while holding the lock.
+            assert not refresh.done()
+            store.save('refresh-token', 'token-of-other-process', now)
+        return await refresh
+
+    assert _run(run()) == ('token-of-other-process', now)
+
+
+def test_split_stream_is_bounded(make_server, monkeypatch):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=5, keywords=20)
+    monkeypatch.setattr(AsyncAdsAPIClient, '_MAX_URL_LENGTH', 300)
+    keyword_ids = ','.join(str(k['keywordId']) for k in
+                           server.get_entities(PROFILE_ID, 'keywords'))
+
+    async def run():
+        pages = _make_client()._iter_entities(
+            'keywords', {'keywordIdFilter': keyword_ids}, by_page=True,
+            page_size=1)
+        await pages.__anext__()
+        await asyncio.sleep(0.5)
+        requests = server.stats['GET keywords 200']
+        await pages.aclose()
+        return requests
+
+    # The sub-queries wait for the caller once their queues are full, with
+    # their next pages requested.
+    client_class = AsyncAdsAPIClient
+    assert _run(run()) <= 1 + client_class._SPLIT_WORKERS * (
+        client_class._SPLIT_QUEUE_SIZE + 1 + client_class._PAGE_WORKERS)
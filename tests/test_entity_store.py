@@ -0,0 +1,131 @@
+"""
+Tests of EntityStore and EntitySync against FakeAdsServer.
+"""
+import sqlite3
+import time
+
+import pytest
+
+from conftest import PROFILE_ID
+from conftest import import_module
+
+amazon_ads_api = import_module('amazon_ads_api')
+entity_store = import_module('entity_store')
+
+AdsAPIError = amazon_ads_api.AdsAPIError
+EntityStore = entity_store.EntityStore
+EntitySync = entity_store.EntitySync
+
+
+def _keywords(store):
+    return dict((k['keywordId'], k) for k in
+                store.get_keywords(PROFILE_ID))
+
+
+def test_failed_page_does_not_archive(make_server, make_client, tmpdir):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=5, keywords=200)
+    store = EntityStore(str(tmpdir.join('entities.db')))
+    sync = EntitySync(make_client(), store, entity_types=('keywords',))
+    sync.sync()
+    keywords = _keywords(store)
+    synced_at = store.get_synced_at(PROFILE_ID, 'keywords')
+
+    server.error_rate = 0.5
+    with pytest.raises(AdsAPIError):
+        sync.sync_changes()
+    assert _keywords(store) == keywords
+    assert store.get_synced_at(PROFILE_ID, 'keywords') == synced_at
+
+    server.error_rate = 0
+    assert sync.sync_changes()['keywords'] == {
+        'inserted': 0, 'updated': 0, 'archived': 0}
+
+
+def test_changes_older_than_the_last_sync(make_server, make_client, tmpdir):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=3)
+    store = EntityStore(str(tmpdir.join('entities.db')))
+    sync = EntitySync(make_client(), store, entity_types=('keywords',))
+    sync.sync()
+    keywords = server.get_entities(PROFILE_ID, 'keywords')
+    # The latest lastUpdatedDate stored is ahead of the next updates.
+    keywords[1] = dict(keywords[1], lastUpdatedDate=(
+        keywords[1]['lastUpdatedDate'] + 10 ** 6))
+    store.apply_changes(PROFILE_ID, 'keywords', [keywords])
+
+    time.sleep(0.01)
+    make_client().update_keywords_v2([{'keywordId': keywords[0]['keywordId'],
+                                       'bid': 2.0}])
+    assert sync.sync_changes()['keywords'] == {
+        'inserted': 0, 'updated': 1, 'archived': 0}
+    assert _keywords(store)[keywords[0]['keywordId']]['bid'] == 2.0
+
+
+def test_sync_state_of_older_databases(tmpdir):
+    path = str(tmpdir.join('entities.db'))
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE sync_state (profile_id TEXT, entity_type TEXT, '
+        'synced_at REAL, PRIMARY KEY (profile_id, entity_type))')
+    conn.execute("INSERT INTO sync_state VALUES ('1', 'keywords', 10.0)")
+    conn.commit()
+    conn.close()
+
+    store = EntityStore(path)
+    assert store.get_sync_state(PROFILE_ID, 'keywords') == {
+        'synced_at': 10.0, 'reconciled_at': None}
+    store.apply_changes(PROFILE_ID, 'keywords',
+                        [[{'keywordId': 1, 'state': 'enabled'}]])
+    store.replace(PROFILE_ID, 'campaigns',
+                  [[{'campaignId': 1, 'state': 'enabled'}]])
+    assert store.get_sync_state(PROFILE_ID, 'keywords')['synced_at'] > 10
+    assert store.get_sync_state(PROFILE_ID, 'campaigns')['reconciled_at']
+
+
+def test_failed_page_does_not_replace(make_server, make_client, tmpdir):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=5, keywords=200)
+    store = EntityStore(str(tmpdir.join('entities.db')))
+    sync = EntitySync(make_client(), store, entity_types=('keywords',))
+    assert sync.sync() == {'keywords': 1000}
+    keywords = _keywords(store)
+    state = store.get_sync_state(PROFILE_ID, 'keywords')
+
+    server.error_rate = 0.5
+    with pytest.raises(AdsAPIError):
+        sync.sync()
+    assert _keywords(store) == keywords
+    assert store.get_sync_state(PROFILE_ID, 'keywords') == state
+
+
+def test_replace_rolls_back_when_the_pages_raise(tmpdir):
+    store = EntityStore(str(tmpdir.join('entities.db')))
+    store.replace(PROFILE_ID, 'campaigns',
+                  [[{'campaignId': 1, 'state': 'enabled'}]])
+
+    def pages():
+        yield [{'campaignId': 2, 'state': 'enabled'}]
+        raise IOError('Connection reset.')
+
+    with pytest.raises(IOError):
+        store.replace(PROFILE_ID, 'campaigns', pages())
+    assert store.get_campaigns(PROFILE_ID) == [
+        {'campaignId': 1, 'state': 'enabled'}]
+    # The staged rows are not written by the next replace.
+    store.replace(PROFILE_ID, 'campaigns',
+                  [[{'campaignId': 3, 'state': 'paused'}]])
+    assert store.get_campaigns(PROFILE_ID) == [
+        {'campaignId': 3, 'state': 'paused'}]
+
+
+def test_lookups_of_many_ids(tmpdir):
+    store = EntityStore(str(tmpdir.join('entities.db')))
+    store.replace(PROFILE_ID, 'keywords', [[
+        {'keywordId': i, 'adGroupId': i % 7, 'state': 'enabled',
+         'matchType': 'exact' if i % 2 else 'broad'} for i in range(2000)]])
+
+    keywords = store.get_keywords(PROFILE_ID, keyword_ids=range(0, 2000, 3),
+                                  match_type='broad,phrase')
+    assert [k['keywordId'] for k in keywords] == list(range(0, 2000, 6))
+    assert len(store.get_keywords(PROFILE_ID, adgroup_ids=3)) == 286
@@ -0,0 +1,241 @@
+"""
+Tests of AdsAPIClient against FakeAdsServer.
+"""
+import time
+
+import requests
+
+from conftest import PROFILE_ID
+from conftest import import_module
+
+amazon_ads_api = import_module('amazon_ads_api')
+entity_store = import_module('entity_store')
+fake_ads_server = import_module('fake_ads_server')
+report_cache = import_module('report_cache')
+
+AdsAPIClient = amazon_ads_api.AdsAPIClient
+
+
+def test_paging(make_server, make_client):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=2, adgroups=3, keywords=50)
+    client = make_client()
+    expected = [k['keywordId'] for k in
+                server.get_entities(PROFILE_ID, 'keywords')]
+
+    for page_workers in (1, 4):
+        keywords = client._get_entities(
+            'keywords', page_size=40, page_workers=page_workers)
+        assert [k['keywordId'] for k in keywords] == expected
+
+    pages = list(client._iter_entities('keywords', by_page=True,
+                                       page_size=40))
+    assert [len(page) for page in pages] == [40] * 7 + [20]
+
+
+def test_paging_split_id_filter(make_server, make_client, monkeypatch):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=2, adgroups=5, keywords=20)
+    monkeypatch.setattr(AdsAPIClient, '_MAX_URL_LENGTH', 300)
+    client = make_client()
+    keyword_ids = [k['keywordId'] for k in
+                   server.get_entities(PROFILE_ID, 'keywords')]
+
+    keywords = client.get_keywords(keyword_ids=keyword_ids + keyword_ids[:10],
+                                   load_extended_fields=False)
+    assert sorted(k['keywordId'] for k in keywords) == keyword_ids
+
+
+def test_multi_status_retry(make_server, make_client, monkeypatch):
+    server = make_server(entity_error_rate=0.2)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=2, keywords=100)
+    monkeypatch.setattr(AdsAPIClient, '_BATCH_RETRIES', 10)
+    monkeypatch.setattr(AdsAPIClient, '_BATCH_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(AdsAPIClient, '_BATCH_SIZE', 50)
+    client = make_client()
+    keywords = server.get_entities(PROFILE_ID, 'keywords')
+
+    results = client.update_keywords_v2(
+        [{'keywordId': k['keywordId'], 'bid': 0.75} for k in keywords])
+
+    assert [r['code'] for r in results] == ['SUCCESS'] * len(keywords)
+    assert [r['keywordId'] for r in results] == [
+        k['keywordId'] for k in keywords]
+    # The entities failed transiently were sent again.
+    assert server.stats['PUT keywords 207'] > 4
+    assert all(k['bid'] == 0.75 for k in
+               server.get_entities(PROFILE_ID, 'keywords'))
+
+
+def test_create_is_not_retried_when_busy(make_server, make_client,
+                                         monkeypatch):
+    server = make_server(entity_error_rate=1.0)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1)
+    monkeypatch.setattr(AdsAPIClient, '_BATCH_RETRY_DELAY', 0.01)
+    client = make_client()
+    adgroup = server.get_entities(PROFILE_ID, 'adGroups')[0]
+
+    results = client.create_keywords_v2([{
+        'campaignId': adgroup['campaignId'],
+        'adGroupId': adgroup['adGroupId'],
+        'keywordText': 'new keyword', 'matchType': 'exact',
+        'state': 'enabled', 'bid': 0.5}])
+
+    assert [r['code'] for r in results] == ['SERVER_IS_BUSY']
+    assert server.stats['POST keywords 207'] == 1
+
+
+def test_throttled_request_waits_retry_after(make_server, make_client):
+    server = make_server(throttle_rate=0.3, retry_after=1)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=100)
+    client = make_client()
+
+    start_time = time.time()
+    keywords = client._get_entities('keywords', page_size=10)
+
+    assert len(keywords) == 100
+    throttled = server.stats.get('GET keywords 429', 0)
+    assert throttled
+    assert time.time() - start_time >= throttled * server.retry_after
+    assert AdsAPIClient._scheduler.stats['throttled'] == throttled
+
+
+def test_report_download(make_server, make_client, monkeypatch, tmpdir):
+    server = make_server(report_delay=0.05)
+    server.populate(PROFILE_ID, campaigns=2, adgroups=2, keywords=30)
+    client = make_client()
+
+    rows = client.get_report('keywords', '20180101')
+    assert len(rows) == 120
+    assert set(r['keywordId'] for r in rows) == set(
+        k['keywordId'] for k in server.get_entities(PROFILE_ID, 'keywords'))
+
+    cache = report_cache.ReportCache(str(tmpdir))
+    monkeypatch.setattr(AdsAPIClient, '_report_cache', cache)
+    assert list(client.iter_report('keywords', '20180101')) == rows
+    assert cache.stats['saves'] == 1
+    requests = sum(server.stats.values())
+    assert list(client.iter_report('keywords', '20180101')) == rows
+    assert cache.stats['hits'] == 1
+    assert sum(server.stats.values()) == requests
+
+
+def test_entity_sync(make_server, make_client, tmpdir):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=2, adgroups=2, keywords=10,
+                    ads=2)
+    client = make_client()
+    store = entity_store.EntityStore(str(tmpdir.join('entities.db')))
+    sync = entity_store.EntitySync(client, store,
+                                   entity_types=('keywords', 'productAds'))
+
+    assert sync.sync() == {'keywords': 40, 'productAds': 8}
+    adgroup_id = server.get_entities(PROFILE_ID, 'adGroups')[0]['adGroupId']
+    assert len(store.get_keywords(PROFILE_ID, adgroup_ids=[adgroup_id])) == 10
+
+    keyword_id = server.get_entities(PROFILE_ID, 'keywords')[0]['keywordId']
+    ad_id = server.get_entities(PROFILE_ID, 'productAds')[0]['adId']
+    time.sleep(0.01)    # lastUpdatedDate is in milliseconds.
+    client.update_keywords_v2([{'keywordId': keyword_id, 'bid': 1.5}])
+    client.delete_ads([ad_id])
+
+    changes = sync.sync_changes()
+    assert changes['keywords'] == {
+        'inserted': 0, 'updated': 1, 'archived': 0}
+    assert changes['productAds'] == {
+        'inserted': 0, 'updated': 0, 'archived': 1}
+    assert store.get_keywords(
+        PROFILE_ID, keyword_ids=[keyword_id])[0]['bid'] == 1.5
+    assert store.get_ads(PROFILE_ID, ad_ids=[ad_id])[0]['state'] == 'archived'
+
+
+def _get(server, path, profile_id=PROFILE_ID, token='Bearer token'):
+    headers = {'Authorization': token} if token else {}
+    if profile_id:
+        headers['Amazon-Advertising-API-Scope'] = str(profile_id)
+    return requests.get(server.api_endpoint % path, headers=headers)
+
+
+def _start(**options):
+    server = fake_ads_server.FakeAdsServer(**options).start()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=10)
+    return server
+
+
+def test_injected_errors_and_throttling():
+    for options, status in (({'error_rate': 1.0}, 500),
+                            ({'throttle_rate': 1.0, 'retry_after': 7}, 429)):
+        server = _start(**options)
+        try:
+            response = _get(server, 'keywords')
+            assert response.status_code == status
+            assert server.stats == {'GET keywords %d' % status: 1}
+            if status == 429:
+                assert response.headers['Retry-After'] == '7'
+
+            # The rates can be changed on the fly.
+            server.error_rate = server.throttle_rate = 0
+            assert len(_get(server, 'keywords').json()) == 10
+        finally:
+            server.stop()
+
+
+def test_injected_failures_are_seeded():
+    def statuses(seed):
+        server = _start(error_rate=0.3, throttle_rate=0.2, seed=seed)
+        try:
+            return [_get(server, 'keywords').status_code
+                    for _ in range(20)]
+        finally:
+            server.stop()
+
+    assert statuses(1) == statuses(1)
+    assert set(statuses(1)) == set([200, 429, 500])
+
+
+def test_rate_limit_per_profile():
+    server = _start(rate_limit=5)
+    server.populate(2, campaigns=1, adgroups=1, keywords=1)
+    try:
+        # Stay within one second of the server.
+        time.sleep(1 - time.time() % 1)
+        statuses = [_get(server, 'keywords').status_code for _ in range(8)]
+        other = _get(server, 'keywords', profile_id=2)
+    finally:
+        server.stop()
+
+    assert statuses == [200] * 5 + [429] * 3
+    assert other.status_code == 200
+
+
+def test_requests_rejected_before_injection():
+    server = _start(error_rate=1.0)
+    try:
+        assert _get(server, 'keywords', token=None).status_code == 401
+        assert _get(server, 'unknown/path').status_code == 500
+        server.error_rate = 0
+        assert _get(server, 'keywords', profile_id=None).status_code == 400
+        assert _get(server, 'unknown').status_code == 404
+    finally:
+        server.stop()
+    assert server.stats['unauthorized 401'] == 1
+
+
+def test_injected_entity_errors():
+    server = _start(entity_error_rate=0.5)
+    keywords = server.get_entities(PROFILE_ID, 'keywords')
+    try:
+        response = requests.put(
+            server.api_endpoint % 'keywords',
+            json=[{'keywordId': k['keywordId'], 'bid': 2.0}
+                  for k in keywords],
+            headers={'Authorization': 'Bearer token',
+                     'Amazon-Advertising-API-Scope': str(PROFILE_ID)})
+    finally:
+        server.stop()
+
+    assert response.status_code == 207
+    codes = [r['code'] for r in response.json()]
+    assert set(codes) == set(['SUCCESS', 'SERVER_IS_BUSY'])
+    assert [k['bid'] == 2.0 for k in server.get_entities(
+        PROFILE_ID, 'keywords')] == [c == 'SUCCESS' for c in codes]
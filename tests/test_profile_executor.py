@@ -0,0 +1,91 @@
+"""
+Tests of MultiProfileExecutor.
+"""
+import threading
+import time
+
+from conftest import import_module
+
+amazon_ads_api = import_module('amazon_ads_api')
+profile_executor = import_module('profile_executor')
+
+MultiProfileExecutor = profile_executor.MultiProfileExecutor
+
+PROFILES = [
+    {'profileId': 1, 'countryCode': 'US'},
+    {'profileId': 2, 'countryCode': 'CA'},
+    {'profileId': 3, 'countryCode': 'UK'},
+    {'profileId': 4, 'countryCode': 'US'},
+    {'profileId': 5, 'countryCode': 'JP'},
+    {'profileId': 6, 'countryCode': 'DE'},
+]
+
+
+class FakeClient(amazon_ads_api.AdsAPIClient):
+    """Client of the profiles above, with a fresh access token."""
+
+    @staticmethod
+    def get_profiles(refresh_token):
+        return PROFILES
+
+    @staticmethod
+    def refresh_access_token(refresh_token, access_token=None,
+                             token_time=None):
+        return ('access-token', amazon_ads_api.AccessTokenCache.now())
+
+
+def _profile_ids(clients):
+    return [int(client.profile_id) for client in clients]
+
+
+def test_get_clients():
+    executor = MultiProfileExecutor('refresh-token', client_class=FakeClient)
+
+    # The profiles of unsupported countries are skipped.
+    assert _profile_ids(executor.get_clients()) == [1, 2, 3, 4, 6]
+    assert _profile_ids(executor.get_clients(countries=['US'])) == [1, 4]
+    assert _profile_ids(executor.get_clients(
+        countries=['US', 'UK'], profile_ids=['3', 4, 6])) == [3, 4]
+    assert executor.get_clients()[0].access_token == 'access-token'
+
+
+def test_run_caps_the_operations_per_region():
+    executor = MultiProfileExecutor('refresh-token', workers=8,
+                                    region_concurrency=2,
+                                    client_class=FakeClient)
+    clients = executor.get_clients()
+    running = {}
+    peaks = {}
+    lock = threading.Lock()
+
+    def operation(client):
+        region = client.api_endpoint
+        with lock:
+            running[region] = running.get(region, 0) + 1
+            peaks[region] = max(peaks.get(region, 0), running[region])
+        time.sleep(0.05)
+        with lock:
+            running[region] -= 1
+        if client.profile_id == '2':
+            raise ValueError('Invalid profile.')
+        return client.profile_id
+
+    outcomes = executor.run(operation, clients)
+
+    assert sorted(outcomes) == ['1', '2', '3', '4', '6']
+    assert outcomes['1'] == dict(outcomes['1'], result='1', error=None)
+    assert outcomes['2']['result'] is None
+    assert isinstance(outcomes['2']['error'], ValueError)
+    assert max(peaks.values()) == 2
+    # The third profile of a region waited for a slot.
+    assert max(o['queue_seconds'] for o in outcomes.values()) >= 0.04
+    assert all(o['seconds'] >= 0.04 for o in outcomes.values())
+
+
+def test_clients_are_interleaved_by_region():
+    clients = MultiProfileExecutor(
+        'refresh-token', client_class=FakeClient).get_clients()
+
+    assert _profile_ids(MultiProfileExecutor._interleave_regions(
+        clients)) == [1, 3, 2, 6, 4]
+    assert MultiProfileExecutor('refresh-token').run(len, []) == {}
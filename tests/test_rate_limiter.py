@@ -0,0 +1,87 @@
+"""
+Tests of TokenBucket and RequestScheduler.
+"""
+from email.utils import formatdate
+import time
+
+import pytest
+
+from conftest import import_module
+
+rate_limiter = import_module('rate_limiter')
+
+RequestScheduler = rate_limiter.RequestScheduler
+TokenBucket = rate_limiter.TokenBucket
+
+
+def test_reservations_queue_up_behind_the_burst():
+    bucket = TokenBucket(10, capacity=2)
+
+    waits = [bucket.reserve() for _ in range(5)]
+    assert waits[:2] == [0, 0]
+    for wait, expected in zip(waits[2:], (0.1, 0.2, 0.3)):
+        assert wait == pytest.approx(expected, abs=0.01)
+
+
+def test_rate_adapts_to_throttling():
+    bucket = TokenBucket(16)
+
+    # Multiplicative decrease down to min_rate.
+    bucket.throttled()
+    assert bucket.rate == 8
+    for _ in range(10):
+        bucket.throttled()
+    assert bucket.rate == 1
+
+    # Additive increase up to max_rate.
+    for _ in range(10):
+        bucket.succeeded()
+    assert bucket.rate == pytest.approx(1 + 10 * 0.16)
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 16
+
+
+def test_pause_holds_back_the_callers():
+    bucket = TokenBucket(100)
+    bucket.pause(0.5)
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+    bucket.pause(0.1)   # Never shortens the pause.
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+
+
+def test_scheduler_waits_for_the_slowest_bucket():
+    scheduler = RequestScheduler({'region': 100, 'profile': 2})
+    keys = [('region', 'na'), ('profile', 'na', 1)]
+
+    assert [scheduler.reserve(keys) for _ in range(2)] == [0, 0]
+    assert scheduler.reserve(keys) == pytest.approx(0.5, abs=0.01)
+    # Other profiles are not held back.
+    assert scheduler.reserve([('region', 'na'), ('profile', 'na', 2)]) == 0
+    assert scheduler.stats['requests'] == 4
+
+    scheduler.throttled(keys, retry_after=2)
+    assert scheduler.get_bucket(keys[1]).rate == 1
+    assert scheduler.get_bucket(keys[0]).rate == 50
+    assert scheduler.reserve(keys) == pytest.approx(2, abs=0.05)
+    assert scheduler.stats['throttled'] == 1
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('5', 5),
+    ('1.5', 1.5),
+    ('-3', 0),
+    ('', None),
+    (None, None),
+    ('soon', None),
+])
+def test_parse_retry_after(value, expected):
+    assert RequestScheduler.parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_date():
+    value = formatdate(time.time() + 30, usegmt=True)
+    assert RequestScheduler.parse_retry_after(value) == pytest.approx(
+        30, abs=1.5)
+    past = formatdate(time.time() - 30, usegmt=True)
+    assert RequestScheduler.parse_retry_after(past) == 0
@@ -0,0 +1,88 @@
+"""
+Tests of ReportBackfill.
+"""
+import threading
+
+from conftest import import_module
+
+report_backfill = import_module('report_backfill')
+report_poller = import_module('report_poller')
+
+ReportBackfill = report_backfill.ReportBackfill
+
+
+class FakeClient(object):
+    """Client whose reports complete on another thread, failing the days
+    of failed_dates."""
+
+    def __init__(self, profile_id, failed_dates=()):
+        self.profile_id = profile_id
+        self.failed_dates = set(failed_dates)
+        self.requested = []
+        self._lock = threading.Lock()
+
+    def submit_report(self, entity_type, report_date, segment=None):
+        with self._lock:
+            self.requested.append((entity_type, report_date))
+        future = report_poller.ReportFuture(report_date)
+        if report_date in self.failed_dates:
+            status, rows = 'FAILURE', []
+        else:
+            status, rows = 'SUCCESS', [{'date': report_date}]
+        threading.Timer(0.01, future.set_result, (rows, status)).start()
+        return future
+
+
+def test_checkpoint_resumes_the_reports_not_completed(tmpdir):
+    checkpoint_path = str(tmpdir.join('checkpoint.jsonl'))
+    clients = [FakeClient(1, failed_dates=['20180102']), FakeClient(2)]
+    handled = []
+
+    def run():
+        return ReportBackfill(
+            clients, ['campaigns', 'keywords'], '20180101', '20180103',
+            lambda *args: handled.append(args[:3]),
+            checkpoint_path=checkpoint_path, max_in_flight=3).run()
+
+    progress = run()
+    assert (progress['total'], progress['completed'],
+            progress['failed']) == (12, 10, 2)
+    assert len(handled) == 10
+    assert clients[1].requested[:2] == [('campaigns', '20180103'),
+                                        ('keywords', '20180103')]
+
+    # A crashed run may leave a partially written line.
+    with open(checkpoint_path, 'a') as f:
+        f.write('{"key": "1|campa')
+    clients[0].failed_dates.clear()
+    del clients[0].requested[:]
+    del clients[1].requested[:]
+    progress = run()
+    assert (progress['total'], progress['completed'],
+            progress['failed']) == (2, 2, 0)
+    assert sorted(clients[0].requested) == [('campaigns', '20180102'),
+                                            ('keywords', '20180102')]
+    assert clients[1].requested == []
+    assert ReportBackfill(
+        clients, ['campaigns', 'keywords'], '20180101', '20180103', None,
+        checkpoint_path=checkpoint_path).plan() == []
+
+
+def test_handler_and_request_errors_count_as_failed():
+    class BrokenClient(FakeClient):
+        def submit_report(self, entity_type, report_date, segment=None):
+            raise IOError('Connection reset.')
+
+    def handler(profile_id, entity_type, report_date, rows):
+        if report_date == '20180101':
+            raise ValueError('Bad row.')
+
+    progress_reports = []
+    progress = ReportBackfill(
+        [FakeClient(1), BrokenClient(2)], ['campaigns'], '20180101',
+        '20180104', handler, max_in_flight=2,
+        progress_callback=progress_reports.append, progress_every=2).run()
+
+    assert (progress['completed'], progress['failed']) == (3, 5)
+    assert progress_reports[-1] == progress
+    assert len(progress_reports) > 1
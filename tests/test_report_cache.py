@@ -0,0 +1,70 @@
+"""
+Tests of ReportCache and ReportCacheWriter.
+"""
+from datetime import datetime
+from datetime import timedelta
+import os
+
+from conftest import import_module
+
+report_cache = import_module('report_cache')
+
+ReportCache = report_cache.ReportCache
+
+ROWS = [{'keywordId': i, 'cost': i / 4.0} for i in range(1000)]
+
+
+def _files(directory):
+    return [name for _, _, names in os.walk(str(directory))
+            for name in names]
+
+
+def test_save_and_load(tmpdir):
+    cache = ReportCache(str(tmpdir))
+    key = ReportCache.get_key(1, 'keywords', '20180101', None, 'cost,clicks')
+
+    assert cache.load(key) is None
+    cache.save(key, ROWS)
+    assert list(cache.load(key)) == ROWS
+    assert cache.stats == {'hits': 1, 'misses': 1, 'saves': 1}
+    # The metrics are in any order.
+    assert ReportCache.get_key(
+        '1', 'keywords', '20180101', None, 'clicks,cost') == key
+    assert ReportCache.get_key(
+        1, 'keywords', '20180102', None, 'cost,clicks') != key
+
+
+def test_empty_report(tmpdir):
+    cache = ReportCache(str(tmpdir))
+    cache.save('key', [])
+    assert list(cache.load('key')) == []
+
+
+def test_aborted_report_is_not_cached(tmpdir):
+    cache = ReportCache(str(tmpdir))
+    writer = cache.open_writer('key')
+    writer.write(ROWS[0])
+    assert cache.load('key') is None     # Not readable until committed.
+    writer.abort()
+
+    assert cache.load('key') is None
+    assert _files(tmpdir) == []
+    assert cache.stats['saves'] == 0
+
+
+def test_failure_to_write_leaves_the_report_uncached(tmpdir):
+    path = tmpdir.join('cache')
+    path.write('not a directory')
+    cache = ReportCache(str(path))
+
+    cache.save('key', ROWS)
+    assert cache.load('key') is None
+    assert cache.stats['saves'] == 0
+
+
+def test_is_final():
+    cache = ReportCache('unused', attribution_days=30)
+    today = datetime.utcnow()
+    assert cache.is_final((today - timedelta(days=31)).strftime('%Y%m%d'))
+    assert not cache.is_final(
+        (today - timedelta(days=29)).strftime('%Y%m%d'))
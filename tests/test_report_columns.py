@@ -0,0 +1,66 @@
+"""
+Tests of ColumnarReport.
+"""
+import pytest
+
+from conftest import import_module
+
+np = pytest.importorskip('numpy')
+report_columns = import_module('report_columns')
+
+ColumnarReport = report_columns.ColumnarReport
+
+METRICS = 'impressions,clicks,cost,attributedSales7d,attributedConversions7d'
+ROWS = [
+    {'campaignId': 10, 'keywordId': 3, 'impressions': 100, 'clicks': 4,
+     'cost': 2.0, 'attributedSales7d': 8.0, 'attributedConversions7d': 1},
+    {'campaignId': 20, 'keywordId': 1, 'impressions': 0, 'clicks': 0,
+     'cost': 0.0, 'attributedSales7d': 0.0, 'attributedConversions7d': 0},
+    {'campaignId': 10, 'keywordId': 2, 'impressions': 50, 'clicks': 1,
+     'cost': None, 'attributedSales7d': 10.0},
+]
+
+
+def _equal(actual, expected):
+    return np.allclose(actual, expected, equal_nan=True)
+
+
+def test_from_rows():
+    report = ColumnarReport.from_rows(ROWS, METRICS)
+
+    assert len(report) == 3
+    assert report.metrics['clicks'].dtype == np.int64
+    assert report.metrics['cost'].dtype == np.float64
+    assert list(report.metrics['cost']) == [2.0, 0.0, 0.0]
+    assert list(report.get_ids('keywordId')) == [3, 1, 2]
+    assert list(report.get_ids('campaignId')) == [10, 20, 10]
+    # ID fields missing from the report are not stored.
+    assert set(report.ids) == set(['campaignId', 'keywordId'])
+
+
+def test_derived_metrics_are_nan_when_undefined():
+    report = ColumnarReport.from_rows(ROWS, METRICS)
+
+    assert _equal(report.ctr(), [0.04, np.nan, 0.02])
+    assert _equal(report.cpc(), [0.5, np.nan, 0.0])
+    assert _equal(report.acos(), [0.25, np.nan, 0.0])
+    assert _equal(report.roas(), [4.0, np.nan, np.nan])
+    assert _equal(report.conversion_rate(), [0.25, np.nan, 0.0])
+    with pytest.raises(ValueError):
+        report.acos(window='14d')
+
+
+def test_aggregate():
+    report = ColumnarReport.from_rows(ROWS, METRICS).aggregate('campaignId')
+
+    assert list(report.get_ids('campaignId')) == [10, 20]
+    assert list(report.metrics['impressions']) == [150, 0]
+    assert report.metrics['impressions'].dtype == np.int64
+    assert list(report.metrics['attributedSales7d']) == [18.0, 0.0]
+    assert _equal(report.ctr(), [5 / 150.0, np.nan])
+
+
+def test_empty_report():
+    report = ColumnarReport.from_rows([], METRICS)
+    assert len(report) == 0
+    assert len(report.ctr()) == 0
@@ -0,0 +1,84 @@
+"""
+Tests of ReportPoller and ReportFuture.
+"""
+import threading
+
+from conftest import import_module
+
+report_poller = import_module('report_poller')
+
+ReportFuture = report_poller.ReportFuture
+ReportPoller = report_poller.ReportPoller
+
+
+def _statuses(*statuses):
+    """Get a get_status callable answering the statuses in turn, the last
+    one from then on."""
+    statuses = list(statuses)
+
+    def get_status():
+        if len(statuses) > 1:
+            return statuses.pop(0)
+        return statuses[0]
+    return get_status
+
+
+def test_report_is_downloaded_once_generated():
+    poller = ReportPoller(min_interval=0.01, max_interval=0.02)
+    future = ReportFuture('r1')
+    poller.add(future, _statuses(('IN_PROGRESS', None),
+                                 ('SUCCESS', 'location')),
+               lambda location: [location])
+
+    assert future.result(5) == ['location']
+    assert future.status == 'SUCCESS'
+
+
+def test_failed_and_timed_out_reports():
+    poller = ReportPoller(min_interval=0.01, max_interval=0.02, timeout=0.05)
+    failed = ReportFuture('failed')
+    poller.add(failed, _statuses(('FAILURE', None)), None)
+    slow = ReportFuture('slow')
+    poller.add(slow, _statuses(('IN_PROGRESS', None)), None)
+
+    assert failed.result(5) == [] and failed.status == 'FAILURE'
+    assert slow.result(5) == [] and slow.status == 'TIMEOUT'
+
+
+def test_download_error_is_raised():
+    poller = ReportPoller(min_interval=0.01)
+    future = ReportFuture('r1')
+
+    def download(location):
+        raise IOError('Connection reset.')
+    poller.add(future, _statuses(('SUCCESS', 'location')), download)
+
+    assert isinstance(future.exception(5), IOError)
+
+
+def test_downloads_do_not_block_status_checks():
+    poller = ReportPoller(workers=1, download_workers=1, min_interval=0.01,
+                          max_interval=0.02)
+    release = threading.Event()
+    large = ReportFuture('large')
+    poller.add(large, _statuses(('SUCCESS', 'large')),
+               lambda location: release.wait(5) and [location])
+    failed = ReportFuture('failed')
+    poller.add(failed, _statuses(('IN_PROGRESS', None),
+                                 ('IN_PROGRESS', None),
+                                 ('FAILURE', None)), None)
+
+    # The report failed while the other one is still downloading.
+    assert failed.result(5) == []
+    assert not large.done()
+    release.set()
+    assert large.result(5) == ['large']
+
+
+def test_done_callbacks():
+    future = ReportFuture('r1')
+    called = []
+    future.add_done_callback(called.append)
+    future.set_result([1])
+    future.add_done_callback(called.append)
+    assert called == [future, future]
@@ -0,0 +1,83 @@
+"""
+Tests of the incremental decoding of gzipped JSON reports.
+"""
+import gzip
+import io
+import json
+
+import pytest
+
+from conftest import import_module
+
+report_stream = import_module('report_stream')
+
+ROWS = [
+    {'keywordId': 1, 'cost': 12.5, 'keywordText': u'caf\xe9 [1], "2"'},
+    {'keywordId': 22, 'cost': 0, 'keywordText': u'\u65e5\u672c'},
+    12345,
+    [],
+    {'keywordId': 333, 'clicks': None},
+]
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _encode(rows):
+    return json.dumps(rows, ensure_ascii=False, indent=1).encode('utf-8')
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_rows_split_across_chunks(size):
+    data = _gzip(_encode(ROWS))
+    assert list(report_stream.iter_gzip_json_array(
+        _chunks(data, size))) == ROWS
+
+
+@pytest.mark.parametrize('size', [1, 5, 100000])
+def test_uncompressed_reports_are_passed_through(size):
+    assert list(report_stream.iter_gzip_json_array(
+        _chunks(_encode(ROWS), size))) == ROWS
+
+
+def test_rows_are_decoded_as_the_chunks_arrive():
+    data = _gzip(json.dumps(list(range(1000))).encode('utf-8'))
+    decoder = report_stream.ReportDecoder()
+    rows = []
+    for chunk in _chunks(data, 64):
+        rows.append(decoder.feed(chunk))
+    rows.append(decoder.close())
+
+    assert [row for chunk_rows in rows for row in chunk_rows] == list(
+        range(1000))
+    assert sum(1 for chunk_rows in rows if chunk_rows) > 2
+
+
+@pytest.mark.parametrize('data', [b'[]', b' [ ] ', b''])
+def test_empty_reports(data):
+    assert list(report_stream.iter_gzip_json_array([_gzip(data)])) == []
+
+
+@pytest.mark.parametrize('data', [b'[1, 2', b'[{"a": 1}, {"a"'])
+def test_truncated_reports_raise(data):
+    with pytest.raises(ValueError):
+        list(report_stream.iter_gzip_json_array(_chunks(_gzip(data), 3)))
+
+
+def test_reports_which_are_not_arrays_raise():
+    with pytest.raises(ValueError):
+        list(report_stream.iter_json_array([b'{"code": "NOT_FOUND"}']))
+
+
+def test_iter_gunzip():
+    data = b'x' * 10000
+    assert b''.join(report_stream.iter_gunzip(
+        _chunks(_gzip(data), 10))) == data
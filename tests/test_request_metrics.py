@@ -0,0 +1,103 @@
+"""
+Tests of RequestMetrics and of the metrics recorded by AdsAPIClient.
+"""
+from conftest import PROFILE_ID
+from conftest import import_module
+
+amazon_ads_api = import_module('amazon_ads_api')
+request_metrics = import_module('request_metrics')
+
+RequestMetrics = request_metrics.RequestMetrics
+
+
+def test_histogram():
+    histogram = request_metrics.Histogram((1, 10))
+    for value in (0.5, 1, 2, 10, 11, 100):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 2, 2]
+    assert histogram.get_cumulative_counts() == [2, 4, 6]
+    assert histogram.sum == 124.5 and histogram.count == 6
+
+
+def test_stats():
+    metrics = RequestMetrics()
+    metrics.record('amazon', 'keywords', 'GET', 200, 0.25,
+                   bytes_received=100, page=0)
+    metrics.record('amazon', 'keywords', 'GET', 200, 0.5,
+                   bytes_received=300, page=1, retries=2)
+    metrics.record('amazon', 'keywords', 'GET', 429, 0.25)
+    metrics.record('google', 'CampaignService', 'mutate', 'OK', 1.0,
+                   bytes_sent=50)
+
+    assert metrics.get_stats() == [{
+        'client': 'amazon', 'service': 'keywords', 'operation': 'GET',
+        'requests': {'200': 2, '429': 1}, 'seconds': 1.0, 'retries': 2,
+        'bytes_sent': 0, 'bytes_received': 400, 'pages': 2,
+    }, {
+        'client': 'google', 'service': 'CampaignService',
+        'operation': 'mutate', 'requests': {'OK': 1}, 'seconds': 1.0,
+        'retries': 0, 'bytes_sent': 50, 'bytes_received': 0, 'pages': 0,
+    }]
+    metrics.reset()
+    assert metrics.get_stats() == []
+
+
+def test_export_prometheus():
+    metrics = RequestMetrics(namespace='test', latency_buckets=(0.1, 1),
+                             size_buckets=(1000, ))
+    metrics.record('amazon', 'keywords', 'GET', 200, 0.5, bytes_received=10)
+    metrics.record('amazon', 'say "hi"\\', 'GET', 500, 2.0)
+
+    lines = metrics.export_prometheus().splitlines()
+    labels = 'client="amazon",service="keywords",operation="GET"'
+    assert '# TYPE test_requests_total counter' in lines
+    assert 'test_requests_total{%s,status="200"} 1' % labels in lines
+    assert 'test_request_received_bytes_total{%s} 10' % labels in lines
+    assert lines.index('# TYPE test_request_duration_seconds histogram') < (
+        lines.index('test_request_duration_seconds_bucket{%s,le="0.1"} 0' %
+                    labels))
+    for line in ('test_request_duration_seconds_bucket{%s,le="1.0"} 1',
+                 'test_request_duration_seconds_bucket{%s,le="+Inf"} 1',
+                 'test_request_duration_seconds_sum{%s} 0.5',
+                 'test_request_duration_seconds_count{%s} 1',
+                 'test_request_response_bytes_bucket{%s,le="1000.0"} 1'):
+        assert line % labels in lines
+    assert ('test_requests_total{client="amazon",service="say \\"hi\\"\\\\",'
+            'operation="GET",status="500"} 1') in lines
+
+
+def test_listeners():
+    metrics = RequestMetrics()
+    calls = []
+
+    def fail(call):
+        raise ValueError('Listener failed.')
+
+    metrics.add_listener(fail)
+    metrics.add_listener(calls.append)
+    metrics.record('amazon', 'keywords', 'GET', 200, 0.1, page=3)
+    metrics.remove_listener(calls.append)
+    metrics.record('amazon', 'keywords', 'GET', 200, 0.1)
+
+    assert len(calls) == 1
+    assert (calls[0]['status'], calls[0]['page']) == (200, 3)
+    assert metrics.get_stats()[0]['requests'] == {'200': 2}
+
+
+def test_client_requests_are_recorded(make_server, make_client,
+                                      monkeypatch):
+    server = make_server(throttle_rate=0.5, retry_after=0.01)
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=25)
+    metrics = RequestMetrics()
+    monkeypatch.setattr(amazon_ads_api.AdsAPIClient, '_metrics', metrics)
+
+    make_client()._get_entities('keywords', page_size=10)
+
+    stats = dict(((s['service'], s['operation']), s)
+                 for s in metrics.get_stats())
+    keywords = stats[('keywords', 'GET')]
+    assert keywords['pages'] == 3
+    assert keywords['requests'] == {'200': 3}
+    assert keywords['retries'] == server.stats.get('GET keywords 429', 0)
+    assert keywords['bytes_received'] > 0
@@ -0,0 +1,117 @@
+"""
+Tests of the token stores and TokenRefresher.
+"""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import import_module
+
+token_store = import_module('token_store')
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def store(request, tmpdir):
+    if request.param == 'file':
+        return token_store.FileTokenStore(str(tmpdir.join('tokens.json')))
+    return token_store.SQLiteTokenStore(str(tmpdir.join('tokens.db')))
+
+
+def test_save_and_load(store):
+    assert store.load('refresh-token') == (None, None)
+    store.save('refresh-token', 'access-token', 100.0)
+    store.save('other-refresh-token', 'other-access-token', 200.0)
+    store.save('refresh-token', 'new-access-token', 300.0)
+
+    assert store.load('refresh-token') == ('new-access-token', 300.0)
+    assert store.load('other-refresh-token') == ('other-access-token', 200.0)
+
+
+def test_refresh_tokens_are_not_stored_in_clear(tmpdir):
+    path = str(tmpdir.join('tokens.json'))
+    token_store.FileTokenStore(path).save('refresh-token', 'access', 1.0)
+
+    with open(path) as f:
+        tokens = json.load(f)
+    assert list(tokens) == [token_store.TokenStore.get_key('refresh-token')]
+
+
+def test_unreadable_file_is_not_stored(tmpdir):
+    path = str(tmpdir.join('tokens.json'))
+    with open(path, 'w') as f:
+        f.write('{"truncated')
+    store = token_store.FileTokenStore(path)
+
+    assert store.load('refresh-token') == (None, None)
+    store.save('refresh-token', 'access-token', 1.0)
+    assert store.load('refresh-token') == ('access-token', 1.0)
+
+
+def test_concurrent_saves_are_atomic(tmpdir):
+    store = token_store.FileTokenStore(str(tmpdir.join('tokens.json')))
+    missing = []
+
+    def save(i):
+        for j in range(20):
+            store.save('refresh-token-%d' % i, 'access-%d-%d' % (i, j), j)
+            # Readers never see a partially written file.
+            if store.load('refresh-token-%d' % i)[0] is None:
+                missing.append(i)
+
+    threads = [threading.Thread(target=save, args=(i, )) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not missing
+    for i in range(4):
+        assert store.load('refresh-token-%d' % i) == ('access-%d-19' % i, 19)
+    # The temporary files are renamed over the store.
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'tokens.json', 'tokens.json.write.lock']
+
+
+@pytest.mark.skipif(token_store.fcntl is None, reason='No advisory locks.')
+def test_lock_is_exclusive(store):
+    events = []
+    locked = threading.Event()
+
+    def refresh():
+        locked.wait(5)
+        with store.lock('refresh-token'):
+            events.append('second')
+
+    thread = threading.Thread(target=refresh)
+    thread.start()
+    with store.lock('refresh-token'):
+        locked.set()
+        time.sleep(0.1)
+        events.append('first')
+    thread.join(5)
+    assert events == ['first', 'second']
+
+
+def test_refresher_runs_jobs_until_removed():
+    refresher = token_store.TokenRefresher(interval=0.01, jitter=0)
+    runs = []
+
+    def fail():
+        raise IOError('Connection reset.')
+
+    refresher.add_job('ok', lambda: runs.append(1))
+    refresher.add_job('failing', fail)
+    time.sleep(0.1)
+    refresher.remove_job('ok')
+    refresher.remove_job('failing')
+    time.sleep(0.05)
+    count = len(runs)
+
+    assert count > 2
+    assert refresher.stats['errors'] > 2
+    time.sleep(0.05)
+    assert len(runs) == count
+    assert refresher._thread is None
@@ -0,0 +1,81 @@
+"""
+Tests of UpdateDiffer.
+"""
+from conftest import PROFILE_ID
+from conftest import import_module
+
+update_diff = import_module('update_diff')
+
+UpdateDiffer = update_diff.UpdateDiffer
+
+
+def test_diff():
+    differ = UpdateDiffer()
+    differ.remember([{'keywordId': 1, 'bid': 0.5, 'state': 'enabled'},
+                     {'keywordId': 2, 'bid': 0.7}])
+
+    assert differ.diff([
+        {'keywordId': 1, 'bid': 0.5 + 1e-9, 'state': 'enabled'},
+        {'keywordId': 2, 'bid': 0.7, 'state': 'paused'},
+        {'keywordId': 3, 'bid': 0.5, 'state': None},
+    ]) == [{'keywordId': 2, 'state': 'paused'},
+           {'keywordId': 3, 'bid': 0.5}]
+    assert differ.stats == {'entities': 3, 'suppressed': 1,
+                            'suppressed_fields': 3}
+
+    differ.forget([1])
+    assert differ.diff([{'keywordId': 1, 'bid': 0.5}]) == [
+        {'keywordId': 1, 'bid': 0.5}]
+
+
+def test_unknown_entities_are_loaded():
+    loaded = []
+
+    def load(ids):
+        loaded.append(ids)
+        return [{'keywordId': i, 'bid': 0.5} for i in ids if i != 3]
+
+    differ = UpdateDiffer(load=load)
+    data = [{'keywordId': i, 'bid': 0.5} for i in (1, 2, 3)]
+    assert differ.diff(data) == [{'keywordId': 3, 'bid': 0.5}]
+    assert differ.diff(data) == [{'keywordId': 3, 'bid': 0.5}]
+    assert loaded == [[1, 2, 3], [3]]
+
+
+def test_update_skips_the_unchanged_entities(make_server, make_client):
+    server = make_server()
+    server.populate(PROFILE_ID, campaigns=1, adgroups=1, keywords=3)
+    client = make_client()
+    keywords = server.get_entities(PROFILE_ID, 'keywords')
+    ids = [k['keywordId'] for k in keywords]
+    differ = UpdateDiffer()
+    differ.remember(keywords)
+
+    results = differ.update(client, 'keywords', [
+        {'keywordId': ids[0], 'bid': keywords[0]['bid']},
+        {'keywordId': ids[1], 'bid': 1.25}])
+    assert results == [{'code': 'SUCCESS', 'keywordId': ids[0]},
+                       {'code': 'SUCCESS', 'keywordId': ids[1]}]
+    assert server.stats['PUT keywords 207'] == 1
+    assert server.get_entities(PROFILE_ID, 'keywords')[1]['bid'] == 1.25
+
+    # The known state follows the updates sent.
+    differ.update(client, 'keywords', [{'keywordId': ids[1], 'bid': 1.25}])
+    assert server.stats['PUT keywords 207'] == 1
+
+
+def test_failed_updates_are_forgotten():
+    class FakeClient(object):
+        def _update_entities(self, entity_type, data):
+            return [{'code': 'INVALID_ARGUMENT', 'keywordId': d['keywordId']}
+                    for d in data]
+
+    differ = UpdateDiffer()
+    differ.remember([{'keywordId': 1, 'bid': 0.5}])
+    results = differ.update(FakeClient(), 'keywords',
+                            [{'keywordId': 1, 'bid': 0.1}])
+
+    assert results[0]['code'] == 'INVALID_ARGUMENT'
+    # The bid is sent again, whatever the state of the keyword is now.
+    assert differ.diff([{'keywordId': 1, 'bid': 0.5}]) == [
+        {'keywordId': 1, 'bid': 0.5}]
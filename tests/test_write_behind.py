@@ -0,0 +1,104 @@
+"""
+Tests of WriteBehindQueue.
+"""
+import threading
+import time
+
+import pytest
+
+from conftest import import_module
+
+write_behind = import_module('write_behind')
+
+WriteBehindQueue = write_behind.WriteBehindQueue
+
+
+class FakeClient(object):
+    """Client recording the batches of updates sent."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def _update_entities(self, entity_type, data):
+        with self._lock:
+            self.batches.append((time.time(), [dict(d) for d in data]))
+        if self.error:
+            raise self.error
+        return [{'code': 'SUCCESS', 'keywordId': d['keywordId']}
+                for d in data]
+
+
+def test_updates_are_coalesced():
+    client = FakeClient()
+    queue = WriteBehindQueue(client, flush_interval=0.05)
+
+    first = queue.put({'keywordId': 1, 'bid': 0.5, 'state': 'enabled'})
+    queue.put({'keywordId': 2, 'bid': 0.7})
+    last = queue.update_keywords([1], bid=0.6)[0]
+    assert queue.pending() == 2
+    assert queue.flush(5)
+
+    # One request, in the order of the first writes, the last write of a
+    # field winning.
+    assert [data for _, data in client.batches] == [[
+        {'keywordId': 1, 'bid': 0.6, 'state': 'enabled'},
+        {'keywordId': 2, 'bid': 0.7}]]
+    assert first.result(0) == last.result(0) == {
+        'code': 'SUCCESS', 'keywordId': 1}
+    assert queue.stats == {'updates': 3, 'coalesced': 1, 'sent': 2,
+                           'flushes': 1}
+    assert queue.close(5)
+    with pytest.raises(RuntimeError):
+        queue.put({'keywordId': 1, 'bid': 0.5})
+
+
+def test_full_batches_are_sent_right_away():
+    client = FakeClient()
+    queue = WriteBehindQueue(client, batch_size=10, flush_interval=60,
+                             max_staleness=60)
+
+    futures = queue.update_keywords_v2(
+        [{'keywordId': i, 'bid': 0.5} for i in range(25)])
+    futures[19].result(5)
+    assert [len(data) for _, data in client.batches] == [20]
+    assert queue.pending() == 5
+    assert not futures[20].done()
+    queue.close(5)
+    assert futures[24].result(0)['keywordId'] == 24
+
+
+def test_updates_are_sent_once_stale():
+    client = FakeClient()
+    queue = WriteBehindQueue(client, flush_interval=0.1, max_staleness=0.3)
+
+    start_time = time.time()
+    # The writes never pause for flush_interval.
+    while not client.batches and time.time() - start_time < 5:
+        queue.put({'keywordId': 1, 'bid': 0.5})
+        time.sleep(0.02)
+    assert 0.25 <= client.batches[0][0] - start_time < 1
+    queue.close(5)
+
+
+def test_failed_requests_raise_from_the_futures():
+    queue = WriteBehindQueue(FakeClient(error=IOError('Connection reset.')),
+                             flush_interval=0.01)
+
+    futures = [queue.put({'keywordId': 1, 'bid': 0.5}),
+               queue.put({'keywordId': 1, 'state': 'paused'})]
+    for future in futures:
+        with pytest.raises(IOError):
+            future.result(5)
+    assert queue.close(5)
+    assert queue.stats['sent'] == 0
+
+
+def test_unsent_update_times_out():
+    queue = WriteBehindQueue(FakeClient(), flush_interval=60)
+    future = queue.put({'keywordId': 1, 'bid': 0.5})
+    with pytest.raises(RuntimeError):
+        future.result(0.01)
+    assert not queue.flush(0)
+    queue.close(5)
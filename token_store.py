@@ -0,0 +1,269 @@
+"""
+Token stores shared by the API clients of multiple processes.
+
+A store persists access tokens keyed by refresh token and provides an
+advisory lock, so that worker processes reuse each other's tokens and only
+one of them refreshes an expired token. TokenRefresher renews tokens in
+the background ahead of their expiry.
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows.
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore(object):
+    """Base class of token stores.
+
+    Subclasses implement load() and save(); lock() serializes token refresh
+    across processes via an advisory lock file.
+    """
+
+    def __init__(self, lock_path):
+        """
+        Args:
+            lock_path: string, path of the advisory lock file.
+        """
+        self.lock_path = lock_path
+
+    @staticmethod
+    def get_key(refresh_token):
+        """Get the store key of a refresh token, which is not kept in clear.
+
+        Args:
+            refresh_token: string.
+
+        Returns:
+            A hex digest string.
+        """
+        return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+    def load(self, refresh_token):
+        """Load the access token of the refresh token.
+
+        Args:
+            refresh_token: string.
+
+        Returns:
+            Access token and token time (UTC), (None, None) if not stored.
+        """
+        raise NotImplementedError
+
+    def save(self, refresh_token, access_token, token_time):
+        """Save the access token of the refresh token.
+
+        Args:
+            refresh_token: string.
+            access_token: string.
+            token_time: float, in UTC time.
+        """
+        raise NotImplementedError
+
+    def lock(self, refresh_token):
+        """Hold the exclusive advisory lock of the store.
+
+        Args:
+            refresh_token: string, the token to be refreshed under the lock.
+        """
+        return self._flock(self.lock_path)
+
+    @staticmethod
+    @contextmanager
+    def _flock(lock_path):
+        """Hold an exclusive advisory lock on the lock file."""
+        if fcntl is None:
+            yield
+            return
+
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class FileTokenStore(TokenStore):
+    """Token store backed by a local JSON file."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: string, path of the JSON file.
+        """
+        super(FileTokenStore, self).__init__(path + '.lock')
+        self.path = path
+
+    def load(self, refresh_token):
+        try:
+            with open(self.path) as f:
+                tokens = json.load(f)
+        except (IOError, OSError, ValueError):
+            return (None, None)
+
+        token = tokens.get(self.get_key(refresh_token))
+        if not token:
+            return (None, None)
+        return (token['access_token'], token['token_time'])
+
+    def save(self, refresh_token, access_token, token_time):
+        # Serialize writers apart from the refresh lock, which may be held
+        # by the caller.
+        with self._flock(self.path + '.write.lock'):
+            try:
+                with open(self.path) as f:
+                    tokens = json.load(f)
+            except (IOError, OSError, ValueError):
+                tokens = {}
+
+            tokens[self.get_key(refresh_token)] = {
+                'access_token': access_token,
+                'token_time': token_time,
+            }
+            # Replace the file atomically so readers never see partial data.
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+            os.rename(tmp_path, self.path)
+
+
+class SQLiteTokenStore(TokenStore):
+    """Token store backed by a local SQLite database."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: string, path of the SQLite database file.
+        """
+        super(SQLiteTokenStore, self).__init__(path + '.lock')
+        self.path = path
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS access_tokens ('
+                    'key TEXT PRIMARY KEY, access_token TEXT, '
+                    'token_time REAL)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Open a connection, one per call to be safe across threads."""
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, refresh_token):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT access_token, token_time FROM access_tokens '
+                'WHERE key = ?', (self.get_key(refresh_token), )).fetchone()
+        except sqlite3.Error:
+            logger.exception('Failed to load access token.')
+            row = None
+        finally:
+            conn.close()
+        return tuple(row) if row else (None, None)
+
+    def save(self, refresh_token, access_token, token_time):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO access_tokens '
+                    '(key, access_token, token_time) VALUES (?, ?, ?)',
+                    (self.get_key(refresh_token), access_token, token_time))
+        finally:
+            conn.close()
+
+
+class TokenRefresher(object):
+    """Background thread which runs token refresh jobs periodically.
+
+    Each job decides by itself whether its token is close enough to expiry
+    to be renewed, so that requests only read tokens which are still valid.
+    """
+
+    def __init__(self, interval=60, jitter=0.2):
+        """
+        Args:
+            interval: int, seconds between two runs of the jobs.
+            jitter: float, random fraction of the interval added to or
+                subtracted from it, so processes do not refresh in lockstep.
+        """
+        self.interval = interval
+        self.jitter = jitter
+        self.stats = {'runs': 0, 'errors': 0, 'refresh_seconds': 0.0}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_job(self, key, job):
+        """Add a refresh job and start the thread if not running.
+
+        Args:
+            key: hashable, identity of the job, e.g., the refresh token.
+            job: callable without arguments, refreshes the token if needed.
+        """
+        with self._lock:
+            self._jobs[key] = job
+            # The thread checks _stopped under the lock before exiting, so
+            # a running thread keeps running the new job.
+            self._stopped.clear()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='TokenRefresher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def remove_job(self, key):
+        """Remove a refresh job; stop the thread when no job is left.
+
+        Args:
+            key: hashable, identity of the job.
+        """
+        with self._lock:
+            self._jobs.pop(key, None)
+            if not self._jobs:
+                self._stopped.set()
+
+    def stop(self):
+        """Remove all jobs and stop the thread."""
+        with self._lock:
+            self._jobs.clear()
+            self._stopped.set()
+
+    def _run(self):
+        """Run the jobs every interval until stopped."""
+        while True:
+            self._stopped.wait(self.interval * (
+                1 + random.uniform(-self.jitter, self.jitter)))
+            with self._lock:
+                if self._stopped.is_set():
+                    self._thread = None
+                    return
+                jobs = list(self._jobs.values())
+            for job in jobs:
+                start_time = time.time()
+                try:
+                    job()
+                except Exception:
+                    logger.exception('Failed to refresh token.')
+                    self.stats['errors'] += 1
+                self.stats['runs'] += 1
+                self.stats['refresh_seconds'] += time.time() - start_time
@@ -0,0 +1,142 @@
+"""
+No-op elimination of entity updates.
+
+Most bid recalculations end up with the bid already set. An UpdateDiffer
+compares the requested updates with the last known state of the entities,
+from the local EntityStore or a recent fetch, drops the fields which would
+not change and skips the entities with nothing left to update.
+"""
+import numbers
+import threading
+
+
+class UpdateDiffer(object):
+    """Diff entity updates against the last known state of the entities.
+
+    The known state of an entity can be partial, a field not known is always
+    sent. The state follows the updates sent successfully through update().
+    """
+
+    # Numbers closer than this are equal, e.g., bids computed as floats.
+    TOLERANCE = 1e-6
+
+    def __init__(self, id_field='keywordId', load=None):
+        """
+        Args:
+            id_field: string, ID field of the entities, e.g., 'keywordId'.
+            load: callable, takes a list of IDs of entities not known yet,
+                returns the entities found, e.g.,
+                lambda ids: store.get_keywords(profile_id, keyword_ids=ids).
+        """
+        self.id_field = id_field
+        self.load = load
+        self.stats = {'entities': 0, 'suppressed': 0, 'suppressed_fields': 0}
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def remember(self, entities):
+        """Set the known state of entities, e.g., just fetched.
+
+        Args:
+            entities: dict[], entities with the ID field.
+        """
+        with self._lock:
+            for entity in entities:
+                self._known[entity[self.id_field]] = dict(entity)
+
+    def forget(self, entity_ids=None):
+        """Drop the known state of entities, all by default."""
+        with self._lock:
+            if entity_ids is None:
+                self._known.clear()
+            for entity_id in entity_ids or ():
+                self._known.pop(entity_id, None)
+
+    def diff(self, data):
+        """Drop the fields and entities which would not change.
+
+        Args:
+            data: dict[], updates with the ID field; fields set to None are
+                dropped too.
+
+        Returns:
+            A list of the updates to send, with the changed fields only.
+        """
+        if self.load:
+            with self._lock:
+                missing = [update[self.id_field] for update in data
+                           if update[self.id_field] not in self._known]
+            if missing:
+                self.remember(self.load(missing))
+
+        changes = []
+        suppressed_fields = 0
+        with self._lock:
+            for update in data:
+                entity_id = update[self.id_field]
+                known = self._known.get(entity_id, {})
+                change = {}
+                for field, value in update.items():
+                    if field == self.id_field or value is None:
+                        continue
+                    if field in known and self._is_same(known[field], value):
+                        suppressed_fields += 1
+                    else:
+                        change[field] = value
+                if change:
+                    change[self.id_field] = entity_id
+                    changes.append(change)
+            self.stats['entities'] += len(data)
+            self.stats['suppressed'] += len(data) - len(changes)
+            self.stats['suppressed_fields'] += suppressed_fields
+        return changes
+
+    def _is_same(self, known, value):
+        if (isinstance(known, numbers.Number) and
+                isinstance(value, numbers.Number)):
+            return abs(known - value) < self.TOLERANCE
+        return known == value
+
+    def update(self, client, entity_type, data):
+        """Send the updates which change something, refer to
+        AdsAPIClient._update_entities().
+
+        Args:
+            client: AdsAPIClient.
+            entity_type: string, type of the entities, e.g., 'keywords'.
+            data: dict[], updates with the ID field.
+
+        Returns:
+            A list of per-entity results in the order of the data; entities
+            skipped get a SUCCESS result.
+        """
+        changes = self.diff(data)
+        results = []
+        if changes:
+            results = client._update_entities(entity_type, changes)
+        self.remember_results(changes, results)
+
+        results_by_id = dict(
+            (change[self.id_field], result)
+            for change, result in zip(changes, results))
+        return [
+            results_by_id.get(update[self.id_field]) or
+            {'code': 'SUCCESS', self.id_field: update[self.id_field]}
+            for update in data]
+
+    def remember_results(self, changes, results):
+        """Apply the updates sent successfully to the known state.
+
+        Args:
+            changes: dict[], updates sent.
+            results: dict[], per-entity results of the updates.
+        """
+        with self._lock:
+            for change, result in zip(changes, results):
+                if not (isinstance(result, dict) and
+                        result.get('code') == 'SUCCESS'):
+                    # The state is unknown after a failure, fetch it again.
+                    self._known.pop(change[self.id_field], None)
+                    continue
+                self._known.setdefault(
+                    change[self.id_field], {}).update(change)
@@ -0,0 +1,270 @@
+"""
+Write-behind buffer of entity updates.
+
+Bidding logic often updates the same keyword many times per cycle, and all
+but the last update are sent for nothing. A WriteBehindQueue holds the
+updates in front of AdsAPIClient._update_entities(), merges the pending
+updates of each entity field by field (the last write of a field wins), and
+sends them later in full batches. Callers get an UpdateFuture per update,
+resolved with the per-entity result of the request which sent it.
+"""
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from .amazon_ads_api import AdsAPIClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateFuture(object):
+    """Pending per-entity result of an update."""
+
+    def __init__(self, entity_id):
+        """
+        Args:
+            entity_id: long, ID of the updated entity.
+        """
+        self.entity_id = entity_id
+        self._result = None
+        self._exception = None
+        self._done = threading.Event()
+
+    def done(self):
+        """Check if the update is sent."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the update to be sent.
+
+        Args:
+            timeout: float, seconds to wait, None to wait until done.
+
+        Returns:
+            The per-entity result, e.g., {'code': 'SUCCESS', 'keywordId': 1}.
+
+        Raises:
+            The exception raised while sending the update.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Update of %s is not sent.' % self.entity_id)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+
+class WriteBehindQueue(object):
+    """Coalesce the updates of entities and send them in the background.
+
+    The pending updates are sent by one thread, in the order of their first
+    write:
+        - in full batches, as soon as batch_size entities are pending;
+        - all of them, once no update came for flush_interval seconds, or
+          once the oldest pending update waited for max_staleness seconds.
+    Updates are sent one request after another, so the updates of an entity
+    are never reordered.
+    """
+
+    def __init__(self, client, entity_type='keywords', id_field='keywordId',
+                 batch_size=AdsAPIClient._BATCH_SIZE, flush_interval=1.0,
+                 max_staleness=10.0, differ=None):
+        """
+        Args:
+            client: AdsAPIClient, sends the updates.
+            entity_type: string, type of the entities, e.g., 'keywords'.
+            id_field: string, ID field of the entities, e.g., 'keywordId'.
+            batch_size: int, entities per batch sent.
+            flush_interval: float, seconds without updates before sending
+                the pending ones.
+            max_staleness: float, maximum seconds an update is held.
+            differ: UpdateDiffer, if set, the updates which would not change
+                anything are not sent.
+        """
+        self.client = client
+        self.entity_type = entity_type
+        self.id_field = id_field
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_staleness = max_staleness
+        self.differ = differ
+        self.stats = {'updates': 0, 'coalesced': 0, 'sent': 0, 'flushes': 0}
+        # Pending updates keyed by entity ID, in the order of their first
+        # write: [merged update, futures, time of the first write].
+        self._pending = OrderedDict()
+        self._last_write_time = None
+        self._flushing = 0      # Number of updates being sent.
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def put(self, update):
+        """Queue the update of an entity.
+
+        Args:
+            update: dict, fields to update with the ID field, fields set to
+                None are left unchanged, e.g., {'keywordId': 1, 'bid': 0.5}.
+
+        Returns:
+            An UpdateFuture, resolved once the update is sent.
+        """
+        entity_id = update[self.id_field]
+        future = UpdateFuture(entity_id)
+        fields = dict((k, v) for k, v in update.items() if v is not None)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Write-behind queue is closed.')
+            now = time.time()
+            pending = self._pending.get(entity_id)
+            if pending is None:
+                self._pending[entity_id] = [fields, [future], now]
+            else:
+                pending[0].update(fields)
+                pending[1].append(future)
+                self.stats['coalesced'] += 1
+            self.stats['updates'] += 1
+            self._last_write_time = now
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='WriteBehindQueue')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def update_keywords(self, keyword_ids, bid=None, state=None):
+        """Queue the update of keywords, refer to
+        AdsAPIClient.update_keywords().
+
+        Returns:
+            A list of UpdateFuture in the order of the keyword IDs.
+        """
+        bid = max(float(bid), AdsAPIClient.MIN_BID) if bid else None
+        return [self.put({'keywordId': k_id, 'bid': bid, 'state': state})
+                for k_id in keyword_ids]
+
+    def update_keywords_v2(self, data):
+        """Queue the update of keywords, refer to
+        AdsAPIClient.update_keywords_v2().
+
+        Returns:
+            A list of UpdateFuture in the order of the data.
+        """
+        return [self.put(keyword) for keyword in data]
+
+    def pending(self):
+        """Get the number of entities with pending updates."""
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, timeout=None):
+        """Send all the pending updates and wait until they are sent.
+
+        Args:
+            timeout: float, seconds to wait, None to wait until sent.
+
+        Returns:
+            True if all the updates are sent, False on timeout.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            # Make all the pending updates due.
+            self._last_write_time = 0
+            self._cond.notify_all()
+            while self._pending or self._flushing:
+                wait = deadline - time.time() if deadline else None
+                if wait is not None and wait <= 0:
+                    return False
+                self._cond.wait(wait)
+        return True
+
+    def close(self, timeout=None):
+        """Send the pending updates and stop the thread.
+
+        Args:
+            timeout: float, seconds to wait, None to wait until sent.
+
+        Returns:
+            True if all the updates are sent, False on timeout.
+        """
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return flushed
+
+    def _get_due_updates(self, now):
+        """Get the updates due, and the seconds to wait if none is.
+
+        Returns:
+            A list of (entity ID, [update, futures, time]), and the seconds
+            until the next updates are due, None if nothing is pending.
+        """
+        if not self._pending:
+            return [], None
+        count = 0
+        if len(self._pending) >= self.batch_size:
+            count = len(self._pending) // self.batch_size * self.batch_size
+        oldest = next(iter(self._pending.values()))[2]
+        due_time = min(self._last_write_time + self.flush_interval,
+                       oldest + self.max_staleness)
+        if due_time <= now:
+            count = len(self._pending)
+        if not count:
+            return [], due_time - now
+        return [self._pending.popitem(last=False) for _ in range(count)], 0
+
+    def _run(self):
+        """Send the updates as they become due until closed."""
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    updates, wait = self._get_due_updates(time.time())
+                    if updates:
+                        break
+                    self._cond.wait(wait)
+                self._flushing = len(updates)
+            try:
+                self._send(updates)
+            finally:
+                with self._cond:
+                    self._flushing = 0
+                    self._cond.notify_all()
+
+    def _send(self, updates):
+        """Send updates and resolve their futures."""
+        data = []
+        for entity_id, (fields, _, _) in updates:
+            fields[self.id_field] = entity_id
+            data.append(fields)
+        try:
+            if self.differ:
+                results = self.differ.update(
+                    self.client, self.entity_type, data)
+            else:
+                results = self.client._update_entities(
+                    self.entity_type, data)
+        except Exception as e:
+            logger.exception('Failed to update %d %s.', len(data),
+                             self.entity_type)
+            for _, (_, futures, _) in updates:
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        self.stats['sent'] += len(data)
+        self.stats['flushes'] += 1
+        for (_, (_, futures, _)), result in zip(updates, results):
+            for future in futures:
+                future.set_result(result)